@@ -10,24 +10,3800 @@ import sys
 import math
 import re
 import shutil
-import tempfile
 import requests
 import json
+import argparse
+import queue
+import hashlib
+import shlex
+import tempfile
+import ipaddress
+import socket
+import collections
+import itertools
+import random
+import selectors
+import struct
+import errno
+import mmap
+import csv
+import array
+import fcntl
+import concurrent.futures
 import webbrowser
 import pwd
 
-def check_root():
-    """Check if running with root privileges"""
-    if os.geteuid() != 0:
-        # Silently restart with elevated privileges
+def check_root():
+    """Check if running with root privileges"""
+    if os.geteuid() != 0:
+        # Silently restart with elevated privileges
+        try:
+            # Use pkexec and pass GUI env so the window can open as root
+            display = os.environ.get('DISPLAY', '')
+            xauth = os.environ.get('XAUTHORITY', '')
+            args = ['pkexec', 'env', f'DISPLAY={display}', f'XAUTHORITY={xauth}', sys.executable] + sys.argv
+            os.execvp('pkexec', args)
+        except Exception as e:
+            sys.exit(1)
+
+def run_firewall_cmd(argv, timeout=10, ignore_errors=False, stdin=None, stdout=None, input=None):
+    """Run a firewall command without a shell; True on success"""
+    try:
+        cp = subprocess.run(
+            argv,
+            capture_output=(stdout is None and stdin is None),
+            text=True,
+            timeout=timeout,
+            stdin=stdin,
+            stdout=stdout,
+            input=input,
+        )
+        if cp.returncode != 0 and not ignore_errors:
+            return False
+        return True
+    except FileNotFoundError:
+        return False if not ignore_errors else True
+    except Exception:
+        return False if not ignore_errors else True
+
+
+DNS_TYPE_A = 1
+DNS_TYPE_AAAA = 28
+
+
+def read_resolv_conf_nameservers(path="/etc/resolv.conf"):
+    """Return the nameserver addresses listed in resolv.conf"""
+    servers = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    servers.append(parts[1])
+    except OSError:
+        pass
+    return servers
+
+
+def _skip_dns_name(packet, offset):
+    """Return the offset just past a (possibly compressed) DNS name"""
+    while True:
+        length = packet[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+
+
+def query_dns(name, qtype, server, timeout=2.0, port=53):
+    """Send one recursive DNS query over UDP.
+
+    Returns a list of (address, ttl) tuples for the A/AAAA records in the
+    answer section (CNAME chains are followed by the server). Raises OSError
+    on timeouts, malformed or failed responses and names that are not valid
+    DNS names (empty labels, labels over 63 characters).
+    """
+    qid = int.from_bytes(os.urandom(2), "big")
+    header = qid.to_bytes(2, "big") + b"\x01\x00" + b"\x00\x01" + b"\x00\x00" * 3
+    try:
+        labels = name.rstrip(".").encode("idna").split(b".")
+    except UnicodeError as e:
+        raise OSError(f"Invalid DNS name {name!r}") from e
+    qname = b"".join(len(label).to_bytes(1, "big") + label for label in labels) + b"\x00"
+    question = qname + qtype.to_bytes(2, "big") + b"\x00\x01"
+
+    family = socket.AF_INET6 if ":" in server else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(header + question, (server, port))
+        while True:
+            packet, _ = sock.recvfrom(4096)
+            if len(packet) >= 12 and int.from_bytes(packet[:2], "big") == qid:
+                break
+
+    rcode = packet[3] & 0x0F
+    if rcode == 3:
+        return []
+    if rcode != 0:
+        raise OSError(f"DNS server {server} returned rcode {rcode}")
+    try:
+        qdcount = int.from_bytes(packet[4:6], "big")
+        ancount = int.from_bytes(packet[6:8], "big")
+        offset = 12
+        for _ in range(qdcount):
+            offset = _skip_dns_name(packet, offset) + 4
+        records = []
+        for _ in range(ancount):
+            offset = _skip_dns_name(packet, offset)
+            rtype = int.from_bytes(packet[offset:offset + 2], "big")
+            ttl = int.from_bytes(packet[offset + 4:offset + 8], "big")
+            rdlength = int.from_bytes(packet[offset + 8:offset + 10], "big")
+            rdata = packet[offset + 10:offset + 10 + rdlength]
+            offset += 10 + rdlength
+            if rtype == DNS_TYPE_A and rdlength == 4:
+                records.append((str(ipaddress.IPv4Address(rdata)), ttl))
+            elif rtype == DNS_TYPE_AAAA and rdlength == 16:
+                records.append((str(ipaddress.IPv6Address(rdata)), ttl))
+        return records
+    except (IndexError, ValueError) as e:
+        raise OSError(f"Malformed DNS response from {server}") from e
+
+
+class RemoteResolver:
+    """Concurrent, TTL-respecting resolver for `remote` hostnames.
+
+    All hosts (and both A and AAAA) are looked up in parallel on a thread
+    pool, so the cost of resolving a profile is one round trip rather than
+    one per host. Answers are cached for their DNS TTL; when a refresh fails
+    the last known addresses are served instead, which keeps the killswitch
+    buildable once port 53 is already blocked.
+    """
+
+    def __init__(self, max_workers=16, timeout=2.0, default_ttl=300, min_ttl=30, max_ttl=86400):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, host):
+        """Resolve one host; returns (addresses, ttl)"""
+        addresses = []
+        ttls = []
+        for server in read_resolv_conf_nameservers()[:2]:
+            try:
+                for qtype in (DNS_TYPE_A, DNS_TYPE_AAAA):
+                    for address, ttl in query_dns(host, qtype, server, timeout=self.timeout):
+                        if address not in addresses:
+                            addresses.append(address)
+                        ttls.append(ttl)
+                break
+            except OSError:
+                addresses, ttls = [], []
+                continue
+        if not addresses:
+            # Fall back to the system resolver (search domains, /etc/hosts,
+            # NSS); it does not expose TTLs, so use the default
+            infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_UDP)
+            for info in infos:
+                address = info[4][0].split("%")[0]
+                if address not in addresses:
+                    addresses.append(address)
+            ttls = [self.default_ttl]
+        ttl = max(self.min_ttl, min(self.max_ttl, min(ttls)))
+        return addresses, ttl
+
+    def _resolve_cached(self, host, now):
+        with self._lock:
+            entry = self._cache.get(host)
+        if entry and entry[0] > now:
+            return entry[1]
+        try:
+            addresses, ttl = self._lookup(host)
+        except (OSError, UnicodeError, ValueError):
+            # Unresolvable, or a malformed name (a typo in one remote must
+            # not take the other servers down with it)
+            addresses, ttl = [], 0
+        if not addresses:
+            # Serve stale rather than lose the server entirely
+            return entry[1] if entry else []
+        with self._lock:
+            self._cache[host] = (now + ttl, addresses)
+        return addresses
+
+    def resolve_all(self, hosts):
+        """Resolve hosts concurrently into an ordered, de-duplicated address list.
+
+        Literal addresses and CIDRs pass through untouched.
+        """
+        results = {}
+        pending = []
+        for host in hosts:
+            try:
+                ipaddress.ip_network(host, strict=False)
+                results[host] = [host]
+            except ValueError:
+                pending.append(host)
+
+        if pending:
+            now = time.monotonic()
+            workers = max(1, min(self.max_workers, len(pending)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                for host, addresses in zip(pending, pool.map(lambda h: self._resolve_cached(h, now), pending)):
+                    results[host] = addresses
+
+        resolved = []
+        for host in hosts:
+            for address in results.get(host, []):
+                if address not in resolved:
+                    resolved.append(address)
+        return resolved
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def _location(city, country):
+    country = country or "Unknown"
+    return f"{city}, {country}" if city else country
+
+
+def parse_ipapi_response(body):
+    data = json.loads(body)
+    return data.get("ip"), _location(data.get("city"), data.get("country_name"))
+
+
+def parse_ipinfo_response(body):
+    data = json.loads(body)
+    return data.get("ip"), _location(data.get("city"), data.get("country"))
+
+
+def parse_echo_response(body):
+    """A bare address (like icanhazip) or JSON with an "ip" key; no location"""
+    text = body.strip()
+    if text.startswith("{"):
+        data = json.loads(text)
+        return data.get("ip"), _location(data.get("city"), data.get("country"))
+    return text, "Unknown"
+
+
+class IpInfoProvider:
+    """One public-IP endpoint: `parse(body)` returns (ip, location)"""
+
+    __slots__ = ("name", "url", "parse")
+
+    def __init__(self, name, url, parse=parse_echo_response):
+        self.name = name
+        self.url = url
+        self.parse = parse
+
+
+IP_INFO_PROVIDERS = (
+    IpInfoProvider("ipapi.co", "https://ipapi.co/json/", parse_ipapi_response),
+    IpInfoProvider("ipinfo.io", "https://ipinfo.io/json", parse_ipinfo_response),
+)
+# Plain address echoes: with an offline geoip database the location is
+# looked up locally, so no geolocation service needs to see the address
+IP_ECHO_PROVIDERS = (
+    IpInfoProvider("icanhazip.com", "https://icanhazip.com/"),
+    IpInfoProvider("ipify.org", "https://api.ipify.org/"),
+)
+
+
+class IpLookupService:
+    """Public IP/location lookup that races every provider at once.
+
+    All providers are queried concurrently over one pooled requests.Session
+    (keep-alive and TLS session reuse across lookups) and the first valid
+    answer wins, so a slow or dead provider costs nothing while another one
+    answers. Results are cached for `ttl` seconds; invalidate() drops the
+    cache (call it whenever the tunnel state changes) and a lookup that
+    straddles an invalidation is not cached. With a GeoIpDatabase the
+    location comes from it rather than from the provider, and the default
+    providers are IP_ECHO_PROVIDERS instead of IP_INFO_PROVIDERS.
+    """
+
+    def __init__(self, providers=None, ttl=300.0, timeout=5.0, session=None, geoip=None,
+                 workers=8):
+        if providers is None:
+            providers = IP_ECHO_PROVIDERS if geoip is not None else IP_INFO_PROVIDERS
+        self.providers = list(providers)
+        self.geoip = geoip
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = session or self._make_session(len(self.providers))
+        self.last_provider = None
+        self.last_latency = None
+        self._cache = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ip-lookup")
+
+    @staticmethod
+    def _make_session(providers):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max(4, providers), pool_maxsize=4)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def add_provider(self, provider, first=False):
+        """Plug in another provider (e.g. a self-hosted echo endpoint)"""
+        with self._lock:
+            if first:
+                self.providers.insert(0, provider)
+            else:
+                self.providers.append(provider)
+
+    def invalidate(self):
+        with self._lock:
+            self._cache = None
+            self._generation += 1
+
+    def cached(self):
+        """The cached (ip, location) if still fresh, else None"""
+        with self._lock:
+            if self._cache is not None and self._cache[0] > time.monotonic():
+                return self._cache[1]
+        return None
+
+    def _query(self, provider, answered):
+        # A worker freed by the winner must not start a loser still queued
+        if answered.is_set():
+            raise concurrent.futures.CancelledError()
+        response = self.session.get(provider.url, timeout=self.timeout)
+        response.raise_for_status()
+        ip, location = provider.parse(response.text)
+        # Only a real address counts as an answer
+        ip = str(ipaddress.ip_address(str(ip).strip()))
+        if self.geoip is not None:
+            location = self.geoip.lookup(ip) or location
+        answered.set()
+        return ip, location
+
+    def lookup(self, force=False):
+        """(ip, location) from the cache or the first provider to answer; None if all fail"""
+        if not force:
+            result = self.cached()
+            if result is not None:
+                return result
+        with self._lock:
+            providers = list(self.providers)
+            generation = self._generation
+        start = time.monotonic()
+        answered = threading.Event()
+        futures = {self._pool.submit(self._query, provider, answered): provider for provider in providers}
+        result = None
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=self.timeout + 1):
+                try:
+                    result = future.result()
+                except Exception:
+                    continue
+                self.last_provider = futures[future].name
+                self.last_latency = time.monotonic() - start
+                break
+        except concurrent.futures.TimeoutError:
+            pass
+        # Losers in flight finish in the background; the rest never start
+        answered.set()
+        for future in futures:
+            future.cancel()
+        if result is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._cache = (time.monotonic() + self.ttl, result)
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+
+GEOIP_MAGIC = b"AGEO"
+GEOIP_VERSION = 1
+# magic, version, reserved, IPv4 records, IPv6 records, location names
+_GEOIP_HEADER = struct.Struct(">4sHHIII")
+# start, end, location index
+_GEOIP_V4 = struct.Struct(">III")
+# start (hi, lo), end (hi, lo), location index
+_GEOIP_V6 = struct.Struct(">QQQQI")
+_GEOIP_OFFSET = struct.Struct(">I")
+_U64 = (1 << 64) - 1
+
+
+def _geoip_ranges(reader, locations):
+    """(version, start, end, location) rows of a range or CIDR geo CSV.
+
+    Handles DB-IP style `start,end,country` / `start,end,continent,
+    country,region,city,...` rows and GeoLite2 style `network,geoname_id,...`
+    blocks (with `locations` mapping geoname_id to a location name).
+    """
+    for row in reader:
+        if not row or row[0].startswith("#"):
+            continue
+        try:
+            if "/" in row[0]:
+                network = ipaddress.ip_network(row[0].strip(), strict=False)
+                start, end = network.network_address, network.broadcast_address
+                geoname = row[1] or (row[2] if len(row) > 2 else "")
+                location = locations.get(geoname)
+            else:
+                start = ipaddress.ip_address(row[0].strip())
+                end = ipaddress.ip_address(row[1].strip())
+                if len(row) >= 6:
+                    location = _location(row[5].strip(), row[3].strip())
+                else:
+                    location = row[2].strip() if len(row) > 2 else None
+        except (ValueError, IndexError):
+            # Header rows and junk
+            continue
+        if location and start.version == end.version and start <= end:
+            yield start.version, int(start), int(end), location
+
+
+def _geoip_locations(path):
+    """{geoname_id: location} from a GeoLite2 *-Locations-*.csv"""
+    locations = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = {name: i for i, name in enumerate(header)}
+        country = columns.get("country_name", columns.get("country_iso_code"))
+        city = columns.get("city_name")
+        for row in reader:
+            try:
+                locations[row[0]] = _location(row[city] if city is not None else "", row[country])
+            except (IndexError, TypeError):
+                continue
+    return locations
+
+
+def compile_geoip(csv_paths, out_path, locations_path=None):
+    """Compile geo CSVs into a sorted binary range table; returns (v4, v6) record counts"""
+    locations = _geoip_locations(locations_path) if locations_path else {}
+    names = {}
+    ranges = {4: [], 6: []}
+    for path in csv_paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for version, start, end, location in _geoip_ranges(csv.reader(f), locations):
+                index = names.setdefault(location, len(names))
+                ranges[version].append((start, end, index))
+    for records in ranges.values():
+        records.sort()
+
+    blob = bytearray()
+    offsets = []
+    for name in names:
+        offsets.append(len(blob))
+        blob += name.encode("utf-8")
+    offsets.append(len(blob))
+
+    directory = os.path.dirname(os.path.abspath(out_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".geoip-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_GEOIP_HEADER.pack(GEOIP_MAGIC, GEOIP_VERSION, 0, len(ranges[4]), len(ranges[6]), len(names)))
+            for start, end, index in ranges[4]:
+                f.write(_GEOIP_V4.pack(start, end, index))
+            for start, end, index in ranges[6]:
+                f.write(_GEOIP_V6.pack(start >> 64, start & _U64, end >> 64, end & _U64, index))
+            for offset in offsets:
+                f.write(_GEOIP_OFFSET.pack(offset))
+            f.write(blob)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(ranges[4]), len(ranges[6])
+
+
+class GeoIpDatabase:
+    """Offline IP -> location lookups on a file made by compile_geoip().
+
+    The file is mmapped and binary-searched in place: opening it only reads
+    the header, and a lookup is O(log n) struct reads with nothing built
+    per record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, self.v4_count, self.v6_count, self.name_count = \
+                _GEOIP_HEADER.unpack_from(self._map, 0)
+            if magic != GEOIP_MAGIC or version != GEOIP_VERSION:
+                raise ValueError(f"{path}: not a geoip database (version {GEOIP_VERSION})")
+            self._v4_base = _GEOIP_HEADER.size
+            self._v6_base = self._v4_base + self.v4_count * _GEOIP_V4.size
+            self._offsets_base = self._v6_base + self.v6_count * _GEOIP_V6.size
+            self._names_base = self._offsets_base + (self.name_count + 1) * _GEOIP_OFFSET.size
+            # The last offset is where the location names end
+            names_end = _GEOIP_OFFSET.unpack_from(
+                self._map, self._offsets_base + self.name_count * _GEOIP_OFFSET.size)[0]
+            if len(self._map) < self._names_base + names_end:
+                raise ValueError(f"{path}: truncated geoip database")
+        except struct.error:
+            self._map.close()
+            raise ValueError(f"{path}: truncated geoip database") from None
+        except ValueError:
+            self._map.close()
+            raise
+
+    def __len__(self):
+        return self.v4_count + self.v6_count
+
+    def _find_v4(self, value):
+        data, base, size = self._map, self._v4_base, _GEOIP_V4.size
+        lo, hi = 0, self.v4_count
+        # Last record starting at or before `value`
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _GEOIP_V4.unpack_from(data, base + mid * size)[0] <= value:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        start, end, index = _GEOIP_V4.unpack_from(data, base + (lo - 1) * size)
+        return index if value <= end else None
+
+    def _find_v6(self, value):
+        data, base, size = self._map, self._v6_base, _GEOIP_V6.size
+        key = (value >> 64, value & _U64)
+        lo, hi = 0, self.v6_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _GEOIP_V6.unpack_from(data, base + mid * size)[:2] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        record = _GEOIP_V6.unpack_from(data, base + (lo - 1) * size)
+        return record[4] if key <= record[2:4] else None
+
+    def lookup(self, ip):
+        """Location name for `ip`, or None if it is not in the database"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if address.version == 4:
+            index = self._find_v4(int(address))
+        else:
+            index = self._find_v6(int(address))
+        if index is None:
+            return None
+        start, end = struct.unpack_from(">II", self._map, self._offsets_base + index * _GEOIP_OFFSET.size)
+        return self._map[self._names_base + start:self._names_base + end].decode("utf-8")
+
+    def close(self):
+        self._map.close()
+
+
+def geoip_database_path():
+    """First existing geoip database: $AN0M0S_GEOIP_DB, next to the app, then /usr/share"""
+    candidates = (
+        os.environ.get("AN0M0S_GEOIP_DB"),
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "geoip.bin"),
+        "/usr/share/an0m0s/geoip.bin",
+    )
+    for path in candidates:
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+
+def compile_geoip_main(argv):
+    """`--compile-geoip`: build the offline geoip database from CSV files"""
+    parser = argparse.ArgumentParser(
+        prog="An0m0s_vpn.py --compile-geoip",
+        description="Compile DB-IP/GeoLite2 CSV files into an An0m0s geoip database",
+    )
+    parser.add_argument("--compile-geoip", dest="csv", nargs="+", required=True, metavar="CSV",
+                        help="range (start,end,...) or network (GeoLite2 blocks) CSV files")
+    parser.add_argument("--locations", help="GeoLite2 *-Locations-*.csv for network CSVs")
+    parser.add_argument("-o", "--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "geoip.bin"),
+                        help="output file (default: geoip.bin next to the app)")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    v4, v6 = compile_geoip(args.csv, args.output, args.locations)
+    print(f"{args.output}: {v4} IPv4 and {v6} IPv6 ranges in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+class IpRefreshScheduler:
+    """Runs public-IP lookups on events and periodically, one at a time.
+
+    request() asks for a lookup. Requests arriving while a lookup is in
+    flight coalesce into one follow-up, and the in-flight result is dropped
+    as stale (the tunnel changed under it) instead of being shown; the
+    follow-up is forced past the lookup cache, which may hold that same
+    stale answer. Between
+    events the IP is re-verified every `interval` seconds; failed lookups
+    retry after `backoff` seconds, doubling up to `max_backoff`.
+
+    Forced requests (route changes) skip the cache, so they are rate
+    limited: at most one per `min_interval` seconds, and none before the
+    failure backoff runs out. A flapping link on a dead network then costs
+    one lookup per backoff step instead of one per flap. Other requests,
+    or any request coalesced with one, run at once.
+
+    `lookup(force)` runs on the scheduler thread and returns a result or
+    None; `on_start(reason)` and `on_result(result)` are called there too.
+    """
+
+    def __init__(self, lookup, on_start=None, on_result=None, interval=300.0, backoff=5.0, max_backoff=300.0,
+                 min_interval=5.0, clock=time.monotonic):
+        self.lookup = lookup
+        self.on_start = on_start
+        self.on_result = on_result
+        self.interval = interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_interval = min_interval
+        self.clock = clock
+        self.lookups = 0
+        self.stale = 0
+        self.failures = 0
+        self.held = 0
+        self._pending = None
+        self._force = False
+        # True while every pending request is a forced one
+        self._forced_only = False
+        self._last_start = None
+        self._generation = 0
+        self._due = None
+        self._running = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._due = self.clock() + self.interval
+        self._thread = threading.Thread(target=self._run, name="ip-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def request(self, reason="manual", force=False):
+        """Ask for a lookup; coalesces with any request not yet started"""
+        with self._cond:
+            self._generation += 1
+            self._forced_only = force and (self._pending is None or self._forced_only)
+            self._pending = self._pending or reason
+            self._force = self._force or force
+            self._cond.notify_all()
+
+    def _request_ready_at(self):
+        """When the pending request may run (call with the lock held)"""
+        if not self._forced_only or self._last_start is None:
+            return float("-inf")
+        ready = self._last_start + self.min_interval
+        if self.failures:
+            ready = max(ready, self._due)
+        return ready
+
+    def _next(self):
+        """Wait for a request or the periodic deadline; (reason, force, generation)"""
+        with self._cond:
+            held = False
+            while self._running:
+                now = self.clock()
+                wake = self._due
+                if self._pending is not None:
+                    ready = self._request_ready_at()
+                    if now >= ready:
+                        reason, force = self._pending, self._force
+                        break
+                    if not held:
+                        held = True
+                        self.held += 1
+                    wake = min(wake, ready)
+                if now >= self._due:
+                    # Periodic verification bypasses the lookup cache
+                    reason, force = "periodic", True
+                    break
+                self._cond.wait(wake - now)
+            else:
+                return None
+            self._pending = None
+            self._force = False
+            self._forced_only = False
+            self._last_start = now
+            return reason, force, self._generation
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            reason, force, generation = job
+            if self.on_start is not None:
+                self.on_start(reason)
+            try:
+                result = self.lookup(force)
+            except Exception:
+                result = None
+            with self._cond:
+                self.lookups += 1
+                self.failures = 0 if result is not None else self.failures + 1
+                delay = self.interval if result is not None else \
+                    min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+                self._due = self.clock() + delay
+                superseded = generation != self._generation
+                if superseded:
+                    self.stale += 1
+                    self._force = True
+            if not superseded and self.on_result is not None:
+                self.on_result(result)
+
+
+OVPN_DEFAULT_PORT = 1194
+OVPN_INLINE_TAGS = frozenset((
+    "ca", "cert", "key", "extra-certs", "pkcs12", "dh", "crl-verify", "secret",
+    "tls-auth", "tls-crypt", "tls-crypt-v2", "auth-user-pass", "http-proxy-user-pass",
+))
+
+
+class OvpnRemote:
+    """One `remote` entry with its effective port and protocol"""
+
+    __slots__ = ("host", "port", "proto")
+
+    def __init__(self, host, port=OVPN_DEFAULT_PORT, proto="udp"):
+        self.host = host
+        self.port = port
+        self.proto = proto
+
+    def __repr__(self):
+        return f"OvpnRemote({self.host!r}, {self.port}, {self.proto!r})"
+
+
+class OvpnConfig:
+    """Parsed OpenVPN client profile.
+
+    `remotes` lists every remote in file order, including those of
+    `<connection>` blocks, with `port`/`proto` defaults already applied.
+    `dev` is the device directive as written (e.g. "tun" or "tun1"),
+    `inline` maps inline section tags (ca, cert, tls-auth, ...) to their
+    contents and `directives` keeps every other directive as (name, args).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.remotes = []
+        self.port = OVPN_DEFAULT_PORT
+        self.proto = "udp"
+        self.dev = "tun"
+        self.dev_type = None
+        self.remote_random = False
+        self.inline = {}
+        self.directives = []
+
+    @property
+    def device_type(self):
+        """"tun" or "tap" """
+        if self.dev_type in ("tun", "tap"):
+            return self.dev_type
+        return "tap" if self.dev.startswith("tap") else "tun"
+
+    @property
+    def device(self):
+        """The fixed tunnel interface name, or None when OpenVPN picks one"""
+        return None if self.dev in ("tun", "tap") else self.dev
+
+    @property
+    def servers(self):
+        """Unique remote hosts in file order"""
+        return list(dict.fromkeys(remote.host for remote in self.remotes))
+
+    @property
+    def ports(self):
+        """Unique remote ports in file order"""
+        return list(dict.fromkeys(remote.port for remote in self.remotes))
+
+    def get(self, name, default=None):
+        """Arguments of the last `name` directive, or `default`"""
+        for directive, args in reversed(self.directives):
+            if directive == name:
+                return args
+        return default
+
+
+def _normalize_ovpn_proto(value):
+    """udp4/udp6 -> udp, tcp-client/tcp6-client -> tcp"""
+    value = value.lower()
+    return "tcp" if value.startswith("tcp") else "udp"
+
+
+def _parse_ovpn_port(value, default):
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return default
+    return port if 1 <= port <= 65535 else default
+
+
+def _ovpn_tokens(line):
+    """Split a directive line like OpenVPN does (quotes and backslash escapes)"""
+    try:
+        return shlex.split(line, comments=False, posix=True)
+    except ValueError:
+        return line.split()
+
+
+def _resolve_ovpn_remotes(pending, port, proto):
+    """Apply the port/proto in effect to raw `remote` arguments"""
+    remotes = []
+    for args in pending:
+        remote_port = _parse_ovpn_port(args[1], port) if len(args) > 1 else port
+        remote_proto = _normalize_ovpn_proto(args[2]) if len(args) > 2 else proto
+        remotes.append(OvpnRemote(args[0], remote_port, remote_proto))
+    return remotes
+
+
+def _parse_ovpn_block(lines, config):
+    """Parse directives into `config`; returns the raw remote entries.
+
+    Each entry is either the argument list of a `remote` or, for a
+    `<connection>` block, a (remotes, port, proto) tuple whose port/proto
+    are None when the block does not set them.
+    """
+    pending = []
+    port = proto = None
+    for raw in lines:
+        line = raw.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("<") and line.endswith(">") and not line.startswith("</"):
+            tag = line[1:-1].strip().lower()
+            body = []
+            for inner in lines:
+                if inner.strip().lower() == f"</{tag}>":
+                    break
+                body.append(inner)
+            else:
+                raise ValueError(f"unterminated <{tag}> block")
+            if tag == "connection":
+                block = OvpnConfig()
+                block_pending, block_port, block_proto = _parse_ovpn_block(iter(body), block)
+                pending.append((block_pending, block_port, block_proto))
+            else:
+                config.inline[tag] = "\n".join(body) + "\n"
+            continue
+        tokens = _ovpn_tokens(line)
+        if not tokens:
+            continue
+        name, args = tokens[0].lower(), tokens[1:]
+        if name.startswith("--"):
+            name = name[2:]
+        if name == "remote" and args:
+            pending.append(args)
+        elif name in ("port", "rport") and args:
+            port = _parse_ovpn_port(args[0], port)
+        elif name == "proto" and args:
+            proto = _normalize_ovpn_proto(args[0])
+        elif name == "dev" and args:
+            config.dev = args[0]
+        elif name == "dev-type" and args:
+            config.dev_type = args[0].lower()
+        elif name == "remote-random":
+            config.remote_random = True
+        else:
+            config.directives.append((name, args))
+    return pending, port, proto
+
+
+def parse_ovpn_config(text, path=None):
+    """Parse the text of an .ovpn profile into an OvpnConfig.
+
+    Raises ValueError for an unterminated inline or `<connection>` block;
+    unknown directives are kept, not rejected.
+    """
+    config = OvpnConfig(path)
+    pending, port, proto = _parse_ovpn_block(iter(text.splitlines()), config)
+    # `port`/`proto` apply to every remote wherever they appear in the file
+    config.port = port or OVPN_DEFAULT_PORT
+    config.proto = proto or "udp"
+    for entry in pending:
+        if isinstance(entry, tuple):
+            block_pending, block_port, block_proto = entry
+            config.remotes.extend(_resolve_ovpn_remotes(
+                block_pending, block_port or config.port, block_proto or config.proto))
+        else:
+            config.remotes.extend(_resolve_ovpn_remotes([entry], config.port, config.proto))
+    return config
+
+
+class OvpnConfigCache:
+    """Memoizes parse_ovpn_config() per file.
+
+    An unchanged (mtime, size) returns the cached config without reading
+    the file; a changed stat with the same content hash (e.g. a touch or a
+    rewrite by an editor) reuses the parse without re-parsing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path):
+        """Return the OvpnConfig for `path`; raises OSError/ValueError"""
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[2]
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).digest()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[1] == digest:
+                self._entries[path] = (key, digest, entry[2])
+                self.hits += 1
+                return entry[2]
+        config = parse_ovpn_config(data.decode("utf-8", errors="replace"), path)
+        with self._lock:
+            self._entries[path] = (key, digest, config)
+            self.misses += 1
+        return config
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class KillswitchSpec:
+    """Everything the killswitch ruleset is built from.
+
+    Backends only ever see this object, so the same inputs produce the same
+    policy regardless of which firewall implements it.
+    """
+
+    def __init__(self, default_iface=None, default_gateway=None, vpn_servers=(), vpn_ports=(),
+                 default_iface6=None, default_gateway6=None, dns_servers=()):
+        self.default_iface = default_iface
+        self.default_gateway = default_gateway
+        self.vpn_servers = list(vpn_servers)
+        self.vpn_ports = list(vpn_ports)
+        # Resolvers pushed by the tunnel; DNS to anyone is allowed until known
+        self.dns_servers = list(dns_servers)
+        # IPv6 default route; the IPv4 interface is used when there is none
+        self.default_iface6 = default_iface6
+        self.default_gateway6 = default_gateway6
+
+    @property
+    def phys_iface6(self):
+        return self.default_iface6 or self.default_iface
+
+
+def is_tunnel_iface(name):
+    """True for tun/tap devices, which are never the physical link"""
+    return bool(name) and name.startswith(("tun", "tap"))
+
+
+def is_safe_iface(value):
+    """True for a plausible interface name that is safe in a firewall rule"""
+    if not value:
+        return False
+    # Linux ifname max length is typically 15 chars, but allow slightly more
+    if len(value) > 32:
+        return False
+    return bool(re.fullmatch(r"[A-Za-z0-9_.:+-]+", value))
+
+
+def normalize_ports(ports):
+    """Unique valid port numbers, in order"""
+    normalized = []
+    for port in ports:
+        try:
+            p = int(port)
+        except Exception:
+            continue
+        if 1 <= p <= 65535 and p not in normalized:
+            normalized.append(p)
+    return normalized
+
+
+def normalize_servers(servers):
+    """Unique server tokens that are safe to put in a firewall payload"""
+    normalized = []
+    for server in servers:
+        if not server:
+            continue
+        s = str(server).strip()
+        # Keep as a single token; iptables will reject invalid values.
+        # The restore payload is whitespace/quote tokenized, so
+        # anything outside a hostname/address alphabet is dropped.
+        if len(s) > 255 or not re.fullmatch(r"[A-Za-z0-9_.:/-]+", s):
+            continue
+        if s not in normalized:
+            normalized.append(s)
+    return normalized
+
+
+def normalize_gateway(value, version):
+    """The gateway as a literal address of IP version `version`, else None"""
+    if not value:
+        return None
+    try:
+        address = ipaddress.ip_address(value)
+    except ValueError:
+        return None
+    return str(address) if address.version == version else None
+
+
+KILLSWITCH_CHAINS = (("INPUT", "AN0M0S_INPUT"), ("OUTPUT", "AN0M0S_OUTPUT"))
+KILLSWITCH_CHAINS_V6 = KILLSWITCH_CHAINS + (("FORWARD", "AN0M0S_FORWARD"),)
+
+
+def read_iptables_state(save_cmd="iptables-save"):
+    """Read the live filter table once.
+
+    Returns (chains, rules) -- the declared chain names and the `-A ...`
+    lines in iptables-save's canonical form -- or None if it cannot be read.
+    """
+    try:
+        cp = subprocess.run([save_cmd, "-t", "filter"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if cp.returncode != 0:
+        return None
+    chains = set()
+    rules = []
+    for line in cp.stdout.splitlines():
+        line = line.strip()
+        if line.startswith(":"):
+            chains.add(line[1:].split()[0])
+        elif line.startswith("-A "):
+            rules.append(line)
+    return chains, rules
+
+
+def _iptables_hook_lines(live_rules, chains, hooked=True):
+    """Restore lines that make each owned chain the first rule of its builtin.
+
+    With hooked=False every jump to our chains is deleted instead. Jumps
+    that are already in place are left alone, so toggling is O(1).
+    """
+    lines = []
+    for builtin, owned in chains:
+        jump = f"-A {builtin} -j {owned}"
+        builtin_rules = [r for r in live_rules if r.startswith(f"-A {builtin} ")]
+        present = builtin_rules.count(jump)
+        if hooked and present == 1 and builtin_rules[0] == jump:
+            continue
+        lines.extend([f"-D {builtin} -j {owned}"] * present)
+        if hooked:
+            lines.append(f"-I {builtin} 1 -j {owned}")
+    return lines
+
+
+def compile_iptables_restore(desired, live_state, chains=KILLSWITCH_CHAINS):
+    """Compile the minimal iptables-restore payload that turns live into desired.
+
+    Only rules that differ are touched: stale ones are deleted by spec, new
+    ACCEPTs are inserted at the top of their chain and new DROPs appended,
+    all in one --noflush transaction that never flushes the chain under
+    established tunnel traffic. Missing chains are created and filled in
+    order. Returns "" when the live ruleset already matches.
+    """
+    live_chains, live_rules = live_state
+    owned = [name for _, name in chains]
+    lines = []
+
+    new_chains = [name for name in owned if name not in live_chains]
+    lines.extend(f":{name} - [0:0]" for name in new_chains)
+
+    live_owned = [r for r in live_rules if r.split()[1] in owned]
+    desired_set = set(desired)
+    live_set = set(live_owned)
+
+    # Stale rules (and duplicates of wanted ones)
+    seen = set()
+    for rule in live_owned:
+        if rule not in desired_set or rule in seen:
+            lines.append("-D" + rule[2:])
+        seen.add(rule)
+
+    added = [r for r in desired if r not in live_set]
+    inserts = []
+    for rule in added:
+        chain = rule.split()[1]
+        if chain in new_chains or rule.endswith(" -j DROP"):
+            lines.append(rule)
+        else:
+            inserts.append(rule)
+    # Insert in reverse so the new accepts keep their relative order
+    for rule in reversed(inserts):
+        _, chain, rest = rule.split(" ", 2)
+        lines.append(f"-I {chain} 1 {rest}")
+
+    lines.extend(_iptables_hook_lines(live_rules, chains))
+    if not lines:
+        return ""
+    return "*filter\n" + "\n".join(lines) + "\nCOMMIT\n"
+
+
+def compile_iptables_teardown(live_rules, chains):
+    """Payload that unhooks and deletes our chains in one transaction"""
+    lines = ["*filter"]
+    # Declaring the chains creates/flushes them, so -X below cannot fail
+    lines.extend(f":{owned} - [0:0]" for _, owned in chains)
+    lines.extend(_iptables_hook_lines(live_rules, chains, hooked=False))
+    lines.extend(f"-X {owned}" for _, owned in chains)
+    lines.append("COMMIT")
+    return "\n".join(lines) + "\n"
+
+
+def split_address_families(servers):
+    """Split literal addresses/CIDRs into collapsed IPv4 and IPv6 network lists.
+
+    Hostnames must already have been resolved (see RemoteResolver); anything
+    that is not a literal is skipped rather than handed to the firewall.
+    """
+    v4, v6 = [], []
+    for server in servers:
+        try:
+            net = ipaddress.ip_network(server, strict=False)
+        except ValueError:
+            continue
+        (v4 if net.version == 4 else v6).append(net)
+    return list(ipaddress.collapse_addresses(v4)), list(ipaddress.collapse_addresses(v6))
+
+
+# Named sets of the killswitch ruleset: name -> (element type, is interval set).
+# Types use nft's names; address sets carry their IP version in the type.
+KILLSWITCH_SETS = {
+    "phys_ifaces": ("ifname", False),
+    "gateways4": ("ipv4_addr", True),
+    "gateways6": ("ipv6_addr", True),
+    "vpn_servers4": ("ipv4_addr", True),
+    "vpn_servers6": ("ipv6_addr", True),
+    "vpn_ports": ("inet_service", False),
+    "vpn_any_ports": ("inet_service", False),
+    "dns_servers4": ("ipv4_addr", True),
+    "dns_servers6": ("ipv6_addr", True),
+}
+
+# ICMPv6 neighbour discovery: router solicit/advert, neighbour solicit/advert, redirect
+ICMPV6_ND_TYPES = (133, 134, 135, 136, 137)
+
+
+class FirewallRule:
+    """One killswitch rule in backend-neutral form.
+
+    Match fields left as None match anything. Values starting with "@" name
+    a set of the ruleset; interface names ending in "+" are prefixes (as in
+    iptables). Ports are ints or inclusive (low, high) ranges.
+    """
+
+    __slots__ = ("chain", "action", "family", "iif", "oif", "ctstate", "proto",
+                 "saddr", "daddr", "sport", "dport", "icmpv6_type")
+
+    def __init__(self, chain, action, family=None, iif=None, oif=None, ctstate=None, proto=None,
+                 saddr=None, daddr=None, sport=None, dport=None, icmpv6_type=None):
+        self.chain = chain
+        self.action = action
+        self.family = family
+        self.iif = iif
+        self.oif = oif
+        self.ctstate = ctstate
+        self.proto = proto
+        self.saddr = saddr
+        self.daddr = daddr
+        self.sport = sport
+        self.dport = dport
+        self.icmpv6_type = icmpv6_type
+
+    def address_family(self):
+        """IP version this rule is restricted to, or None for both"""
+        for value in (self.saddr, self.daddr):
+            if isinstance(value, str) and value.startswith("@"):
+                return 4 if KILLSWITCH_SETS[value[1:]][0] == "ipv4_addr" else 6
+        return self.family
+
+
+_CT_ESTABLISHED = ("related", "established")
+_L4 = ("udp", "tcp")
+_PHYS = "@phys_ifaces"
+# Every port but DNS: the gateway only gets DNS through the DNS rules
+_NOT_DNS = ((0, 52), (54, 65535))
+
+# The killswitch policy. Rules never change; everything that depends on the
+# current network and profile lives in the sets, and every ACCEPT precedes
+# every DROP within a chain.
+KILLSWITCH_RULES = (
+    # Loopback, established connections and the VPN tunnel
+    FirewallRule("input", "accept", iif="lo"),
+    FirewallRule("output", "accept", oif="lo"),
+    FirewallRule("input", "accept", ctstate=_CT_ESTABLISHED),
+    FirewallRule("output", "accept", ctstate=_CT_ESTABLISHED),
+    FirewallRule("input", "accept", iif="tun+"),
+    FirewallRule("output", "accept", oif="tun+"),
+    FirewallRule("input", "accept", iif="tap+"),
+    FirewallRule("output", "accept", oif="tap+"),
+    # IPv6 does not work on the link without neighbour discovery
+    FirewallRule("output", "accept", family=6, oif=_PHYS, proto="icmpv6", icmpv6_type=ICMPV6_ND_TYPES),
+    FirewallRule("input", "accept", family=6, iif=_PHYS, proto="icmpv6", icmpv6_type=ICMPV6_ND_TYPES),
+    # DNS (to anyone before the tunnel pushes its resolvers), DHCP and DHCPv6
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@dns_servers4", proto=_L4, dport=(53,)),
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@dns_servers6", proto=_L4, dport=(53,)),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@dns_servers4", proto=_L4, sport=(53,)),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@dns_servers6", proto=_L4, sport=(53,)),
+    FirewallRule("output", "accept", family=4, oif=_PHYS, proto="udp", dport=((67, 68),)),
+    FirewallRule("input", "accept", family=4, iif=_PHYS, proto="udp", sport=((67, 68),)),
+    FirewallRule("output", "accept", family=6, oif=_PHYS, proto="udp", dport=((546, 547),)),
+    FirewallRule("input", "accept", family=6, iif=_PHYS, proto="udp", sport=((546, 547),)),
+    # VPN server connections
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@vpn_servers4", proto=_L4, dport="@vpn_ports"),
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@vpn_servers6", proto=_L4, dport="@vpn_ports"),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@vpn_servers4"),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@vpn_servers6"),
+    FirewallRule("output", "accept", oif=_PHYS, proto=_L4, dport="@vpn_any_ports"),
+    # Gateway: anything but DNS, so that a router resolver cannot bypass
+    # the pushed ones once the DNS sets are narrowed
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@gateways4", proto=_L4, dport=_NOT_DNS),
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@gateways4", proto="icmp"),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@gateways4", proto=_L4, sport=_NOT_DNS),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@gateways4", proto="icmp"),
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@gateways6", proto=_L4, dport=_NOT_DNS),
+    FirewallRule("output", "accept", oif=_PHYS, daddr="@gateways6", proto="icmpv6"),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@gateways6", proto=_L4, sport=_NOT_DNS),
+    FirewallRule("input", "accept", iif=_PHYS, saddr="@gateways6", proto="icmpv6"),
+    # Drop all other traffic on physical interface
+    FirewallRule("output", "drop", oif=_PHYS),
+    FirewallRule("input", "drop", iif=_PHYS),
+    FirewallRule("forward", "drop", family=6, oif=_PHYS),
+)
+
+
+class KillswitchRuleset:
+    """The killswitch as data: the fixed rules plus the current set contents.
+
+    This is what every backend compiles from and what KillswitchSimulator
+    evaluates, so the simulated policy is the deployed policy.
+    """
+
+    def __init__(self, sets, rules=KILLSWITCH_RULES):
+        self.sets = sets
+        self.rules = rules
+
+    def rule_count(self, family):
+        """Number of rules a backend without sets (iptables) would need"""
+        return len(render_iptables_rules(self, family))
+
+
+def build_killswitch_ruleset(spec):
+    """Build the desired ruleset for a KillswitchSpec.
+
+    Any change of interface, gateway, servers or ports only changes set
+    contents, never the rules.
+    """
+    sets = {name: set() for name in KILLSWITCH_SETS}
+    # The DROP rules match the physical interfaces; a tunnel device there
+    # would leave the real link with no DROP at all
+    ifaces = [iface for iface in (spec.default_iface, spec.default_iface6)
+              if iface and not is_tunnel_iface(iface)]
+    if not ifaces:
+        return KillswitchRuleset(sets)
+    sets["phys_ifaces"].update(ifaces)
+    for gateway in (spec.default_gateway, spec.default_gateway6):
+        if not gateway:
+            continue
+        try:
+            gateway = ipaddress.ip_network(gateway)
+            sets["gateways4" if gateway.version == 4 else "gateways6"].add(str(gateway))
+        except ValueError:
+            pass
+    if spec.vpn_servers:
+        servers4, servers6 = split_address_families(spec.vpn_servers)
+        sets["vpn_servers4"].update(str(net) for net in servers4)
+        sets["vpn_servers6"].update(str(net) for net in servers6)
+        sets["vpn_ports"].update(spec.vpn_ports)
+    else:
+        # No known servers: allow the VPN ports to any destination
+        sets["vpn_any_ports"].update(spec.vpn_ports)
+    if spec.dns_servers:
+        dns4, dns6 = split_address_families(spec.dns_servers)
+        sets["dns_servers4"].update(str(net) for net in dns4)
+        sets["dns_servers6"].update(str(net) for net in dns6)
+    else:
+        sets["dns_servers4"].add("0.0.0.0/0")
+        sets["dns_servers6"].add("::/0")
+    return KillswitchRuleset(sets)
+
+
+def _sorted_elements(values):
+    return sorted(values, key=lambda v: (str(type(v)), v if isinstance(v, (int, tuple)) else str(v)))
+
+
+def render_iptables_rules(ruleset, family):
+    """Expand the ruleset into iptables rules for one IP version.
+
+    Sets are expanded into one rule per element combination, and rules are
+    spelled exactly the way iptables-save prints them, so the reconciler
+    can compare desired and live rules as plain strings.
+    """
+    chain_names = {"input": "AN0M0S_INPUT", "output": "AN0M0S_OUTPUT", "forward": "AN0M0S_FORWARD"}
+    rules = []
+
+    def expand(value):
+        if value is None:
+            return [None]
+        if isinstance(value, str) and value.startswith("@"):
+            return _sorted_elements(ruleset.sets[value[1:]])
+        if isinstance(value, (tuple, list)):
+            return list(value)
+        return [value]
+
+    def port(value):
+        return f"{value[0]}:{value[1]}" if isinstance(value, tuple) else str(value)
+
+    for rule in ruleset.rules:
+        rule_family = rule.address_family()
+        if rule_family not in (None, family):
+            continue
+        if rule.chain == "forward" and family == 4:
+            continue
+        for iif, oif, saddr, daddr, proto, sport, dport, icmp_type in itertools.product(
+            expand(rule.iif), expand(rule.oif), expand(rule.saddr), expand(rule.daddr),
+            expand(rule.proto), expand(rule.sport), expand(rule.dport), expand(rule.icmpv6_type),
+        ):
+            parts = ["-A", chain_names[rule.chain]]
+            # iptables-save leaves out "any address" matches
+            if saddr is not None and saddr not in ("0.0.0.0/0", "::/0"):
+                parts += ["-s", saddr]
+            if daddr is not None and daddr not in ("0.0.0.0/0", "::/0"):
+                parts += ["-d", daddr]
+            if iif is not None:
+                parts += ["-i", iif]
+            if oif is not None:
+                parts += ["-o", oif]
+            # Without options iptables-save leaves out the protocol's match
+            if proto == "icmpv6":
+                parts += ["-p", "ipv6-icmp"]
+                if icmp_type is not None:
+                    parts += ["-m", "icmp6", "--icmpv6-type", str(icmp_type)]
+            elif proto is not None:
+                parts += ["-p", proto]
+                if sport is not None or dport is not None:
+                    parts += ["-m", proto]
+                if sport is not None:
+                    parts += ["--sport", port(sport)]
+                if dport is not None:
+                    parts += ["--dport", port(dport)]
+            if rule.ctstate:
+                parts += ["-m", "conntrack", "--ctstate", ",".join(s.upper() for s in rule.ctstate)]
+            parts += ["-j", rule.action.upper()]
+            rules.append(" ".join(parts))
+    return rules
+
+
+# The layout set carries no elements; it marks the rule layout so that a
+# table created by an older version is reloaded instead of reconciled.
+NFT_LAYOUT_SET = "layout_5"
+ICMPV6_ND_NAMES = {
+    133: "nd-router-solicit",
+    134: "nd-router-advert",
+    135: "nd-neighbor-solicit",
+    136: "nd-neighbor-advert",
+    137: "nd-redirect",
+}
+
+
+def _nft_elements(name, values):
+    """Format set elements for an nft script"""
+    if KILLSWITCH_SETS[name][0] == "ifname":
+        items = [f'"{v}"' for v in sorted(values)]
+    else:
+        items = [str(v) for v in sorted(values, key=str)]
+    return ", ".join(items)
+
+
+def _nft_rule(rule):
+    """Render one FirewallRule as an nft rule statement"""
+
+    def ifname(value):
+        if value.startswith("@"):
+            return value
+        return '"' + (value[:-1] + "*" if value.endswith("+") else value) + '"'
+
+    def ports(value):
+        if isinstance(value, str):
+            return value
+        items = [f"{p[0]}-{p[1]}" if isinstance(p, tuple) else str(p) for p in value]
+        return items[0] if len(items) == 1 else "{ " + ", ".join(items) + " }"
+
+    parts = []
+    if rule.iif:
+        parts.append(f"iifname {ifname(rule.iif)}")
+    if rule.oif:
+        parts.append(f"oifname {ifname(rule.oif)}")
+    family = rule.address_family()
+    ip = "ip" if family == 4 else "ip6"
+    if rule.saddr:
+        parts.append(f"{ip} saddr {rule.saddr}")
+    if rule.daddr:
+        parts.append(f"{ip} daddr {rule.daddr}")
+    if rule.family and not (rule.saddr or rule.daddr) and rule.proto != "icmpv6":
+        parts.append(f"meta nfproto {'ipv4' if rule.family == 4 else 'ipv6'}")
+    if rule.ctstate:
+        parts.append("ct state " + ",".join(rule.ctstate))
+    if rule.proto == "icmpv6" and rule.icmpv6_type:
+        parts.append("icmpv6 type { " + ", ".join(ICMPV6_ND_NAMES[t] for t in rule.icmpv6_type) + " }")
+    elif rule.proto:
+        if isinstance(rule.proto, tuple):
+            parts.append("meta l4proto { " + ", ".join(sorted(rule.proto)) + " }")
+            prefix = "th"
+        else:
+            prefix = rule.proto
+            if rule.sport is None and rule.dport is None:
+                parts.append(f"meta l4proto {'ipv6-icmp' if rule.proto == 'icmpv6' else rule.proto}")
+        if rule.sport is not None:
+            parts.append(f"{prefix} sport {ports(rule.sport)}")
+        if rule.dport is not None:
+            parts.append(f"{prefix} dport {ports(rule.dport)}")
+    parts.append(rule.action)
+    return " ".join(parts)
+
+
+def compile_nft_ruleset(ruleset, table="an0m0s"):
+    """Compile the killswitch into one `nft -f` script.
+
+    Servers, ports, the physical interface and the gateway live in named
+    sets (interval sets for addresses), so matching is a set lookup instead
+    of a walk over one rule per server/port/protocol. An `inet` table
+    covers IPv4 and IPv6 in the same netlink batch. The table is recreated
+    in the same transaction.
+    """
+    lines = [
+        f"table inet {table}",
+        f"delete table inet {table}",
+        f"table inet {table} {{",
+        f"    set {NFT_LAYOUT_SET} {{ type inet_service; }}",
+    ]
+    for name, (set_type, interval) in KILLSWITCH_SETS.items():
+        values = ruleset.sets[name]
+        flags = " flags interval;" if interval else ""
+        elements = f" elements = {{ {_nft_elements(name, values)} }};" if values else ""
+        lines.append(f"    set {name} {{ type {set_type};{flags}{elements} }}")
+    for chain in ("input", "forward", "output"):
+        lines.extend([
+            f"    chain {chain} {{",
+            f"        type filter hook {chain} priority 0; policy accept;",
+        ])
+        lines.extend("        " + _nft_rule(rule) for rule in ruleset.rules if rule.chain == chain)
+        lines.append("    }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def _nft_json_elements(name, elems):
+    """Normalize `nft -j` set elements to the form build_killswitch_ruleset() uses"""
+    values = set()
+    for elem in elems:
+        if isinstance(elem, dict) and "elem" in elem:
+            elem = elem["elem"].get("val")
+        if KILLSWITCH_SETS[name][0] in ("ifname", "inet_service"):
+            values.add(elem)
+        elif isinstance(elem, str):
+            values.add(str(ipaddress.ip_network(elem)))
+        elif isinstance(elem, dict) and "prefix" in elem:
+            values.add(str(ipaddress.ip_network(f"{elem['prefix']['addr']}/{elem['prefix']['len']}")))
+        elif isinstance(elem, dict) and "range" in elem:
+            first, last = (ipaddress.ip_address(a) for a in elem["range"])
+            values.update(str(net) for net in ipaddress.summarize_address_range(first, last))
+    return values
+
+
+def read_nft_sets(table="an0m0s"):
+    """Read the live set contents of our table with one `nft -j` call.
+
+    Returns None when the table is missing or was created with a different
+    rule layout (e.g. by an older version), so the caller reloads it.
+    """
+    try:
+        cp = subprocess.run(["nft", "-j", "list", "table", "inet", table], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if cp.returncode != 0:
+        return None
+    try:
+        objects = json.loads(cp.stdout).get("nftables", [])
+        sets = {}
+        layout = False
+        for obj in objects:
+            nft_set = obj.get("set") if isinstance(obj, dict) else None
+            if not nft_set:
+                continue
+            if nft_set.get("name") == NFT_LAYOUT_SET:
+                layout = True
+            elif nft_set.get("name") in KILLSWITCH_SETS:
+                sets[nft_set["name"]] = _nft_json_elements(nft_set["name"], nft_set.get("elem", []))
+    except (ValueError, AttributeError, KeyError, TypeError):
+        return None
+    if not layout or set(sets) != set(KILLSWITCH_SETS):
+        return None
+    return sets
+
+
+def compile_nft_reconcile(desired, live, table="an0m0s"):
+    """Minimal `nft -f` batch of set element deletions and additions.
+
+    Deletions come first so that a CIDR replacing overlapping hosts never
+    conflicts with them. Returns "" when nothing changed.
+    """
+    lines = []
+    for name in KILLSWITCH_SETS:
+        removed = live[name] - desired[name]
+        if removed:
+            lines.append(f"delete element inet {table} {name} {{ {_nft_elements(name, removed)} }}")
+    for name in KILLSWITCH_SETS:
+        added = desired[name] - live[name]
+        if added:
+            lines.append(f"add element inet {table} {name} {{ {_nft_elements(name, added)} }}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+SimPacket = collections.namedtuple(
+    "SimPacket",
+    "chain family iif oif proto src dst sport dport ctstate icmpv6_type",
+    defaults=(None, None, None, None, None, None, None, None, "new", None),
+)
+SimPacket.__doc__ = """A synthetic packet for KillswitchSimulator.
+
+chain is "input", "output" or "forward"; src/dst are address strings;
+ctstate is "new", "established" or "related".
+"""
+
+
+class KillswitchSimulator:
+    """Evaluates synthetic packets against a KillswitchRuleset in-process.
+
+    Each chain is compiled once into a straight-line Python function of
+    set/range lookups (interval sets become a host hash set plus one
+    network set per prefix length), so evaluation needs neither root, nor a
+    network, nor a walk over expanded per-server rules. Chains fall through
+    to ACCEPT, like the hooks the real backends install. evaluate_batch()
+    specialises a chain for packets that share everything but addresses
+    and ports and runs it as a single list comprehension.
+    """
+
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+        self._consts = {}
+        self._addr_cache = {}
+        self._chains = {}
+        self._batches = {}
+        self._tests = [self._rule_tests(rule) for rule in ruleset.rules]
+        # Index -1 (no rule matched) picks the chain policy
+        self._verdicts = [rule.action for rule in ruleset.rules] + ["accept"]
+        for chain in ("input", "output", "forward"):
+            rules = [(i, rule) for i, rule in enumerate(ruleset.rules) if rule.chain == chain]
+            self._chains[chain] = self._compile_chain(chain, rules)
+
+    def _const(self, value):
+        name = f"_c{len(self._consts)}"
+        self._consts[name] = value
+        return name
+
+    def _addr_test(self, var, set_name):
+        """(family, test) for `var` being in an address set"""
+        version = 4 if KILLSWITCH_SETS[set_name][0] == "ipv4_addr" else 6
+        hosts = set()
+        # One network set per prefix length: a lookup per mask, not per prefix
+        prefixes = collections.defaultdict(set)
+        for value in self.ruleset.sets[set_name]:
+            net = ipaddress.ip_network(value)
+            if net.num_addresses == 1:
+                hosts.add(int(net.network_address))
+            else:
+                prefixes[int(net.netmask)].add(int(net.network_address))
+        if not hosts and not prefixes:
+            return version, "False"
+        tests = []
+        if hosts:
+            tests.append(f"{var} in {self._const(frozenset(hosts))}")
+        for mask, networks in sorted(prefixes.items(), reverse=True):
+            if len(networks) == 1:
+                tests.append(f"({var} & {mask}) == {next(iter(networks))}")
+            else:
+                tests.append(f"({var} & {mask}) in {self._const(frozenset(networks))}")
+        return version, f"({' or '.join(tests)})"
+
+    def _iface_test(self, var, value):
+        if value.startswith("@"):
+            names = self.ruleset.sets[value[1:]]
+            return f"{var} in {self._const(frozenset(names))}" if names else "False"
+        if value.endswith("+"):
+            return f"{var}.startswith({value[:-1]!r})"
+        return f"{var} == {value!r}"
+
+    def _port_test(self, var, value):
+        if isinstance(value, str):
+            ports = self.ruleset.sets[value[1:]]
+            return f"{var} in {self._const(frozenset(ports))}" if ports else "False"
+        tests = []
+        singles = frozenset(p for p in value if not isinstance(p, tuple))
+        if singles:
+            tests.append(f"{var} in {self._const(singles)}")
+        tests.extend(f"{low} <= {var} <= {high}" for low, high in (p for p in value if isinstance(p, tuple)))
+        return "(" + " or ".join(tests) + ")"
+
+    def _rule_tests(self, rule):
+        """Test expressions for one rule, split into (header, flow).
+
+        Header tests only read the fields a batch of packets shares (fam,
+        iif, oif, ct, proto); flow tests read the per-packet src, dst,
+        sport, dport and icmp.
+        """
+        header = []
+        flow = []
+        if rule.family:
+            header.append(f"fam == {rule.family}")
+        if rule.iif:
+            header.append(self._iface_test("iif", rule.iif))
+        if rule.oif:
+            header.append(self._iface_test("oif", rule.oif))
+        if rule.ctstate:
+            header.append(f"ct in {self._const(frozenset(rule.ctstate))}")
+        if rule.proto:
+            protos = rule.proto if isinstance(rule.proto, tuple) else (rule.proto,)
+            header.append(f"proto in {self._const(frozenset(protos))}")
+        if rule.icmpv6_type:
+            flow.append(f"icmp in {self._const(frozenset(rule.icmpv6_type))}")
+        for var, value in (("src", rule.saddr), ("dst", rule.daddr)):
+            if value:
+                version, test = self._addr_test(var, value[1:])
+                header.append(f"fam == {version}")
+                flow.append(test)
+        if rule.sport is not None:
+            flow.append(self._port_test("sport", rule.sport))
+        if rule.dport is not None:
+            flow.append(self._port_test("dport", rule.dport))
+        return header, flow
+
+    def _compile_chain(self, chain, rules):
+        body = [
+            f"def _chain_{chain}(fam, iif, oif, proto, src, dst, sport, dport, ct, icmp):",
+        ]
+        for index, rule in rules:
+            tests = self._tests[index][0] + self._tests[index][1]
+            if "False" in tests:
+                continue
+            body.append(f"    if {' and '.join(tests) or 'True'}:")
+            body.append(f"        return {index}")
+        body.append("    return -1")
+        namespace = dict(self._consts)
+        exec("\n".join(body), namespace)
+        return namespace[f"_chain_{chain}"]
+
+    def _compile_batch(self, chain, fam, iif, oif, proto, ct):
+        """One list comprehension over the flows, with the shared fields folded in.
+
+        Rules whose header cannot match are left out, and a rule without
+        flow tests ends the expression, so each packet only pays for the
+        set lookups that can still decide it.
+        """
+        namespace = dict(self._consts, fam=fam, iif=iif, oif=oif, proto=proto, ct=ct)
+        branches = []
+        for index, rule in enumerate(self.ruleset.rules):
+            header, flow = self._tests[index]
+            if rule.chain != chain or "False" in header or "False" in flow:
+                continue
+            if not all(eval(test, namespace) for test in header):
+                continue
+            if not flow:
+                branches.append(str(index))
+                break
+            branches.append(f"{index} if {' and '.join(flow)} else")
+        else:
+            branches.append("-1")
+        exec(f"def _batch(flows):\n"
+             f"    return [{' '.join(branches)} for src, dst, sport, dport, icmp in flows]", namespace)
+        return namespace["_batch"]
+
+    def _addr(self, value):
+        cached = self._addr_cache.get(value)
+        if cached is None:
+            if value is None:
+                cached = (None, 0)
+            else:
+                address = ipaddress.ip_address(value)
+                cached = (address.version, int(address))
+            self._addr_cache[value] = cached
+        return cached
+
+    def match(self, packet):
+        """Index of the rule that decides `packet`, or -1 for the chain policy"""
+        src_fam, src = self._addr(packet.src)
+        dst_fam, dst = self._addr(packet.dst)
+        fam = packet.family or src_fam or dst_fam
+        sport = -1 if packet.sport is None else packet.sport
+        dport = -1 if packet.dport is None else packet.dport
+        return self._chains[packet.chain](
+            fam, packet.iif or "", packet.oif or "", packet.proto, src, dst, sport, dport,
+            packet.ctstate, packet.icmpv6_type,
+        )
+
+    def evaluate(self, packet):
+        """Return "accept" or "drop" for one SimPacket"""
+        return self._verdicts[self.match(packet)]
+
+    def match_batch(self, chain, fam, proto, flows, iif=None, oif=None, ctstate="new"):
+        """match() for many packets that share chain, family, interfaces, protocol and state.
+
+        `flows` holds (src, dst, sport, dport, icmp) tuples: addresses as
+        integers (0 when absent), ports as integers (-1 when absent) and the
+        ICMPv6 type or None. The chain is specialised once per set of shared
+        fields, so a packet costs a few set lookups instead of a call.
+        """
+        key = (chain, fam, iif or "", oif or "", proto, ctstate)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = self._compile_batch(*key)
+        return batch(flows)
+
+    def evaluate_batch(self, chain, fam, proto, flows, iif=None, oif=None, ctstate="new"):
+        """evaluate() for many packets, see match_batch()"""
+        verdicts = self._verdicts
+        return [verdicts[index] for index in self.match_batch(chain, fam, proto, flows, iif, oif, ctstate)]
+
+    def find_leaks(self, samples=100000, seed=0):
+        """Property check: new egress on the physical interface only reaches VPN servers.
+
+        Generates random outbound packets and returns those the ruleset
+        accepts although the policy does not allow them. The only
+        destinations allowed besides the VPN servers (on the VPN ports) are
+        the gateway, the allowed DNS servers, DHCP/DHCPv6 and IPv6 neighbour
+        discovery. The gateway gets no DNS unless it is an allowed resolver.
+        Packets are generated and evaluated in one batch per interface,
+        family and protocol.
+        """
+        sets = self.ruleset.sets
+        if not sets["phys_ifaces"]:
+            return []
+        rng = random.Random(seed)
+        ifaces = sorted(sets["phys_ifaces"])
+        nets = {
+            "targets": self._leak_networks("vpn_servers", "gateways"),
+            "servers": self._leak_networks("vpn_servers"),
+            "gateways": self._leak_networks("gateways"),
+            "resolvers": self._leak_networks("dns_servers"),
+        }
+        ports = sorted(sets["vpn_ports"] | sets["vpn_any_ports"]) or [1194]
+
+        # udp twice: it is the protocol most leaks would use
+        groups = [(iface, fam, proto) for iface in ifaces for fam in (4, 6)
+                  for proto in ("tcp", "udp", "udp", "icmp" if fam == 4 else "icmpv6")]
+        share, extra = divmod(samples, len(groups))
+        leaks = []
+        for n, (iface, fam, proto) in enumerate(groups):
+            batch = self._leak_flows(rng, nets["targets"][fam], ports, fam, proto, share + (n < extra))
+            verdicts = self.evaluate_batch("output", fam, proto, batch, oif=iface)
+            for (_, dst, sport, dport, icmp), verdict in zip(batch, verdicts):
+                if verdict == "accept" and not self._leak_allowed(nets, fam, proto, dst, dport, icmp):
+                    address = ipaddress.IPv4Address(dst) if fam == 4 else ipaddress.IPv6Address(dst)
+                    leaks.append(SimPacket("output", fam, oif=iface, proto=proto, dst=str(address), sport=sport,
+                                           dport=None if dport < 0 else dport, icmpv6_type=icmp))
+        return leaks
+
+    def _leak_networks(self, *names):
+        """(mask, network, size) integers per family for the named sets"""
+        nets = {4: [], 6: []}
+        for fam in (4, 6):
+            for name in names:
+                for value in self.ruleset.sets[f"{name}{fam}"]:
+                    net = ipaddress.ip_network(value)
+                    nets[fam].append((int(net.netmask), int(net.network_address), net.num_addresses))
+        return nets
+
+    def _leak_allowed(self, nets, fam, proto, dst, dport, icmp):
+        """Whether the policy allows a new egress flow on the physical interface"""
+        sets = self.ruleset.sets
+
+        def inside(name):
+            return any(dst & mask == network for mask, network, _ in nets[name][fam])
+
+        dns = proto in ("tcp", "udp") and dport == 53
+        if not dns and inside("gateways"):
+            return True
+        if proto in ("tcp", "udp"):
+            if dport in sets["vpn_any_ports"]:
+                return True
+            if dport in sets["vpn_ports"] and inside("servers"):
+                return True
+        if dns and inside("resolvers"):
+            return True
+        if proto == "udp" and ((fam == 4 and dport in (67, 68)) or (fam == 6 and dport in (546, 547))):
+            return True
+        return fam == 6 and proto == "icmpv6" and icmp in ICMPV6_ND_TYPES
+
+    @staticmethod
+    def _leak_flows(rng, near, ports, fam, proto, count):
+        """count random (iif, dst, sport, dport, icmp) flows, some near the allowed targets"""
+        bits = 32 if fam == 4 else 128
+        icmp = proto.startswith("icmp")
+        # Bound methods: generating the packets costs more than evaluating them
+        uniform, getrandbits, choice, randrange = rng.random, rng.getrandbits, rng.choice, rng.randrange
+        batch = []
+        for _ in range(count):
+            if near and uniform() < 0.3:
+                _, network, size = choice(near)
+                dst = network + randrange(size)
+            else:
+                dst = getrandbits(bits)
+            sport = 1024 + getrandbits(16) % 64512
+            if icmp:
+                batch.append((0, dst, sport, -1, getrandbits(8)))
+            elif uniform() < 0.3:
+                batch.append((0, dst, sport, choice(ports), None))
+            else:
+                dport = (53, 67, 547, getrandbits(16) or 1)[getrandbits(2)]
+                batch.append((0, dst, sport, dport, None))
+        return batch
+
+
+class IptablesBackend:
+    """Killswitch on iptables/ip6tables in dedicated AN0M0S_* chains.
+
+    Every apply reconciles: the live table is read once and only the rules
+    that differ from the desired set are changed.
+    """
+
+    name = "iptables"
+
+    @staticmethod
+    def available():
+        return shutil.which("iptables-restore") is not None
+
+    @staticmethod
+    def _reconcile(save_cmd, restore_cmd, desired, chains):
+        live_state = read_iptables_state(save_cmd)
+        if live_state is None:
+            return False
+        payload = compile_iptables_restore(desired, live_state, chains)
+        if not payload:
+            return True
+        return run_firewall_cmd([restore_cmd, "--noflush"], timeout=15, ignore_errors=False, input=payload)
+
+    def apply(self, spec):
+        ruleset = build_killswitch_ruleset(spec)
+        # IPv4 and IPv6 are independent tables; commit both at once so the
+        # total apply time is the slower of the two rather than their sum
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            v4 = pool.submit(self._reconcile, "iptables-save", "iptables-restore",
+                             render_iptables_rules(ruleset, 4), KILLSWITCH_CHAINS)
+            v6 = pool.submit(self._reconcile, "ip6tables-save", "ip6tables-restore",
+                             render_iptables_rules(ruleset, 6), KILLSWITCH_CHAINS_V6)
+            ok4, ok6 = v4.result(), v6.result()
+        # A host without an IPv6 stack has nothing to protect there
+        return ok4 and (ok6 or not os.path.exists("/proc/net/if_inet6"))
+
+    @staticmethod
+    def _teardown(save_cmd, restore_cmd, chains):
+        live_state = read_iptables_state(save_cmd)
+        if live_state is None:
+            return False
+        payload = compile_iptables_teardown(live_state[1], chains)
+        return run_firewall_cmd([restore_cmd, "--noflush"], timeout=15, ignore_errors=False, input=payload)
+
+    def remove(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            v4 = pool.submit(self._teardown, "iptables-save", "iptables-restore", KILLSWITCH_CHAINS)
+            v6 = pool.submit(self._teardown, "ip6tables-save", "ip6tables-restore", KILLSWITCH_CHAINS_V6)
+            ok4, ok6 = v4.result(), v6.result()
+        return ok4 and (ok6 or not os.path.exists("/proc/net/if_inet6"))
+
+
+class NftablesBackend:
+    """Killswitch as a single `inet` nftables table loaded with `nft -f`.
+
+    Once the table exists, applies only add/delete set elements.
+    """
+
+    name = "nftables"
+    table = "an0m0s"
+
+    @staticmethod
+    def available():
+        return shutil.which("nft") is not None
+
+    def apply(self, spec):
+        ruleset = build_killswitch_ruleset(spec)
+        live = read_nft_sets(self.table)
+        if live is None:
+            payload = compile_nft_ruleset(ruleset, table=self.table)
+        else:
+            payload = compile_nft_reconcile(ruleset.sets, live, table=self.table)
+            if not payload:
+                return True
+        return run_firewall_cmd(["nft", "-f", "-"], timeout=15, ignore_errors=False, input=payload)
+
+    def remove(self):
+        # Deleting our own table is the whole teardown; other tables are untouched
+        payload = f"table inet {self.table}\ndelete table inet {self.table}\n"
+        return run_firewall_cmd(["nft", "-f", "-"], timeout=10, ignore_errors=False, input=payload)
+
+
+FIREWALL_BACKENDS = (NftablesBackend, IptablesBackend)
+
+
+def detect_firewall_backend(preferred=None):
+    """Return the first available firewall backend, preferring nftables.
+
+    `preferred` may name a backend ("nftables" or "iptables") to force it
+    when available.
+    """
+    backends = list(FIREWALL_BACKENDS)
+    if preferred:
+        backends.sort(key=lambda cls: cls.name != preferred)
+    for cls in backends:
+        if cls.available():
+            return cls()
+    return None
+
+
+# rtnetlink multicast groups and message types (linux/rtnetlink.h)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+RTM_EVENT_TYPES = {16, 17, 20, 21, 24, 25}  # NEW/DEL LINK, ADDR, ROUTE
+
+
+class NetworkChangeWatcher:
+    """Calls `callback` after route/link/address changes, debounced.
+
+    Subscribes to rtnetlink multicast groups (falling back to `ip monitor`
+    when netlink sockets are unavailable) and sleeps in a selector until the
+    kernel reports something -- there is no polling. A burst of events is
+    coalesced until `debounce` seconds pass without a new one, then the
+    callback runs once. Event counts and the time from the first event of a
+    burst to the end of the callback are kept for monitoring. When neither
+    source is available, or `ip monitor` exits, the watcher disables itself
+    and says why in `error`.
+    """
+
+    def __init__(self, callback, debounce=0.25):
+        self.callback = callback
+        self.debounce = debounce
+        self.event_count = 0
+        self.burst_count = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.source = None
+        self.error = None
+        self._thread = None
+        self._wake_r = None
+        self._wake_w = None
+        self._wake_lock = threading.Lock()
+        self._running = False
+
+    def _open_netlink(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE))
+        sock.setblocking(False)
+        return sock
+
+    @staticmethod
+    def _count_netlink_events(data):
+        count = 0
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type = struct.unpack_from("=IH", data, offset)
+            if length < 16:
+                break
+            if msg_type in RTM_EVENT_TYPES:
+                count += 1
+            offset += (length + 3) & ~3
+        return count
+
+    def start(self):
+        if self._running:
+            return
+        try:
+            source = self._open_netlink()
+            self.source = "netlink"
+        except (OSError, AttributeError):
+            try:
+                source = subprocess.Popen(
+                    ["ip", "monitor", "link", "address", "route"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                )
+            except OSError as e:
+                self._disable(f"no netlink and no `ip monitor`: {e}")
+                return
+            os.set_blocking(source.stdout.fileno(), False)
+            self.source = "ip monitor"
+        self.error = None
+        self._wake_r, self._wake_w = os.pipe()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, args=(source,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        with self._wake_lock:
+            if self._wake_w is not None:
+                try:
+                    os.write(self._wake_w, b"x")
+                except OSError:
+                    pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _disable(self, reason):
+        self.error = reason
+        self.source = None
+        print(f"Network watcher disabled: {reason}", file=sys.stderr)
+
+    def _read_events(self, source):
+        """Drain whatever is readable; returns the number of events seen.
+
+        Raises EOFError once `ip monitor` has exited.
+        """
+        count = 0
+        while True:
+            try:
+                if isinstance(source, socket.socket):
+                    data = source.recv(65536)
+                    count += self._count_netlink_events(data)
+                else:
+                    data = os.read(source.stdout.fileno(), 65536)
+                    if not data:
+                        raise EOFError
+                    count += data.count(b"\n")
+            except (BlockingIOError, InterruptedError):
+                return count
+            except OSError:
+                # ENOBUFS: events were dropped, which still means "changed"
+                return count + 1
+
+    def _run(self, source):
+        fileobj = source if isinstance(source, socket.socket) else source.stdout
+        sel = selectors.DefaultSelector()
+        sel.register(fileobj, selectors.EVENT_READ, "events")
+        sel.register(self._wake_r, selectors.EVENT_READ, "wake")
+        burst_start = None
+        try:
+            while self._running:
+                # Block indefinitely when idle; only wait `debounce` inside a burst
+                timeout = None if burst_start is None else self.debounce
+                ready = sel.select(timeout)
+                if not self._running:
+                    break
+                if not ready:
+                    self._fire(burst_start)
+                    burst_start = None
+                    continue
+                for key, _ in ready:
+                    if key.data == "events":
+                        try:
+                            count = self._read_events(source)
+                        except EOFError:
+                            # A readable EOF would spin the selector forever.
+                            # Re-check once, since changes go unseen from now on
+                            self._fire(burst_start or time.monotonic())
+                            self._disable(f"`ip monitor` exited ({source.wait()})")
+                            return
+                        if count:
+                            self.event_count += count
+                            if burst_start is None:
+                                burst_start = time.monotonic()
+        finally:
+            sel.close()
+            if isinstance(source, socket.socket):
+                source.close()
+            else:
+                source.terminate()
+                source.stdout.close()
+            self._running = False
+            os.close(self._wake_r)
+            with self._wake_lock:
+                os.close(self._wake_w)
+                self._wake_w = None
+
+    def _fire(self, burst_start):
+        try:
+            self.callback()
+        except Exception:
+            pass
+        latency = time.monotonic() - burst_start
+        self.burst_count += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def stats(self):
+        """Monitoring counters: events seen, bursts handled, latencies (s)"""
+        return {
+            "source": self.source,
+            "error": self.error,
+            "events": self.event_count,
+            "bursts": self.burst_count,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+        }
+
+
+# Spawn-free status probing: everything below reads /proc and /sys (plus one
+# ioctl for the IPv4 address) instead of forking pgrep/ip
+PROC_ROOT = "/proc"
+SYS_NET = "/sys/class/net"
+RTF_UP = 0x0001
+RTF_REJECT = 0x0200
+IFF_UP = 0x1
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+
+
+def _read_small_file(path, size=4096):
+    """Bytes of a small /proc or /sys file, or None; unbuffered (one read)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.read(fd, size)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def read_process_stat(pid, proc=PROC_ROOT):
+    """(command name, state letter) of `pid` from /proc/<pid>/stat, or None"""
+    data = _read_small_file(f"{proc}/{pid}/stat")
+    if data is None:
+        return None
+    # The name may itself contain spaces and parentheses
+    start = data.find(b"(")
+    end = data.rfind(b")")
+    if start < 0 or end < start:
+        return None
+    return data[start + 1:end].decode(errors="replace"), data[end + 2:end + 3].decode()
+
+
+def find_processes(name, proc=PROC_ROOT):
+    """PIDs of live processes whose command name is exactly `name` (pgrep -x)"""
+    pids = []
+    try:
+        entries = os.listdir(proc)
+    except OSError:
+        return pids
+    # The kernel truncates command names to 15 characters
+    name = name[:15]
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        stat = read_process_stat(entry, proc)
+        if stat is not None and stat[0] == name and stat[1] not in ("Z", "X", ""):
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def read_link(iface, sys_net=SYS_NET):
+    """{"operstate", "up"} of `iface` from /sys/class/net, or None if it does not exist"""
+    operstate = _read_small_file(f"{sys_net}/{iface}/operstate")
+    flags = _read_small_file(f"{sys_net}/{iface}/flags")
+    if operstate is None or flags is None:
+        return None
+    operstate = operstate.decode().strip()
+    try:
+        flags = int(flags, 16)
+    except ValueError:
+        return None
+    # tun devices report "unknown" while up: IFF_UP is what counts
+    up = bool(flags & IFF_UP) and operstate not in ("down", "lowerlayerdown", "notpresent")
+    return {"operstate": operstate, "up": up}
+
+
+def read_ipv4_address(iface):
+    """Primary IPv4 address of `iface` as "addr/prefix", or None"""
+    name = struct.pack("256s", iface.encode()[:15])
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            address = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, name)[20:24]
+            netmask = fcntl.ioctl(sock.fileno(), SIOCGIFNETMASK, name)[20:24]
+    except OSError:
+        return None
+    prefix = bin(int.from_bytes(netmask, "big")).count("1")
+    return f"{socket.inet_ntoa(address)}/{prefix}"
+
+
+def read_ipv6_addresses(iface=None, proc_net=PROC_ROOT + "/net"):
+    """[(iface, "addr/prefix", scope)] from /proc/net/if_inet6, optionally for one iface"""
+    addresses = []
+    try:
+        with open(f"{proc_net}/if_inet6") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return addresses
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 6 or (iface is not None and fields[5] != iface):
+            continue
+        address = ipaddress.IPv6Address(bytes.fromhex(fields[0]))
+        scope = {0x00: "global", 0x10: "host", 0x20: "link", 0x40: "site"}.get(int(fields[3], 16), fields[3])
+        addresses.append((fields[5], f"{address}/{int(fields[2], 16)}", scope))
+    return addresses
+
+
+def read_default_route(family, proc_net=PROC_ROOT + "/net"):
+    """(iface, gateway) of the lowest-metric default route for IP version `family`"""
+    best = None
+    try:
+        with open(f"{proc_net}/route" if family == 4 else f"{proc_net}/ipv6_route") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None, None
+    if family == 4:
+        # Iface Destination Gateway Flags RefCnt Use Metric Mask ... (hex, little endian)
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) < 8 or fields[1] != "00000000" or fields[7] != "00000000":
+                continue
+            flags = int(fields[3], 16)
+            if not flags & RTF_UP or flags & RTF_REJECT:
+                continue
+            gateway = int(fields[2], 16)
+            route = (int(fields[6]), fields[0],
+                     socket.inet_ntoa(struct.pack("<I", gateway)) if gateway else None)
+            if best is None or route[0] < best[0]:
+                best = route
+    else:
+        # Destination Prefix Source Prefix NextHop Metric RefCnt Use Flags Iface
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 10 or fields[1] != "00" or int(fields[0], 16):
+                continue
+            flags = int(fields[8], 16)
+            # The kernel's "unreachable default" sits on lo with RTF_REJECT
+            if not flags & RTF_UP or flags & RTF_REJECT or fields[9] == "lo":
+                continue
+            nexthop = int(fields[4], 16)
+            route = (int(fields[5], 16), fields[9],
+                     str(ipaddress.IPv6Address(nexthop)) if nexthop else None)
+            if best is None or route[0] < best[0]:
+                best = route
+    return (best[1], best[2]) if best is not None else (None, None)
+
+
+def probe_status(process_name="openvpn", interfaces=(), proc=PROC_ROOT, sys_net=SYS_NET):
+    """Status snapshot (processes, interfaces, default routes) with no process spawn"""
+    proc_net = f"{proc}/net"
+    links = {}
+    for iface in interfaces:
+        link = read_link(iface, sys_net)
+        if link is not None:
+            link["ipv4"] = read_ipv4_address(iface)
+            link["ipv6"] = [address for _, address, _ in read_ipv6_addresses(iface, proc_net)]
+        links[iface] = link
+    return {
+        "pids": find_processes(process_name, proc),
+        "interfaces": links,
+        "default_route": read_default_route(4, proc_net),
+        "default_route6": read_default_route(6, proc_net),
+    }
+
+
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+NLMSG_ERROR = 2
+NLM_F_REQUEST = 0x1
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PREFSRC = 7
+# rtm_type values that mean "dropped here", not "sent somewhere"
+RTN_BLOCKED = {6: "blackhole", 7: "unreachable", 8: "prohibit"}
+_NLMSGHDR = struct.Struct("=IHHII")
+_RTMSG = struct.Struct("=BBBBBBBBI")
+_RTATTR = struct.Struct("=HH")
+
+
+def build_route_get_request(address, seq=1):
+    """RTM_GETROUTE request asking where the kernel would send `address`"""
+    address = ipaddress.ip_address(address)
+    family = socket.AF_INET if address.version == 4 else socket.AF_INET6
+    packed = address.packed
+    body = _RTMSG.pack(family, len(packed) * 8, 0, 0, 0, 0, 0, 0, 0)
+    body += _RTATTR.pack(_RTATTR.size + len(packed), RTA_DST) + packed
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(body), RTM_GETROUTE, NLM_F_REQUEST, seq, 0) + body
+
+
+def parse_route_reply(data):
+    """{"oif", "gateway", "prefsrc", "type"} from an RTM_NEWROUTE reply; OSError for a netlink error"""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, kind = _NLMSGHDR.unpack_from(data, offset)[:2]
+        if length < _NLMSGHDR.size:
+            break
+        if kind == NLMSG_ERROR:
+            error = struct.unpack_from("=i", data, offset + _NLMSGHDR.size)[0]
+            if error:
+                raise OSError(-error, os.strerror(-error))
+        elif kind == RTM_NEWROUTE:
+            fields = _RTMSG.unpack_from(data, offset + _NLMSGHDR.size)
+            family = socket.AF_INET if fields[0] == socket.AF_INET else socket.AF_INET6
+            route = {"oif": None, "gateway": None, "prefsrc": None, "type": fields[7]}
+            attr = offset + _NLMSGHDR.size + _RTMSG.size
+            end = offset + length
+            while attr + _RTATTR.size <= end:
+                attr_len, attr_type = _RTATTR.unpack_from(data, attr)
+                if attr_len < _RTATTR.size:
+                    break
+                value = bytes(data[attr + _RTATTR.size:attr + attr_len])
+                if attr_type == RTA_OIF:
+                    route["oif"] = struct.unpack("=I", value[:4])[0]
+                elif attr_type == RTA_GATEWAY:
+                    route["gateway"] = socket.inet_ntop(family, value)
+                elif attr_type == RTA_PREFSRC:
+                    route["prefsrc"] = socket.inet_ntop(family, value)
+                attr += (attr_len + 3) & ~3
+            return route
+        offset += (length + 3) & ~3
+    raise OSError(errno.EPROTO, "no route in netlink reply")
+
+
+def route_get(address, timeout=1.0):
+    """Where the kernel would send a packet to `address` (like `ip route get`, no spawn).
+
+    Returns {"dev", "oif", "gateway", "prefsrc", "type"}; raises OSError
+    (e.g. ENETUNREACH) when there is no route.
+    """
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE) as sock:
+        sock.settimeout(timeout)
+        sock.send(build_route_get_request(address))
+        route = parse_route_reply(sock.recv(65536))
+    try:
+        route["dev"] = socket.if_indextoname(route["oif"]) if route["oif"] else None
+    except OSError:
+        route["dev"] = None
+    return route
+
+
+def is_stub_resolver(servers):
+    """True if `servers` is only a local stub such as systemd-resolved's 127.0.0.53"""
+
+    def is_loopback(server):
+        try:
+            return ipaddress.ip_address(server.split("%")[0]).is_loopback
+        except ValueError:
+            return False
+
+    return bool(servers) and all(is_loopback(server) for server in servers)
+
+
+def system_resolvers(resolv_conf="/etc/resolv.conf", resolved_conf="/run/systemd/resolve/resolv.conf"):
+    """(configured, upstream) resolvers: resolv.conf's, and those systemd-resolved forwards to.
+
+    When resolv.conf only points at a local stub (127.0.0.53), the servers
+    queries really go to are the ones resolved lists in `resolved_conf`.
+    """
+    configured = read_resolv_conf_nameservers(resolv_conf)
+    upstream = configured
+    if is_stub_resolver(configured):
+        upstream = read_resolv_conf_nameservers(resolved_conf)
+    return configured, upstream
+
+
+def measure_resolver_latency(servers, name="example.com", attempts=3, timeout=1.0):
+    """{server: median time for an A query in s, or None if it never answered}.
+
+    All servers are probed concurrently; the first query usually warms the
+    resolver's cache, so the median is what a lookup normally costs.
+    """
+    def probe(server):
+        times = []
+        for _ in range(attempts):
+            start = time.perf_counter()
+            try:
+                query_dns(name, DNS_TYPE_A, server, timeout=timeout)
+            except OSError:
+                continue
+            times.append(time.perf_counter() - start)
+        return sorted(times)[len(times) // 2] if times else None
+
+    servers = list(dict.fromkeys(servers))
+    if not servers:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(servers)) as pool:
+        return dict(zip(servers, pool.map(probe, servers)))
+
+
+RESOLV_CONF_MARKER = "# Generated by An0m0s VPN for the tunnel's resolvers"
+
+
+class DnsConfigurator:
+    """Points the system at the tunnel's resolvers and puts everything back.
+
+    With systemd-resolved (resolv.conf pointing at its stub) the servers
+    become per-link DNS on the tunnel device with the "~." routing domain,
+    so every query goes to them; resolved drops them with the device.
+    Otherwise resolv.conf is replaced atomically after a backup of the
+    original (file or symlink) that restore() moves back. recover() undoes
+    a rewrite left behind by a crash.
+    """
+
+    def __init__(self, resolv_conf="/etc/resolv.conf", backup_path=None, resolved_run="/run/systemd/resolve"):
+        self.resolv_conf = resolv_conf
+        self.backup_path = backup_path or resolv_conf + ".an0m0s-backup"
+        self.resolved_run = resolved_run
+        # "resolved" or "resolv.conf" while the tunnel's DNS is applied
+        self.method = None
+        self.dev = None
+        self.servers = []
+
+    def uses_resolved(self):
+        configured, _ = system_resolvers(self.resolv_conf, os.path.join(self.resolved_run, "resolv.conf"))
+        return (shutil.which("resolvectl") is not None and os.path.isdir(self.resolved_run)
+                and is_stub_resolver(configured))
+
+    def apply(self, dev, servers, domains=()):
+        """Use `servers` for all lookups; returns the method used, or None on failure"""
+        if self.method == "resolved" and self.dev != dev:
+            self.restore()
+        if self.method != "resolv.conf" and self.uses_resolved():
+            if (run_firewall_cmd(["resolvectl", "dns", dev] + list(servers))
+                    and run_firewall_cmd(["resolvectl", "domain", dev, "~."] + list(domains))):
+                # Older systemd has no default-route switch; "~." does the job there
+                run_firewall_cmd(["resolvectl", "default-route", dev, "true"], ignore_errors=True)
+                self.method, self.dev, self.servers = "resolved", dev, list(servers)
+                return self.method
+        lines = [RESOLV_CONF_MARKER]
+        lines.extend(f"nameserver {server}" for server in servers[:3])
+        if domains:
+            lines.append("search " + " ".join(domains))
+        try:
+            self._backup()
+            self._write(self.resolv_conf, "\n".join(lines) + "\n")
+        except OSError:
+            return None
+        self.method, self.dev, self.servers = "resolv.conf", dev, list(servers)
+        return self.method
+
+    def restore(self):
+        """Undo apply(); True if the original configuration is back"""
+        method, dev = self.method, self.dev
+        self.method, self.dev, self.servers = None, None, []
+        if method == "resolved":
+            # Fails harmlessly when the device is already gone
+            run_firewall_cmd(["resolvectl", "revert", dev], ignore_errors=True)
+            return True
+        if method == "resolv.conf" and os.path.lexists(self.backup_path):
+            try:
+                os.replace(self.backup_path, self.resolv_conf)
+            except OSError:
+                return False
+        return True
+
+    def recover(self):
+        """Put back a resolv.conf that a crashed run left rewritten"""
+        try:
+            with open(self.resolv_conf) as f:
+                ours = f.readline().rstrip("\n") == RESOLV_CONF_MARKER
+        except OSError:
+            ours = False
+        if ours and os.path.lexists(self.backup_path):
+            os.replace(self.backup_path, self.resolv_conf)
+            return True
+        return False
+
+    def _backup(self):
+        # An existing backup is the original (a reconnect or a crash rewrote
+        # resolv.conf since); never overwrite it with our own file
+        if os.path.lexists(self.backup_path) or not os.path.lexists(self.resolv_conf):
+            return
+        directory = os.path.dirname(os.path.abspath(self.backup_path))
+        tmp = os.path.join(directory, f".an0m0s-backup.{os.getpid()}")
+        if os.path.islink(self.resolv_conf):
+            os.symlink(os.readlink(self.resolv_conf), tmp)
+        else:
+            shutil.copy2(self.resolv_conf, tmp)
+        os.replace(tmp, self.backup_path)
+
+    @staticmethod
+    def _write(path, content):
+        fd, tmp = tempfile.mkstemp(prefix=".resolv.conf.", dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def tunnel_interfaces(sys_net=SYS_NET):
+    """tun/tap interfaces that are up"""
+    try:
+        names = sorted(os.listdir(sys_net))
+    except OSError:
+        return []
+    return [name for name in names
+            if name.startswith(("tun", "tap")) and (read_link(name, sys_net) or {}).get("up")]
+
+
+def leak_test_main(argv):
+    """`--leak-test`: run the leak checks against the live tunnel and print the report"""
+    parser = argparse.ArgumentParser(prog="An0m0s_vpn.py --leak-test",
+                                     description="Check for DNS, IPv6 and route leaks outside the VPN tunnel")
+    parser.add_argument("--leak-test", action="store_true", required=True)
+    parser.add_argument("--iface", action="append", help="tunnel interface (default: every tun/tap that is up)")
+    parser.add_argument("--killswitch", action="store_true", help="paths outside the tunnel are firewalled")
+    args = parser.parse_args(argv)
+    report = run_leak_checks(args.iface or tunnel_interfaces(), killswitch=args.killswitch)
+    print(report.format())
+    return 0 if report.passed else 1
+
+
+LEAK_PASS = "PASS"
+LEAK_WARN = "WARN"
+LEAK_FAIL = "FAIL"
+# Public destinations whose route stands for "the internet"
+LEAK_TEST_DESTINATIONS = ("1.1.1.1", "9.9.9.9", "2606:4700:4700::1111")
+
+
+class LeakReport:
+    """Result of run_leak_checks(): (check, status, detail) rows"""
+
+    __slots__ = ("results", "elapsed")
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def passed(self):
+        return all(status != LEAK_FAIL for _, status, _ in self.results)
+
+    def format(self):
+        lines = [f"{status:<4}  {check}: {detail}" for check, status, detail in self.results]
+        lines.append("")
+        lines.append(f"{'No leaks found' if self.passed else 'LEAKS FOUND'} ({self.elapsed * 1000:.0f} ms)")
+        return "\n".join(lines)
+
+
+def run_leak_checks(tunnel_ifaces, destinations=LEAK_TEST_DESTINATIONS, killswitch=False,
+                    route_lookup=route_get, proc=PROC_ROOT, resolv_conf="/etc/resolv.conf",
+                    resolved_conf="/run/systemd/resolve/resolv.conf"):
+    """Check DNS, IPv6 and route leaks against the tunnel interfaces; returns a LeakReport.
+
+    Every resolver and test destination is routed (concurrently) through
+    `route_lookup`; anything the kernel would send out of a non-tunnel
+    interface is a leak. With the killswitch on such paths are reported
+    as WARN instead, because the firewall drops the packets.
+    """
+    start = time.monotonic()
+    tunnel_ifaces = set(tunnel_ifaces)
+    outside = LEAK_WARN if killswitch else LEAK_FAIL
+    results = []
+    if not tunnel_ifaces:
+        results.append(("tunnel", LEAK_FAIL, "no tunnel interface is up"))
+
+    configured, upstream = system_resolvers(resolv_conf, resolved_conf)
+    if not upstream:
+        results.append(("DNS", LEAK_WARN, "no resolvers found"))
+    elif upstream != configured:
+        results.append(("DNS", LEAK_PASS, f"{', '.join(configured)} forwards to {', '.join(upstream)}"))
+    else:
+        results.append(("DNS", LEAK_PASS, f"resolv.conf uses {', '.join(upstream)}"))
+
+    targets = list(dict.fromkeys([s.split("%")[0] for s in upstream] + list(destinations)))
+    routes = {}
+    if targets:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            for address, future in [(a, pool.submit(route_lookup, a)) for a in targets]:
+                try:
+                    routes[address] = future.result()
+                except (OSError, ValueError) as e:
+                    routes[address] = e
+
+    def route_row(check, address):
+        route = routes[address]
+        if isinstance(route, OSError) and route.errno in (errno.ENETUNREACH, errno.EHOSTUNREACH):
+            return check, LEAK_PASS, "unreachable (nothing to leak)"
+        if isinstance(route, Exception):
+            return check, LEAK_WARN, f"route lookup failed: {route}"
+        if route.get("type") in RTN_BLOCKED:
+            return check, LEAK_PASS, f"{RTN_BLOCKED[route['type']]} route (nothing to leak)"
+        dev = route.get("dev")
+        if dev in tunnel_ifaces:
+            return check, LEAK_PASS, f"via {dev}"
+        if dev == "lo":
+            return check, LEAK_PASS, "local"
+        via = f"via {dev}" + (f" gateway {route['gateway']}" if route.get("gateway") else "")
+        return check, outside, f"{via}, outside the tunnel" + (" (dropped by the killswitch)" if killswitch else "")
+
+    for server in upstream:
+        results.append(route_row(f"DNS {server}", server.split("%")[0]))
+    for destination in destinations:
+        results.append(route_row(f"route {destination}", destination))
+
+    # IPv6: a global address outside the tunnel only leaks if IPv6 traffic
+    # is routed out of it
+    proc_net = f"{proc}/net"
+    global6 = [(iface, address) for iface, address, scope in read_ipv6_addresses(None, proc_net)
+               if scope == "global" and iface not in tunnel_ifaces]
+    default6 = read_default_route(6, proc_net)[0]
+    probes6 = [d for d in destinations if ipaddress.ip_address(d).version == 6]
+    if not global6 and (default6 is None or default6 in tunnel_ifaces):
+        results.append(("IPv6", LEAK_PASS, "no global IPv6 outside the tunnel"))
+    elif probes6:
+        status = route_row("IPv6", probes6[0])[1]
+        where = f"{global6[0][1]} on {global6[0][0]}" if global6 else "no global address"
+        results.append(("IPv6", status, f"{where}, default route via {default6 or 'none'}; "
+                                        f"{probes6[0]} {route_row('', probes6[0])[2]}"))
+    else:
+        results.append(("IPv6", outside, f"default route via {default6} outside the tunnel"))
+
+    return LeakReport(results, time.monotonic() - start)
+
+
+LINK_STATISTICS = ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+                   "rx_errors", "tx_errors", "rx_dropped", "tx_dropped")
+
+
+def read_link_statistics(iface, sys_net=SYS_NET):
+    """{counter: value} from /sys/class/net/<iface>/statistics, or None if it does not exist"""
+    counters = {}
+    for name in LINK_STATISTICS:
+        data = _read_small_file(f"{sys_net}/{iface}/statistics/{name}", 32)
+        if data is None:
+            return None
+        counters[name] = int(data)
+    return counters
+
+
+def format_rate(value):
+    """Bytes per second as a short human readable string"""
+    if value < 1024:
+        return f"{value:.0f} B/s"
+    for unit in ("KB/s", "MB/s", "GB/s"):
+        value /= 1024
+        if value < 1024 or unit == "GB/s":
+            return f"{value:.1f} {unit}"
+
+
+class RateSeries:
+    """Fixed-size ring of (rx, tx) rates in bytes/s, backed by two arrays.
+
+    Appending overwrites the oldest slot, so memory stays constant no
+    matter how long the app runs.
+    """
+
+    __slots__ = ("capacity", "rx", "tx", "_next", "_count")
+
+    def __init__(self, capacity=120):
+        self.capacity = capacity
+        self.rx = array.array("d", bytes(8 * capacity))
+        self.tx = array.array("d", bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, rx, tx):
+        self.rx[self._next] = rx
+        self.tx[self._next] = tx
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def clear(self):
+        for i in range(self.capacity):
+            self.rx[i] = self.tx[i] = 0.0
+        self._next = 0
+        self._count = 0
+
+    def ordered(self, values):
+        """The filled part of `values` (self.rx or self.tx), oldest first"""
+        start = (self._next - self._count) % self.capacity
+        if start + self._count <= self.capacity:
+            return values[start:start + self._count]
+        return values[start:] + values[:self._next]
+
+    def latest(self):
+        if not self._count:
+            return 0.0, 0.0
+        last = (self._next - 1) % self.capacity
+        return self.rx[last], self.tx[last]
+
+    def peak(self):
+        # Unfilled slots are zero, so they never win
+        return max(max(self.rx), max(self.tx))
+
+
+class ThroughputSampler:
+    """Turns a link's byte counters into rates; call sample() at the rate you want"""
+
+    def __init__(self, capacity=120, sys_net=SYS_NET, clock=time.monotonic):
+        self.series = RateSeries(capacity)
+        self.sys_net = sys_net
+        self.clock = clock
+        self.iface = None
+        # Latest raw counters (packets, errors, drops included)
+        self.counters = None
+        self._last = None
+
+    def reset(self):
+        self.iface = None
+        self.counters = None
+        self._last = None
+        self.series.clear()
+
+    def sample(self, iface):
+        """Read `iface`'s counters and append its rates; False if it does not exist"""
+        if iface != self.iface:
+            self.reset()
+            self.iface = iface
+        counters = read_link_statistics(iface, self.sys_net)
+        now = self.clock()
+        if counters is None:
+            self.counters = None
+            self._last = None
+            return False
+        rx, tx = counters["rx_bytes"], counters["tx_bytes"]
+        if self._last is not None and now > self._last[0]:
+            elapsed = now - self._last[0]
+            # Counters start over when the device is recreated
+            self.series.append(max(0, rx - self._last[1]) / elapsed, max(0, tx - self._last[2]) / elapsed)
+        self._last = (now, rx, tx)
+        self.counters = counters
+        return True
+
+
+# Logged (from verb 3 on) with every option the server pushes
+OPENVPN_PUSH_REPLY = re.compile(r"PUSH: Received control message: '(PUSH_REPLY,[^']*)'")
+# (kind, pattern) pairs for OpenVpnLogReader events; the first match wins
+OPENVPN_LOG_EVENTS = (
+    ("connected", re.compile(r"Initialization Sequence Completed")),
+    ("auth_failed", re.compile(r"AUTH_FAILED")),
+    ("fatal", re.compile(r"Exiting due to fatal error|Options error")),
+    ("tls_error", re.compile(r"TLS Error|TLS handshake failed")),
+    ("resolve_error", re.compile(r"RESOLVE: Cannot resolve host address: (\S+)")),
+    ("reconnecting", re.compile(r"SIGUSR1\[|Restart pause")),
+    ("peer", re.compile(r"Peer Connection Initiated with \[AF_INET6?\]([^\s]+)")),
+    ("device", re.compile(r"TUN/TAP device (\S+) opened")),
+    ("push_reply", OPENVPN_PUSH_REPLY),
+    ("exiting", re.compile(r"SIGTERM\[|SIGINT\[|process exiting")),
+)
+OPENVPN_ERROR_EVENTS = frozenset(("auth_failed", "fatal", "tls_error", "resolve_error"))
+_OPENVPN_TIMESTAMP = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d ")
+_OPENVPN_ERROR_LINE = re.compile(r"ERROR|AUTH_FAILED|fatal|TLS Error|failed|Cannot ", re.IGNORECASE)
+_OPENVPN_WARNING_LINE = re.compile(r"WARNING|DEPRECATED|Restart pause|SIGUSR1\[|Inactivity timeout")
+OPENVPN_LOG_LEVELS = ("info", "warning", "error")
+
+
+def parse_pushed_dns(push_reply):
+    """(servers, domains) from a PUSH_REPLY's dhcp-option DNS/DOMAIN and `dns` options"""
+    servers = []
+    domains = []
+    for option in push_reply.split(","):
+        args = option.split()
+        if len(args) >= 3 and args[0] == "dhcp-option":
+            if args[1] in ("DNS", "DNS6"):
+                servers.append(args[2])
+            elif args[1] in ("DOMAIN", "DOMAIN-SEARCH", "ADAPTER_DOMAIN_SUFFIX"):
+                domains.append(args[2])
+        elif len(args) >= 5 and args[:2] == ["dns", "server"] and args[3] == "address":
+            # OpenVPN 2.6: dns server <priority> address <addr>[:port] ...
+            for address in args[4:]:
+                address = address.split("#")[0]
+                if address.startswith("["):
+                    address = address[1:].partition("]")[0]
+                elif address.count(":") == 1:
+                    address = address.partition(":")[0]
+                servers.append(address)
+        elif len(args) >= 3 and args[:2] == ["dns", "search-domains"]:
+            domains.extend(args[2:])
+    valid = []
+    for server in servers:
+        try:
+            address = str(ipaddress.ip_address(server))
+        except ValueError:
+            continue
+        if address not in valid:
+            valid.append(address)
+    return valid, list(dict.fromkeys(domains))
+
+
+def openvpn_log_level(text, stream="stdout"):
+    """Classify an openvpn log line as "error", "warning" or "info" """
+    if _OPENVPN_ERROR_LINE.search(text):
+        return "error"
+    if stream == "stderr" or _OPENVPN_WARNING_LINE.search(text):
+        return "warning"
+    return "info"
+
+
+class OpenVpnLogBuffer:
+    """Ring buffer of (time, stream, level, text) openvpn log lines.
+
+    A Tunnel keeps one for its whole life and every attempt's reader
+    appends to it, so the log panel's filter and search see all attempts;
+    separator() marks where an attempt begins. `line_count` counts every
+    line ever added, for lines_since().
+    """
+
+    def __init__(self, capacity=2000):
+        self.lines = collections.deque(maxlen=capacity)
+        self.line_count = 0
+        self._lock = threading.Lock()
+
+    def append(self, stream, level, text, now=None):
+        with self._lock:
+            self.lines.append((time.time() if now is None else now, stream, level, text))
+            self.line_count += 1
+
+    def separator(self, text):
+        """Add a "separator" stream line, shown whatever the panel filters"""
+        self.append("separator", "info", text)
+
+    def tail(self, count=None):
+        """Snapshot of the last `count` (time, stream, level, text) lines"""
+        with self._lock:
+            lines = list(self.lines)
+        return lines if count is None else lines[-count:]
+
+    def lines_since(self, seen):
+        """Lines added after the first `seen`; returns (line_count, lines).
+
+        Lines that already left the ring buffer are skipped.
+        """
+        with self._lock:
+            new = min(self.line_count - seen, len(self.lines))
+            lines = list(itertools.islice(self.lines, len(self.lines) - new, None)) if new > 0 else []
+            return self.line_count, lines
+
+
+class OpenVpnLogReader:
+    """Drains openvpn's stdout/stderr so the process never blocks on a full pipe.
+
+    One thread waits on both pipes in a selector and appends complete lines
+    to an OpenVpnLogBuffer (`buffer`, or its own of `capacity` lines), so
+    memory stays bounded however long the tunnel runs.
+    Lines are optionally appended to `rotate_path`
+    (rotated at `max_bytes`, keeping `backups` old files). Lines matching
+    OPENVPN_LOG_EVENTS are kept as (time, kind, detail, line) events and
+    passed to `on_event` (on the reader thread).
+    """
+
+    def __init__(self, stdout, stderr=None, capacity=2000, on_event=None,
+                 rotate_path=None, max_bytes=1048576, backups=3, buffer=None):
+        self.streams = [s for s in (stdout, stderr) if s is not None]
+        self.on_event = on_event
+        self.buffer = buffer if buffer is not None else OpenVpnLogBuffer(capacity)
+        self.events = collections.deque(maxlen=200)
+        self.rotate_path = rotate_path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def line_count(self):
+        return self.buffer.line_count
+
+    def tail(self, count=None):
+        return self.buffer.tail(count)
+
+    def lines_since(self, seen):
+        return self.buffer.lines_since(seen)
+
+    def last_event(self, kinds=None):
+        """Most recent event, optionally only of the given kinds"""
+        with self._lock:
+            for event in reversed(self.events):
+                if kinds is None or event[1] in kinds:
+                    return event
+        return None
+
+    def _run(self):
+        sel = selectors.DefaultSelector()
+        partial = {}
+        for index, stream in enumerate(self.streams):
+            fd = stream.fileno()
+            os.set_blocking(fd, False)
+            sel.register(fd, selectors.EVENT_READ, "stdout" if index == 0 else "stderr")
+            partial[fd] = b""
+        try:
+            while partial:
+                for key, _ in sel.select():
+                    fd = key.fd
+                    try:
+                        data = os.read(fd, 65536)
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    except OSError:
+                        data = b""
+                    if not data:
+                        # EOF: flush an unterminated last line
+                        if partial[fd]:
+                            self._add_line(key.data, partial[fd])
+                        sel.unregister(fd)
+                        del partial[fd]
+                        continue
+                    *lines, partial[fd] = (partial[fd] + data).split(b"\n")
+                    for line in lines:
+                        self._add_line(key.data, line)
+        finally:
+            sel.close()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _add_line(self, stream, raw):
+        text = raw.decode("utf-8", errors="replace").rstrip("\r")
+        now = time.time()
+        event = None
+        message = _OPENVPN_TIMESTAMP.sub("", text, count=1)
+        for kind, pattern in OPENVPN_LOG_EVENTS:
+            match = pattern.search(message)
+            if match:
+                event = (now, kind, match.group(1) if match.groups() else "", text)
+                break
+        self.buffer.append(stream, openvpn_log_level(message, stream), text, now)
+        if event is not None:
+            with self._lock:
+                self.events.append(event)
+        if self.rotate_path:
+            self._write(text)
+        if event is not None and self.on_event is not None:
+            try:
+                self.on_event(*event)
+            except Exception:
+                pass
+
+    def _write(self, text):
         try:
-            # Use pkexec and pass GUI env so the window can open as root
-            display = os.environ.get('DISPLAY', '')
-            xauth = os.environ.get('XAUTHORITY', '')
-            args = ['pkexec', 'env', f'DISPLAY={display}', f'XAUTHORITY={xauth}', sys.executable] + sys.argv
-            os.execvp('pkexec', args)
-        except Exception as e:
-            sys.exit(1)
+            if self._file is None:
+                self._file = open(self.rotate_path, "a", encoding="utf-8")
+            self._file.write(text + "\n")
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._file.close()
+                self._file = None
+                for index in range(self.backups - 1, 0, -1):
+                    source = f"{self.rotate_path}.{index}"
+                    if os.path.exists(source):
+                        os.replace(source, f"{self.rotate_path}.{index + 1}")
+                if self.backups > 0:
+                    os.replace(self.rotate_path, f"{self.rotate_path}.1")
+                else:
+                    os.unlink(self.rotate_path)
+        except OSError:
+            # Disk trouble must not stop the draining
+            self.rotate_path = None
+
+
+class ProcessExitWatcher:
+    """Reports the exit of a child process within milliseconds, without polling.
+
+    Waits on a pidfd (Linux 5.3+), which becomes readable when the process
+    exits, together with a wake pipe for stop(). Without pidfd support a
+    thread blocks in waitpid instead. Either way `callback(returncode)`
+    runs once, on the watcher thread, unless stop() was called first.
+    """
+
+    def __init__(self, process, callback):
+        self.process = process
+        self.callback = callback
+        self.mechanism = None
+        self.started_at = None
+        self.exited_at = None
+        self.returncode = None
+        self._thread = None
+        self._wake_r = None
+        self._wake_w = None
+        # Guards _wake_w: stop() must never write to it once closed (the
+        # descriptor number may already belong to another file)
+        self._wake_lock = threading.Lock()
+        self._cancelled = False
+        self._exited = threading.Event()
+
+    @property
+    def runtime(self):
+        """Seconds the process ran after start(), or None while it runs"""
+        if self.exited_at is None or self.started_at is None:
+            return None
+        return self.exited_at - self.started_at
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.started_at = time.monotonic()
+        try:
+            pidfd = os.pidfd_open(self.process.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+        if pidfd is not None:
+            self.mechanism = "pidfd"
+            self._wake_r, self._wake_w = os.pipe()
+            self._thread = threading.Thread(target=self._wait_pidfd, args=(pidfd,), daemon=True)
+        else:
+            self.mechanism = "waitpid"
+            self._thread = threading.Thread(target=self._wait_blocking, daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """Block until the process has exited (and been reaped); False on timeout"""
+        return self._exited.wait(timeout)
+
+    def stop(self):
+        """Stop watching; the callback will not run"""
+        self._cancelled = True
+        with self._wake_lock:
+            if self._wake_w is not None:
+                try:
+                    os.write(self._wake_w, b"x")
+                except OSError:
+                    pass
+
+    def _wait_pidfd(self, pidfd):
+        sel = selectors.DefaultSelector()
+        sel.register(pidfd, selectors.EVENT_READ, "exit")
+        sel.register(self._wake_r, selectors.EVENT_READ, "wake")
+        try:
+            while True:
+                ready = sel.select()
+                if any(key.data == "exit" for key, _ in ready):
+                    break
+                if self._cancelled:
+                    # Nobody reaps it now; wait() falls back to the process
+                    threading.Thread(target=self._wait_blocking, daemon=True).start()
+                    return
+        finally:
+            sel.close()
+            os.close(pidfd)
+            os.close(self._wake_r)
+            with self._wake_lock:
+                os.close(self._wake_w)
+                self._wake_w = None
+        # Already exited: this only reaps it
+        self._finish(self.process.wait())
+
+    def _wait_blocking(self):
+        self._finish(self.process.wait())
+
+    def _finish(self, returncode):
+        self.exited_at = time.monotonic()
+        self.returncode = returncode
+        self._exited.set()
+        if self._cancelled:
+            return
+        try:
+            self.callback(returncode)
+        except Exception:
+            pass
+
+
+def stop_openvpn(process, exit_watcher, management=None, timeout=5.0):
+    """Stop one openvpn we started: SIGTERM, wait, SIGKILL only on timeout.
+
+    SIGTERM goes over the management socket when it is connected (else as a
+    signal), which lets openvpn send its exit notification to the server.
+    Returns as soon as `exit_watcher` sees the process gone, as
+    (seconds taken, whether SIGKILL was needed). Only this PID is signalled.
+    """
+    started = time.monotonic()
+    escalated = False
+    if not exit_watcher.wait(0):
+        if management is None or not management.send("signal SIGTERM"):
+            process.terminate()
+        if not exit_watcher.wait(timeout):
+            escalated = True
+            process.kill()
+            exit_watcher.wait(2.0)
+    return time.monotonic() - started, escalated
+
+
+def make_management_socket_path():
+    """Path for the management socket inside a fresh 0700 directory"""
+    directory = tempfile.mkdtemp(prefix="an0m0s-mgmt-")
+    os.chmod(directory, 0o700)
+    return os.path.join(directory, "management.sock")
+
+
+class ManagementClient:
+    """Client for OpenVPN's management interface on a Unix socket.
+
+    OpenVPN is started with `--management <path> unix --management-hold`,
+    so it waits for this client before doing anything and no event is
+    missed. The reader thread enables state, byte count and log
+    notifications, releases the hold when asked and turns `>STATE:`,
+    `>BYTECOUNT:`, `>LOG:` and `>HOLD:` lines into attributes and
+    `on_event(kind, fields)` calls (on the reader thread); a `>LOG:` line
+    with the server's PUSH_REPLY is also reported as "push_reply". With
+    `--management-query-remote`, `>REMOTE:` prompts are answered by
+    skipping ahead to `preferred_remote` (an OvpnRemote), then accepting.
+    """
+
+    def __init__(self, path, on_event=None, bytecount_interval=1, log_size=500,
+                 preferred_remote=None, remote_skip_limit=64):
+        self.path = path
+        self.on_event = on_event
+        self.preferred_remote = preferred_remote
+        self.remote_skip_limit = remote_skip_limit
+        self._remote_skips = 0
+        self.bytecount_interval = bytecount_interval
+        self.state = None
+        self.state_time = None
+        self.state_detail = None
+        self.local_ip = None
+        self.remote_ip = None
+        self.remote_port = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.started_at = None
+        self.connected_at = None
+        self.log = collections.deque(maxlen=log_size)
+        self._sock = None
+        self._thread = None
+        self._running = False
+        self._send_lock = threading.Lock()
+        self._changed = threading.Condition()
+
+    @property
+    def time_to_connected(self):
+        """Seconds from start() to the CONNECTED event, or None"""
+        if self.started_at is None or self.connected_at is None:
+            return None
+        return self.connected_at - self.started_at
+
+    def start(self, connect_timeout=30.0):
+        if self._running:
+            return
+        self._running = True
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, args=(connect_timeout,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Disconnect (OpenVPN keeps running) and remove the socket directory"""
+        self._running = False
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+        with self._changed:
+            self._changed.notify_all()
+
+    def send(self, command):
+        """Send one management command; returns False if not connected"""
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            with self._send_lock:
+                sock.sendall(command.encode() + b"\n")
+            return True
+        except OSError:
+            return False
+
+    def wait_for_state(self, states, timeout=None):
+        """Block until the state is one of `states`; returns the state or None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while self.state not in states:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not self._running or (remaining is not None and remaining <= 0):
+                    return None
+                self._changed.wait(remaining)
+            return self.state
+
+    def _connect(self, timeout):
+        # The socket appears once OpenVPN has parsed its config
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while self._running:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                return sock
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    return None
+                time.sleep(delay)
+                delay = min(delay * 2, 0.2)
+        return None
+
+    def _run(self, connect_timeout):
+        sock = self._connect(connect_timeout)
+        if sock is None:
+            self._running = False
+            self._dispatch("error", ["management socket not available"])
+            return
+        self._sock = sock
+        self.send("state on")
+        self.send("log on")
+        self.send(f"bytecount {self.bytecount_interval}")
+        buffer = b""
+        try:
+            while self._running:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    self._handle_line(line.decode("utf-8", errors="replace").rstrip("\r"))
+        except OSError:
+            pass
+        finally:
+            self._sock = None
+            sock.close()
+            was_running = self._running
+            self._running = False
+            with self._changed:
+                self._changed.notify_all()
+            if was_running:
+                self._dispatch("closed", [])
+
+    def _handle_line(self, line):
+        if not line.startswith(">"):
+            # SUCCESS:/ERROR: replies to our commands
+            return
+        kind, _, payload = line[1:].partition(":")
+        if kind == "STATE":
+            fields = payload.split(",")
+            fields += [""] * (9 - len(fields))
+            with self._changed:
+                self.state_time = int(fields[0]) if fields[0].isdigit() else None
+                self.state = fields[1]
+                self.state_detail = fields[2]
+                self.local_ip = fields[3] or self.local_ip
+                self.remote_ip = fields[4] or self.remote_ip
+                self.remote_port = int(fields[5]) if fields[5].isdigit() else self.remote_port
+                if self.state == "CONNECTED":
+                    self.connected_at = time.monotonic()
+                elif self.state in ("RECONNECTING", "EXITING"):
+                    self.connected_at = None
+                self._changed.notify_all()
+            self._dispatch("state", fields)
+        elif kind == "BYTECOUNT":
+            bytes_in, _, bytes_out = payload.partition(",")
+            try:
+                self.bytes_in, self.bytes_out = int(bytes_in), int(bytes_out)
+            except ValueError:
+                return
+            self._dispatch("bytecount", [self.bytes_in, self.bytes_out])
+        elif kind == "LOG":
+            fields = payload.split(",", 2)
+            self.log.append(fields[-1])
+            self._dispatch("log", fields)
+            # Independent of where the profile sends openvpn's own log
+            match = OPENVPN_PUSH_REPLY.search(fields[-1])
+            if match:
+                self._dispatch("push_reply", [match.group(1)])
+        elif kind == "REMOTE":
+            host, _, rest = payload.partition(",")
+            port = rest.partition(",")[0]
+            preferred = self.preferred_remote
+            if (preferred is None or (host == preferred.host and port == str(preferred.port))
+                    or self._remote_skips >= self.remote_skip_limit):
+                # From here on openvpn's own remote rotation applies
+                self.preferred_remote = None
+                self.send("remote ACCEPT")
+            else:
+                self._remote_skips += 1
+                self.send("remote SKIP")
+            self._dispatch("remote", [host, port])
+        elif kind == "HOLD":
+            # Sent on attach (and after a restart) with --management-hold
+            self.send("hold release")
+            self._dispatch("hold", [payload])
+        else:
+            self._dispatch(kind.lower(), [payload])
+
+    def _dispatch(self, kind, fields):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(kind, fields)
+        except Exception:
+            pass
+
+
+class TunnelSupervisor:
+    """Keeps a tunnel up: IDLE -> CONNECTING -> CONNECTED -> RECONNECTING -> FAILED.
+
+    `launch(remote, attempt)` starts one openvpn process, preferring
+    `remote` (an OvpnRemote); the owner reports back with connected(),
+    reconnecting() and exited(attempt, returncode). After an unexpected
+    exit the next remote is launched after a capped exponential backoff
+    with jitter; `max_attempts` consecutive failures end in FAILED. A
+    successful connect resets the backoff. Every attempt is recorded with
+    its timings in `attempts` (newest last). `clock`, `rng` and `timer`
+    (threading.Timer's signature) can be replaced to drive it in tests.
+    """
+
+    IDLE = "IDLE"
+    CONNECTING = "CONNECTING"
+    CONNECTED = "CONNECTED"
+    RECONNECTING = "RECONNECTING"
+    FAILED = "FAILED"
+
+    def __init__(self, launch, on_state=None, base_delay=1.0, max_delay=60.0, jitter=0.5,
+                 max_attempts=10, history=50, clock=time.monotonic, rng=None, timer=threading.Timer):
+        self.launch = launch
+        self.on_state = on_state
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.state = self.IDLE
+        self.attempts = collections.deque(maxlen=history)
+        self.remotes = []
+        self.failures = 0
+        self.next_delay = None
+        self._attempt = 0
+        self._remote_index = 0
+        self._timer = None
+        self._lock = threading.RLock()
+        self.clock = clock
+        self._random = rng or random.Random()
+        self._new_timer = timer
+
+    @property
+    def active(self):
+        return self.state in (self.CONNECTING, self.CONNECTED, self.RECONNECTING)
+
+    def start(self, remotes):
+        """Begin supervising; the first attempt is launched on this thread.
+
+        An exception from that first launch propagates (state back to IDLE)
+        instead of being retried.
+        """
+        with self._lock:
+            self._cancel_timer()
+            self.remotes = list(remotes)
+            self.failures = 0
+            self._remote_index = 0
+            self._set_state(self.CONNECTING)
+        self._launch(first=True)
+
+    def stop(self):
+        """Stop supervising (the caller stops the process itself)"""
+        with self._lock:
+            self._cancel_timer()
+            if self.attempts and self.attempts[-1]["outcome"] is None:
+                self._close_attempt("stopped")
+            self._set_state(self.IDLE)
+
+    def connected(self):
+        with self._lock:
+            if not self.active:
+                return
+            attempt = self.attempts[-1] if self.attempts else None
+            if attempt is not None and attempt["connected_after"] is None:
+                attempt["connected_after"] = self.clock() - attempt["launched"]
+            self.failures = 0
+            self.next_delay = None
+            self._set_state(self.CONNECTED)
+
+    def reconnecting(self):
+        """openvpn is restarting the session by itself (process still alive)"""
+        with self._lock:
+            if self.state == self.CONNECTED:
+                self._set_state(self.RECONNECTING)
+
+    def exited(self, attempt, returncode):
+        """The process of `attempt` exited; schedule the next attempt"""
+        with self._lock:
+            if attempt != self._attempt or not self.active:
+                return
+            self._close_attempt(f"exit {returncode}")
+            self.failures += 1
+            if self.failures >= self.max_attempts:
+                self.next_delay = None
+                self._set_state(self.FAILED)
+                return
+            self._remote_index += 1
+            delay = min(self.max_delay, self.base_delay * (2 ** (self.failures - 1)))
+            delay *= 1 - self.jitter * self._random.random()
+            self.next_delay = delay
+            self._set_state(self.RECONNECTING)
+            self._timer = self._new_timer(delay, self._launch)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _launch(self, first=False):
+        with self._lock:
+            self._timer = None
+            if not self.active:
+                return
+            self._attempt += 1
+            attempt = self._attempt
+            remote = self.remotes[self._remote_index % len(self.remotes)] if self.remotes else None
+            self.attempts.append({
+                "attempt": attempt,
+                "remote": remote,
+                "started": time.time(),
+                "launched": self.clock(),
+                "connected_after": None,
+                "ended_after": None,
+                "outcome": None,
+            })
+        try:
+            self.launch(remote, attempt)
+        except Exception:
+            if not first:
+                self.exited(attempt, None)
+                return
+            with self._lock:
+                self._close_attempt("error")
+                self._set_state(self.IDLE)
+            raise
+
+    def _close_attempt(self, outcome):
+        attempt = self.attempts[-1]
+        attempt["ended_after"] = self.clock() - attempt["launched"]
+        attempt["outcome"] = outcome
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        if self.on_state is not None:
+            try:
+                self.on_state(state)
+            except Exception:
+                pass
+
+
+def read_net_dev(path="/proc/net/dev"):
+    """{iface: (rx_bytes, tx_bytes)} for every interface, from one read"""
+    counters = {}
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()[2:]
+    except OSError:
+        return counters
+    for line in lines:
+        name, _, data = line.partition(":")
+        fields = data.split()
+        if len(fields) >= 9:
+            counters[name.strip()] = (int(fields[0]), int(fields[8]))
+    return counters
+
+
+class Tunnel:
+    """One OpenVPN instance with its own process, management socket and device.
+
+    `on_event(tunnel, kind, value)` is called from worker threads with
+    kind "started" (attempt number), "state" (openvpn state), "exited"
+    (return code), "supervisor" (TunnelSupervisor state) or "dns"
+    ((servers, domains) pushed by the server).
+    """
+
+    def __init__(self, name, config_cache, allocate_device, on_event=None, config_path=None, log_path=None):
+        self.name = name
+        self.config_path = config_path
+        # Set to a file path to keep a rotated copy of the openvpn log
+        self.log_path = log_path
+        self.config_cache = config_cache
+        self.allocate_device = allocate_device
+        self.on_event = on_event
+        self.dev = None
+        self.process = None
+        self.exit_watcher = None
+        self.management = None
+        # The current attempt's reader, and the log of every attempt
+        self.log = None
+        self.log_buffer = OpenVpnLogBuffer()
+        # Resolvers and search domains the server pushed to this attempt
+        self.dns_servers = []
+        self.dns_domains = []
+        self._lock = threading.Lock()
+        self.supervisor = TunnelSupervisor(self._launch, on_state=lambda state: self._emit("supervisor", state))
+
+    @property
+    def pid(self):
+        process = self.process
+        return None if process is None else process.pid
+
+    @property
+    def active(self):
+        return self.supervisor.active
+
+    def start(self):
+        """Start (and keep up) the tunnel; the first launch runs on this thread"""
+        config = self.config_cache.load(self.config_path)
+        self.supervisor.start(config.remotes)
+
+    def stop(self, timeout=5.0):
+        """Stop supervising and stop the process; False if it is still alive"""
+        self.supervisor.stop()
+        with self._lock:
+            process, exit_watcher, management = self.process, self.exit_watcher, self.management
+        if process is None:
+            return True
+        stop_openvpn(process, exit_watcher, management, timeout)
+        return exit_watcher.wait(0)
+
+    def _launch(self, remote, attempt):
+        config = self.config_cache.load(self.config_path)
+        self.dev = self.allocate_device(self, config)
+
+        # It holds until our management client is attached, so no state
+        # event is missed
+        management_path = make_management_socket_path()
+        target = "openvpn's own remote" if remote is None else f"{remote.host} {remote.port}/{remote.proto}"
+        self.log_buffer.separator(f"--- attempt {attempt}: {target} on {self.dev} ---")
+        cmd = ['openvpn', '--config', self.config_path, '--dev', self.dev,
+               '--management', management_path, 'unix', '--management-hold',
+               '--management-query-remote']
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        # Drain both pipes from now on: a full pipe would stall openvpn
+        log_reader = OpenVpnLogReader(process.stdout, process.stderr, rotate_path=self.log_path,
+                                      buffer=self.log_buffer)
+        log_reader.start()
+        management = ManagementClient(management_path, on_event=self._on_management_event,
+                                      preferred_remote=remote)
+        management.start()
+        # Learn about the process exit the moment it happens
+        exit_watcher = ProcessExitWatcher(process, lambda code: self._on_exit(attempt, process, code))
+
+        with self._lock:
+            previous = self.management
+            self.process = process
+            self.exit_watcher = exit_watcher
+            self.management = management
+            self.log = log_reader
+        if previous is not None:
+            previous.stop()
+        exit_watcher.start()
+        if not self.supervisor.active:
+            # Stopped while this attempt was being launched
+            stop_openvpn(process, exit_watcher, management)
+            return
+        self._emit("started", attempt)
+
+    def _on_exit(self, attempt, process, returncode):
+        self.supervisor.exited(attempt, returncode)
+        with self._lock:
+            if process is not self.process:
+                return
+            management = self.management
+            self.process = None
+            self.exit_watcher = None
+            self.management = None
+            self.dns_servers, self.dns_domains = [], []
+        if management is not None:
+            management.stop()
+        self._emit("exited", returncode)
+
+    def _on_management_event(self, kind, fields):
+        if kind == "state":
+            if fields[1] == "CONNECTED":
+                self.supervisor.connected()
+            elif fields[1] == "RECONNECTING":
+                self.supervisor.reconnecting()
+            self._emit("state", fields[1])
+        elif kind == "push_reply":
+            servers, domains = parse_pushed_dns(fields[0])
+            self.dns_servers, self.dns_domains = servers, domains
+            if servers:
+                self._emit("dns", (servers, domains))
+
+    def _emit(self, kind, value):
+        if self.on_event is not None:
+            try:
+                self.on_event(self, kind, value)
+            except Exception:
+                pass
+
+
+class TunnelRegistry:
+    """The tunnels of this app, keyed by name.
+
+    Assigns each tunnel its own `dev tunN`/`tapN`, collects the servers and
+    ports every tunnel needs through the killswitch, and reports the status
+    of all of them from one /proc/net/dev read plus their management state.
+    """
+
+    def __init__(self, config_cache, sys_net="/sys/class/net", proc_net_dev="/proc/net/dev"):
+        self.config_cache = config_cache
+        self.sys_net = sys_net
+        self.proc_net_dev = proc_net_dev
+        self._tunnels = {}
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._tunnels.values()))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tunnels)
+
+    def get(self, name):
+        with self._lock:
+            return self._tunnels.get(name)
+
+    def add(self, name, config_path=None, on_event=None, log_path=None):
+        with self._lock:
+            if name in self._tunnels:
+                raise ValueError(f"tunnel {name!r} already exists")
+            tunnel = Tunnel(name, self.config_cache, self.allocate_device, on_event=on_event,
+                            config_path=config_path, log_path=log_path)
+            self._tunnels[name] = tunnel
+        return tunnel
+
+    def remove(self, name):
+        """Forget a stopped tunnel"""
+        with self._lock:
+            tunnel = self._tunnels.get(name)
+            if tunnel is not None and tunnel.active:
+                raise ValueError(f"tunnel {name!r} is still running")
+            self._tunnels.pop(name, None)
+
+    def stop_all(self, timeout=5.0):
+        """Stop every tunnel concurrently; True if all processes are gone"""
+        tunnels = [t for t in self if t.process is not None or t.active]
+        if not tunnels:
+            return True
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(tunnels)) as pool:
+            return all(pool.map(lambda t: t.stop(timeout), tunnels))
+
+    def allocate_device(self, tunnel, config):
+        """Device name for `tunnel`: its configured fixed dev, else a free tunN/tapN"""
+        prefix = config.device_type
+        with self._lock:
+            taken = {t.dev for t in self._tunnels.values() if t is not tunnel and t.dev and t.active}
+            if config.device and config.device not in taken:
+                return config.device
+            # A relaunch keeps its device, even if the old one still exists
+            if tunnel.dev and tunnel.dev.startswith(prefix) and tunnel.dev not in taken:
+                return tunnel.dev
+            try:
+                existing = set(os.listdir(self.sys_net))
+            except OSError:
+                existing = set()
+            index = 0
+            while f"{prefix}{index}" in taken or f"{prefix}{index}" in existing:
+                index += 1
+            return f"{prefix}{index}"
+
+    def allowances(self, extra_paths=()):
+        """(servers, ports) all tunnels need to reach, in first-seen order"""
+        servers = {}
+        ports = {}
+        paths = [t.config_path for t in self if t.config_path] + [p for p in extra_paths if p]
+        for path in dict.fromkeys(paths):
+            try:
+                config = self.config_cache.load(path)
+            except (OSError, ValueError):
+                continue
+            servers.update(dict.fromkeys(config.servers))
+            ports.update(dict.fromkeys(config.ports))
+        return list(servers), list(ports)
+
+    def status(self):
+        """Status of every tunnel, from a single /proc/net/dev read"""
+        counters = read_net_dev(self.proc_net_dev)
+        result = []
+        for tunnel in self:
+            management = tunnel.management
+            attempts = tunnel.supervisor.attempts
+            error = tunnel.log.last_event(OPENVPN_ERROR_EVENTS) if tunnel.log is not None else None
+            rx, tx = counters.get(tunnel.dev, (None, None))
+            result.append({
+                "name": tunnel.name,
+                "dev": tunnel.dev,
+                "active": tunnel.active,
+                "supervisor": tunnel.supervisor.state,
+                "pid": tunnel.pid,
+                "state": management.state if management is not None else None,
+                "detail": management.state_detail if management is not None else None,
+                "local_ip": management.local_ip if management is not None else None,
+                "remote": (f"{management.remote_ip}:{management.remote_port}"
+                           if management is not None and management.remote_ip else None),
+                "time_to_connected": management.time_to_connected if management is not None else None,
+                "reconnects": max(0, len(attempts) - 1),
+                "interface_up": tunnel.dev in counters,
+                "rx_bytes": rx,
+                "tx_bytes": tx,
+                "last_error": error[3] if error is not None else None,
+            })
+        return result
+
+
+def sparkline_coords(values, capacity, width, height, peak, pad=2):
+    """Flat [x0, y0, x1, y1, ...] for `values`, right-aligned in a width x height box"""
+    baseline = height - pad
+    if len(values) < 2:
+        return [0, baseline, width, baseline]
+    step = (width - 1) / max(capacity - 1, 1)
+    x = width - 1 - step * (len(values) - 1)
+    scale = (height - 2 * pad) / peak if peak > 0 else 0.0
+    coords = []
+    for value in values:
+        coords.append(x)
+        coords.append(baseline - value * scale)
+        x += step
+    return coords
+
+
+class Sparkline:
+    """rx/tx lines on a Tk canvas; draw() moves the existing items, nothing is recreated"""
+
+    def __init__(self, canvas, rx_color, tx_color, line_width=2):
+        self.canvas = canvas
+        self.rx_item = canvas.create_line(0, 0, 0, 0, fill=rx_color, width=line_width)
+        self.tx_item = canvas.create_line(0, 0, 0, 0, fill=tx_color, width=line_width)
+
+    def draw(self, series):
+        width = max(self.canvas.winfo_width(), 2)
+        height = max(self.canvas.winfo_height(), 2)
+        peak = series.peak()
+        for item, values in ((self.rx_item, series.ordered(series.rx)),
+                             (self.tx_item, series.ordered(series.tx))):
+            self.canvas.coords(item, sparkline_coords(values, series.capacity, width, height, peak))
+
+
+# The Tk loop drains worker callbacks once per frame, for at most a
+# budget, so a flood of posts cannot hold the window past a frame
+UI_FRAME_MS = 16
+UI_PUMP_BUDGET = 0.008
+
 
 class An0m0sVPN:
     def __init__(self, root):
@@ -56,12 +3832,57 @@ class An0m0sVPN:
         
         # Configuration
         self.ovpn_file = None
-        self.vpn_process = None
-        self.vpn_pid = None
+        # Log panel: flush interval (ms) and lines kept in the widget
+        self.log_flush_ms = 150
+        self.log_panel_lines = 500
+        self._log_panel_buffer = None
+        self._log_panel_seen = 0
+        self._log_filter_after_id = None
+        self._ui_queue = queue.Queue()
+        self._pipeline_busy = False
+        self._leak_test_running = False
         self.status_check_thread = None
         self.is_running = False
         self.killswitch_enabled = False
-        self._iptables_backup_path = None
+        self.firewall_backend = None
+        self.remote_resolver = RemoteResolver()
+        # Public IP lookups race all providers; AN0M0S_IP_ECHO_URL replaces
+        # them with a self-hosted echo endpoint (plain address or {"ip": ...} JSON)
+        echo_url = os.environ.get("AN0M0S_IP_ECHO_URL")
+        self.ip_lookup = IpLookupService([IpInfoProvider("echo", echo_url)] if echo_url else None,
+                                         geoip=self._open_geoip())
+        # One lookup in flight at most: on tunnel/route events, and every
+        # `interval` seconds to verify the IP in between
+        self.ip_refresh = IpRefreshScheduler(
+            lambda force: self.ip_lookup.lookup(force=force),
+            on_start=self._on_ip_lookup_start,
+            on_result=self._on_ip_lookup_result,
+            interval=300.0,
+        )
+        self.config_cache = OvpnConfigCache()
+        # Every OpenVPN instance lives in the registry; the UI drives "main"
+        self.tunnels = TunnelRegistry(self.config_cache)
+        self.tunnel = self.tunnels.add("main", on_event=self._on_tunnel_event)
+        self._firewall_lock = threading.Lock()
+        # {family: (iface, gateway)} of the last default route on a physical link
+        self._last_default_routes = {}
+        # _network_state() as of the last network change acted upon
+        self._last_network_state = None
+        self.network_watcher = NetworkChangeWatcher(self._on_network_change)
+        # Tunnel throughput, sampled every `throughput_interval` seconds
+        self.throughput_interval = 1.0
+        self.throughput = ThroughputSampler(capacity=120)
+        # Resolvers pushed by the server (systemd-resolved per-link DNS or
+        # a rewritten resolv.conf); the killswitch only lets these through
+        self.dns = DnsConfigurator()
+        try:
+            self.dns.recover()
+        except OSError:
+            pass
+        self.tunnel_dns = []
+        self.dns_latency_before = {}
+        self.dns_latency_after = {}
+        self._dns_lock = threading.Lock()
         self.current_ip = "Not Connected"
         self.current_country = "Unknown"
         
@@ -107,6 +3928,8 @@ class An0m0sVPN:
         self.font_h3 = tkfont.Font(family=self.font_family, size=max(11, base_size + 1), weight="bold")
         self.font_button = tkfont.Font(family=self.font_family, size=base_size, weight="bold")
         self.font_button_small = tkfont.Font(family=self.font_family, size=max(9, base_size - 1), weight="bold")
+        self.font_mono = tkfont.nametofont("TkFixedFont").copy()
+        self.font_mono.configure(size=max(9, base_size - 1))
 
         # Consistent spacing
         self.space_xs = 6
@@ -165,6 +3988,38 @@ class An0m0sVPN:
         self._render_ui(force=True)
         self.update_status()
         self.start_animations()
+        self._pump_ui_queue()
+        self._flush_log_panel()
+        self._sample_throughput()
+
+    @staticmethod
+    def _open_geoip():
+        """The offline geoip database, if one is installed"""
+        path = geoip_database_path()
+        if path is None:
+            return None
+        try:
+            return GeoIpDatabase(path)
+        except (OSError, ValueError):
+            return None
+
+    def _post(self, func, *args):
+        """Run func(*args) on the Tk thread; safe to call from any thread"""
+        self._ui_queue.put((func, args))
+
+    def _pump_ui_queue(self):
+        """Run callbacks posted by worker threads, once per frame and within UI_PUMP_BUDGET"""
+        deadline = time.monotonic() + UI_PUMP_BUDGET
+        try:
+            # Never waits on a worker; what is left runs next frame
+            while time.monotonic() < deadline:
+                try:
+                    func, args = self._ui_queue.get_nowait()
+                except queue.Empty:
+                    break
+                func(*args)
+        finally:
+            self.root.after(UI_FRAME_MS, self._pump_ui_queue)
 
     def _choose_font_family(self, preferred_families):
         try:
@@ -300,6 +4155,7 @@ class An0m0sVPN:
             self.font_h3.configure(size=max(11, base_size + 1))
             self.font_button.configure(size=base_size)
             self.font_button_small.configure(size=max(9, base_size - 1))
+            self.font_mono.configure(size=max(9, base_size - 1))
         except Exception:
             pass
 
@@ -425,7 +4281,7 @@ class An0m0sVPN:
             pady=6,
             relief="flat",
             borderwidth=0,
-            command=self.refresh_ip_info,
+            command=lambda: self.refresh_ip_info(force=True),
         )
         self.refresh_ip_btn.pack(side="right")
         self.add_button_hover(self.refresh_ip_btn, self.bg_secondary, self._blend(self.bg_secondary, self.text_primary, 0.10))
@@ -495,6 +4351,17 @@ class An0m0sVPN:
         self.country_label = info_row(info_box_inner, "Location")
         self.country_label.config(text=self.current_country, fg=self.text_primary)
 
+        self.throughput_label = info_row(info_box_inner, "Throughput")
+        self.throughput_canvas = tk.Canvas(
+            info_box_inner,
+            height=44,
+            bg=self.bg_secondary,
+            highlightthickness=0,
+        )
+        self.throughput_canvas.pack(fill="x", pady=(self.space_xs, 0))
+        self.sparkline = Sparkline(self.throughput_canvas, self.accent_primary, self.accent_secondary)
+        self.throughput_canvas.bind("<Configure>", lambda e: self._render_throughput())
+
         # Config card
         config_card = tk.Frame(left, bg=self.bg_card, highlightbackground=self.border_subtle, highlightthickness=1)
         config_card.pack(fill="x")
@@ -694,6 +4561,9 @@ class An0m0sVPN:
         self.restore_btn = make_btn(button_grid, "Restore network", self.accent_secondary, "#12091f", self.restore_network)
         self.restore_btn.grid(row=1, column=1, sticky="ew", padx=(self.space_sm, 0))
 
+        self.leak_test_btn = make_btn(button_grid, "Leak test", self.accent_warning, "#1a1204", self.run_leak_test)
+        self.leak_test_btn.grid(row=2, column=0, columnspan=2, sticky="ew", pady=(self.space_sm, 0))
+
         self.close_btn = tk.Button(
             controls_inner,
             text="Exit",
@@ -712,6 +4582,90 @@ class An0m0sVPN:
         self.close_btn.pack(fill="x", pady=(self.space_md, 0))
         self.add_button_hover(self.close_btn, self.bg_secondary, self._blend(self.bg_secondary, "#FFFFFF", 0.10))
 
+        # Log card (full width, below both columns)
+        if not hasattr(self, "log_level_var") or self.log_level_var is None:
+            self.log_level_var = tk.StringVar(value="All")
+            self.log_search_var = tk.StringVar(value="")
+            self.log_level_var.trace_add("write", self._on_log_filter_change)
+            self.log_search_var.trace_add("write", self._on_log_filter_change)
+
+        log_card = tk.Frame(self.scrollable_frame, bg=self.bg_card, highlightbackground=self.border_subtle, highlightthickness=1)
+        log_card.pack(fill="x", padx=content_padx, pady=(self.space_lg, 0))
+
+        log_inner = tk.Frame(log_card, bg=self.bg_card)
+        log_inner.pack(fill="x", padx=self.space_lg, pady=self.space_lg)
+
+        log_head = tk.Frame(log_inner, bg=self.bg_card)
+        log_head.pack(fill="x")
+
+        tk.Label(
+            log_head,
+            text="OPENVPN LOG",
+            bg=self.bg_card,
+            fg=self.text_tertiary,
+            font=self.font_micro,
+        ).pack(side="left")
+
+        level_menu = tk.OptionMenu(log_head, self.log_level_var, "All", "Warnings", "Errors")
+        level_menu.config(
+            font=self.font_button_small,
+            bg=self.bg_secondary,
+            fg=self.text_primary,
+            activebackground=self._blend(self.bg_secondary, self.text_primary, 0.08),
+            activeforeground=self.text_primary,
+            highlightthickness=0,
+            relief="flat",
+            borderwidth=0,
+        )
+        level_menu["menu"].config(bg=self.bg_secondary, fg=self.text_primary, font=self.font_small)
+        level_menu.pack(side="right")
+
+        tk.Entry(
+            log_head,
+            textvariable=self.log_search_var,
+            font=self.font_small,
+            bg=self.bg_secondary,
+            fg=self.text_primary,
+            insertbackground=self.text_primary,
+            highlightbackground=self.border_subtle,
+            highlightthickness=1,
+            relief="flat",
+            width=18 if width >= 520 else 10,
+        ).pack(side="right", padx=(self.space_sm, self.space_sm), ipady=4)
+
+        tk.Label(
+            log_head,
+            text="Search",
+            bg=self.bg_card,
+            fg=self.text_secondary,
+            font=self.font_small,
+        ).pack(side="right")
+
+        log_box = tk.Frame(log_inner, bg=self.bg_secondary, highlightbackground=self.border_subtle, highlightthickness=1)
+        log_box.pack(fill="x", pady=(self.space_md, 0))
+
+        self.log_text = tk.Text(
+            log_box,
+            height=12,
+            wrap="word",
+            bg=self.bg_secondary,
+            fg=self.text_secondary,
+            font=self.font_mono,
+            relief="flat",
+            borderwidth=0,
+            padx=self.space_sm,
+            pady=self.space_sm,
+            state="disabled",
+        )
+        log_scroll = ttk.Scrollbar(log_box, orient="vertical", command=self.log_text.yview)
+        self.log_text.configure(yscrollcommand=log_scroll.set)
+        log_scroll.pack(side="right", fill="y")
+        self.log_text.pack(side="left", fill="both", expand=True)
+        self.log_text.tag_configure("warning", foreground=self.accent_warning)
+        self.log_text.tag_configure("error", foreground=self.accent_danger)
+        self.log_text.tag_configure("separator", foreground=self.text_tertiary)
+        self._render_log_panel()
+
         # Footer
         footer = tk.Frame(self.scrollable_frame, bg=self.bg_primary)
         footer.pack(fill="x", padx=content_padx, pady=(self.space_lg, self.space_lg))
@@ -762,6 +4716,114 @@ class An0m0sVPN:
         self._sync_config_label()
         self._sync_toggle_visual()
 
+    def _log_line_visible(self, level, text):
+        minimum = {"Warnings": 1, "Errors": 2}.get(self.log_level_var.get(), 0)
+        if OPENVPN_LOG_LEVELS.index(level) < minimum:
+            return False
+        needle = self.log_search_var.get().strip().lower()
+        return not needle or needle in text.lower()
+
+    def _write_log_lines(self, lines, replace=False):
+        """Put a batch of log lines into the panel with a single insert.
+
+        The panel keeps only the last `log_panel_lines` of what the filter
+        lets through; the full history stays in the tunnel's log buffer.
+        """
+        widget = self.log_text
+        # Attempt separators are always shown, so filtered lines keep their context
+        visible = [("separator", text) if stream == "separator" else (level, text)
+                   for _, stream, level, text in lines
+                   if stream == "separator" or self._log_line_visible(level, text)]
+        if replace:
+            visible = visible[-self.log_panel_lines:]
+        elif not visible:
+            return
+
+        # Consecutive lines of the same level share one tagged chunk
+        chunks = []
+        for level, text in visible:
+            if chunks and chunks[-1][1] == level:
+                chunks[-1][0].append(text)
+            else:
+                chunks.append(([text], level))
+        args = []
+        for texts, level in chunks:
+            args.extend(("\n".join(texts) + "\n", level))
+
+        follow = replace or widget.yview()[1] >= 0.999
+        widget.configure(state="normal")
+        if replace:
+            widget.delete("1.0", "end")
+        if args:
+            widget.insert("end", *args)
+        excess = int(widget.index("end-1c").split(".")[0]) - 1 - self.log_panel_lines
+        if excess > 0:
+            widget.delete("1.0", f"{excess + 1}.0")
+        widget.configure(state="disabled")
+        if follow:
+            widget.see("end")
+
+    def _flush_log_panel(self):
+        """Move lines logged since the last flush into the panel in one batch"""
+        try:
+            buffer = self.tunnel.log_buffer
+            if hasattr(self, "log_text"):
+                if buffer is not self._log_panel_buffer:
+                    # Another tunnel: start the panel over
+                    self._render_log_panel()
+                else:
+                    self._log_panel_seen, lines = buffer.lines_since(self._log_panel_seen)
+                    if lines:
+                        self._write_log_lines(lines)
+        finally:
+            self.root.after(self.log_flush_ms, self._flush_log_panel)
+
+    def _render_log_panel(self):
+        """Re-render the panel from the tunnel's log buffer (every attempt)"""
+        buffer = self.tunnel.log_buffer
+        self._log_panel_seen, lines = buffer.lines_since(0)
+        self._log_panel_buffer = buffer
+        self._write_log_lines(lines, replace=True)
+
+    def _on_log_filter_change(self, *args):
+        # Debounced: typing in the search box re-filters once it pauses
+        if self._log_filter_after_id is not None:
+            self.root.after_cancel(self._log_filter_after_id)
+        self._log_filter_after_id = self.root.after(150, self._apply_log_filter)
+
+    def _apply_log_filter(self):
+        self._log_filter_after_id = None
+        if hasattr(self, "log_text"):
+            self._render_log_panel()
+
+    def _sample_throughput(self):
+        """Sample the tunnel's counters and redraw the bandwidth graph"""
+        if not self.animation_running:
+            return
+        dev = self.tunnel.dev
+        if self.is_running and dev:
+            self.throughput.sample(dev)
+        elif self.throughput.iface is not None:
+            self.throughput.reset()
+        self._render_throughput()
+        self.root.after(int(self.throughput_interval * 1000), self._sample_throughput)
+
+    def _render_throughput(self):
+        if not hasattr(self, "sparkline"):
+            return
+        counters = self.throughput.counters
+        if counters is None:
+            text = "—"
+        else:
+            rx, tx = self.throughput.series.latest()
+            text = f"↓ {format_rate(rx)}   ↑ {format_rate(tx)}"
+            errors = counters["rx_errors"] + counters["tx_errors"]
+            dropped = counters["rx_dropped"] + counters["tx_dropped"]
+            if errors or dropped:
+                text += f"   ({errors} errors, {dropped} dropped)"
+        self.throughput_label.config(text=text)
+        self.sparkline.draw(self.throughput.series)
+
     def _sync_config_label(self):
         if not hasattr(self, "file_label"):
             return
@@ -843,8 +4905,11 @@ class An0m0sVPN:
     
     def start_animations(self):
         """Start background animations"""
-        # Fetch IP info on startup
-        self.refresh_ip_info()
+        # Fetch IP info on startup, then on tunnel and route changes
+        self.ip_refresh.start()
+        self.ip_refresh.request("startup")
+        self._last_network_state = self._network_state()
+        self.network_watcher.start()
 
         # Subtle pulse on the connection pill to draw attention without being noisy
         self.pulse_status_indicator()
@@ -870,63 +4935,35 @@ class An0m0sVPN:
                 self.connection_pill.config(bg=bg)
             self.root.after(60, self.pulse_status_indicator)
     
-    def get_ip_info(self):
-        """Get IP address and country information"""
-        try:
-            # Try multiple services for redundancy
-            services = [
-                'https://ipapi.co/json/',
-                'https://ipinfo.io/json'
-            ]
-            
-            for service in services:
-                try:
-                    response = requests.get(service, timeout=5)
-                    if response.status_code == 200:
-                        data = response.json()
-                        
-                        # Extract IP and Country based on service
-                        if 'ipapi.co' in service:
-                            ip = data.get('ip', 'Unknown')
-                            country = data.get('country_name', 'Unknown')
-                            city = data.get('city', '')
-                            if city:
-                                country = f"{city}, {country}"
-                        elif 'ipinfo.io' in service:
-                            ip = data.get('ip', 'Unknown')
-                            country = data.get('country', 'Unknown')
-                            city = data.get('city', '')
-                            if city:
-                                country = f"{city}, {country}"
-                        
-                        return ip, country
-                except:
-                    continue
-            
-            return "Unable to fetch", "Unknown"
-        except Exception as e:
-            return "Error", "Unknown"
-    
-    def refresh_ip_info(self):
-        """Refresh IP and country information in a separate thread"""
-        def fetch_and_update():
-            # Update UI to show loading
-            self.root.after(0, lambda: self.ip_label.config(text="Loading…", fg=self.accent_warning))
-            self.root.after(0, lambda: self.country_label.config(text="Loading…", fg=self.accent_warning))
-            
-            # Fetch IP info
-            ip, country = self.get_ip_info()
-            
-            # Update variables
+    def refresh_ip_info(self, force=False):
+        """Ask the refresh scheduler for a new IP lookup"""
+        if force:
+            # Emptying the cache keeps the user's request out of the
+            # rate limit for forced requests
+            self.ip_lookup.invalidate()
+        self.ip_refresh.request("manual" if force else "refresh")
+
+    def _on_ip_lookup_start(self, reason):
+        """Scheduler thread: a lookup is starting"""
+        # The periodic re-check keeps showing the current IP until its
+        # answer replaces it; only events and the user get "Loading…"
+        if reason == "periodic":
+            return
+        self._post(self._show_ip_info, "Loading…", "Loading…", True)
+
+    def _on_ip_lookup_result(self, result):
+        """Scheduler thread: the (still current) lookup finished"""
+        ip, country = result if result is not None else ("Unable to fetch", "Unknown")
+        self._post(self._show_ip_info, ip, country)
+
+    def _show_ip_info(self, ip, country, loading=False):
+        color = self.accent_warning if loading else self.text_primary
+        if not loading:
             self.current_ip = ip
             self.current_country = country
-            
-            # Update UI
-            self.root.after(0, lambda: self.ip_label.config(text=ip, fg=self.text_primary))
-            self.root.after(0, lambda: self.country_label.config(text=country, fg=self.text_primary))
-        
-        # Run in separate thread to avoid blocking UI
-        threading.Thread(target=fetch_and_update, daemon=True).start()
+        if hasattr(self, "ip_label"):
+            self.ip_label.config(text=ip, fg=color)
+            self.country_label.config(text=country, fg=color)
     
     def upload_file(self):
         """Handle file upload with premium feedback"""
@@ -936,10 +4973,16 @@ class An0m0sVPN:
         )
         
         if file_path:
+            try:
+                config = self.config_cache.load(file_path)
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Error", f"Invalid configuration file:\n{str(e)}")
+                return
             self.ovpn_file = file_path
             self._sync_config_label()
             filename = os.path.basename(file_path)
-            messagebox.showinfo("Success", f"Configuration loaded successfully.\n\n{filename}")
+            messagebox.showinfo("Success", f"Configuration loaded successfully.\n\n{filename}\n"
+                                f"{len(config.remotes)} remote(s), {config.device_type} device")
     
     def toggle_killswitch_click(self, event=None):
         """Handle toggle switch click with animation and actual killswitch control"""
@@ -970,16 +5013,9 @@ class An0m0sVPN:
             if not response:
                 return
             
-            # Apply killswitch
-            if self.apply_killswitch():
-                self.killswitch_var.set(True)
-                self._sync_toggle_visual()
-                messagebox.showinfo(
-                    "Success",
-                    "Killswitch enabled.\n\nInternet is now blocked except VPN traffic.\nStart the VPN to restore access through the tunnel."
-                )
-            else:
-                messagebox.showerror("Error", "Failed to enable killswitch.")
+            # Apply killswitch (resolving remotes and the firewall commands
+            # take a while, so on a worker)
+            self._run_pipeline("KILLSWITCH", self._killswitch_up, self._on_killswitch_applied)
         
         # If disabling killswitch
         else:
@@ -993,12 +5029,30 @@ class An0m0sVPN:
                 return
             
             # Remove killswitch
-            if self.remove_killswitch():
-                self.killswitch_var.set(False)
-                self._sync_toggle_visual()
-                messagebox.showinfo("Success", "Killswitch disabled.\nInternet restored to normal.")
-            else:
-                messagebox.showerror("Error", "Failed to disable killswitch.")
+            self._run_pipeline("RESTORING", self._killswitch_down, self._on_killswitch_removed)
+
+    def _on_killswitch_applied(self, error):
+        self._pipeline_busy = False
+        self.update_status()
+        if error is None:
+            self.killswitch_var.set(True)
+            self._sync_toggle_visual()
+            messagebox.showinfo(
+                "Success",
+                "Killswitch enabled.\n\nInternet is now blocked except VPN traffic.\nStart the VPN to restore access through the tunnel."
+            )
+        else:
+            messagebox.showerror("Error", error or "Failed to enable killswitch.")
+
+    def _on_killswitch_removed(self, error):
+        self._pipeline_busy = False
+        self.update_status()
+        if error is None:
+            self.killswitch_var.set(False)
+            self._sync_toggle_visual()
+            messagebox.showinfo("Success", "Killswitch disabled.\nInternet restored to normal.")
+        else:
+            messagebox.showerror("Error", error or "Failed to disable killswitch.")
     
     def toggle_killswitch(self):
         """Toggle killswitch on/off (legacy support)"""
@@ -1017,120 +5071,316 @@ class An0m0sVPN:
         if not os.path.exists(self.ovpn_file):
             messagebox.showerror("Error", "Configuration file not found!")
             return
+
+        try:
+            config = self._load_config()
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Invalid configuration file:\n{str(e)}")
+            return
+        if not config.remotes:
+            messagebox.showerror("Error", "The configuration has no `remote` entries!")
+            return
         
+        # The slow part (firewall, process start) runs on a worker thread;
+        # its stages come back through the UI queue
+        want_killswitch = self.killswitch_var.get()
+        if self._run_pipeline("PREPARING", lambda: self._connect_worker(want_killswitch)):
+            self.start_btn.config(state="disabled")
+
+    def _run_pipeline(self, stage, job, on_done=None):
+        """Run `job` on a worker thread, one pipeline at a time (Tk thread).
+
+        Connect, disconnect and every firewall change go through here so the
+        Tk loop never waits on DNS, firewall commands or openvpn. With
+        `on_done`, on_done(result) is posted back when the job returns
+        (the result of an exception is its message); otherwise the job
+        reports back itself. Returns False if another job is running.
+        """
+        if self._pipeline_busy:
+            messagebox.showwarning("Warning", "A connect, disconnect or firewall change is already in progress.")
+            return False
+        self._pipeline_busy = True
+        self._set_stage(stage)
+
+        def worker():
+            try:
+                result = job()
+            except Exception as e:
+                result = str(e)
+            if on_done is not None:
+                self._post(on_done, result)
+
+        threading.Thread(target=worker, daemon=True).start()
+        return True
+
+    def _connect_worker(self, want_killswitch):
+        """Connect pipeline (worker thread)"""
         try:
             # Apply killswitch if enabled (before starting VPN)
-            if self.killswitch_var.get() and not self.killswitch_enabled:
-                if not self.apply_killswitch():
-                    messagebox.showerror("Error", "Failed to apply killswitch!\nVPN start cancelled.")
+            if want_killswitch and not self.killswitch_enabled:
+                self._post(self._set_stage, "KILLSWITCH")
+                error = self._killswitch_up()
+                if error is not None:
+                    message = "Failed to apply killswitch!\nVPN start cancelled."
+                    self._post(self._on_connect_failed, message + (f"\n\n{error}" if error else ""))
                     return
-                time.sleep(1)
-            
-            # Start OpenVPN (already running as root)
-            cmd = ['openvpn', '--config', self.ovpn_file]
-            
-            self.vpn_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            
-            # Get the PID
-            time.sleep(1)
-            result = subprocess.run(['pgrep', '-x', 'openvpn'], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                self.vpn_pid = result.stdout.strip().split()[0]
-            
-            self.is_running = True
-            self.update_status()
-            messagebox.showinfo("Success", "VPN started successfully!")
-            
-            # Start monitoring thread
-            threading.Thread(target=self.monitor_vpn, daemon=True).start()
-            
-            # Wait a bit for VPN to establish, then refresh IP
-            time.sleep(3)
-            self.refresh_ip_info()
-            
+
+            # Resolver latency without the tunnel, to compare against the
+            # pushed resolvers once they are in place
+            threading.Thread(target=self._measure_dns_baseline, daemon=True).start()
+
+            # The supervisor launches the first attempt right here and
+            # relaunches (rotating remotes) whenever openvpn dies
+            self._post(self._set_stage, "STARTING")
+            self.tunnel.config_path = self.ovpn_file
+            self.tunnel.start()
+
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to start VPN:\n{str(e)}")
-            self.is_running = False
-            self.update_status()
+            self._post(self._on_connect_failed, f"Failed to start VPN:\n{str(e)}")
+
+    def _on_tunnel_event(self, tunnel, kind, value):
+        """Tunnel callback (worker threads); hands off to Tk"""
+        if kind in ("state", "exited"):
+            # The public IP may change with any tunnel state change
+            self.ip_lookup.invalidate()
+            if tunnel is self.tunnel and (kind == "exited" or value == "CONNECTED"):
+                self.ip_refresh.request(f"tunnel {value if kind == 'state' else 'down'}")
+        if tunnel is self.tunnel:
+            # Off the log reader thread: resolvectl, the firewall and the
+            # latency probe all take a while
+            if kind == "dns":
+                threading.Thread(target=self._apply_tunnel_dns, args=(tunnel.dev, *value),
+                                 daemon=True).start()
+            elif kind == "exited" or (kind == "state" and value == "RECONNECTING"):
+                # The pushed resolvers are unreachable until the tunnel is back
+                threading.Thread(target=self._restore_dns, daemon=True).start()
+        handler = {
+            "started": self._on_connect_started,
+            "state": self._on_vpn_state,
+            "exited": self._on_vpn_exit,
+            "supervisor": self._on_supervisor_state,
+        }.get(kind)
+        if handler is not None:
+            self._post(handler, tunnel, value)
+
+    def _measure_dns_baseline(self):
+        self.dns_latency_before = measure_resolver_latency(system_resolvers()[1])
+
+    def _apply_tunnel_dns(self, dev, servers, domains):
+        """Use the pushed resolvers and allow only them through the killswitch (worker thread)"""
+        with self._dns_lock:
+            method = self.dns.apply(dev, servers, domains)
+            self.tunnel_dns = list(servers) if method else []
+        if method:
+            self._retarget_killswitch()
+        latency = measure_resolver_latency(servers) if method else {}
+        self.dns_latency_after = latency
+        self._post(self._on_dns_applied, method, servers)
+
+    def _restore_dns(self):
+        """Put the system resolvers back and reopen DNS in the killswitch (worker thread)"""
+        with self._dns_lock:
+            if self.dns.method is None and not self.tunnel_dns:
+                return
+            self.dns.restore()
+            self.tunnel_dns = []
+        self._retarget_killswitch()
+
+    def _format_dns_latency(self):
+        """Fastest resolver before the tunnel vs the pushed ones, for the status dialog"""
+        def best(latency):
+            times = [t for t in latency.values() if t is not None]
+            return f"{min(times) * 1000:.0f} ms" if times else "n/a"
+        if not self.dns_latency_before and not self.dns_latency_after:
+            return None
+        return f"{best(self.dns_latency_before)} before → {best(self.dns_latency_after)} via VPN"
+
+    def _on_dns_applied(self, method, servers):
+        if method is None:
+            messagebox.showwarning(
+                "DNS",
+                f"Could not switch DNS to the VPN resolvers ({', '.join(servers)}).\n\n"
+                "Lookups still go to the system resolvers."
+            )
+
+    def _on_connect_started(self, tunnel, attempt):
+        if tunnel is not self.tunnel:
+            return
+        self.is_running = True
+        self._pipeline_busy = False
+        self.update_status()
+        if attempt == 1:
+            messagebox.showinfo("Success", "VPN started — connecting…")
+
+    def _on_connect_failed(self, message):
+        self._pipeline_busy = False
+        self.is_running = False
+        self.update_status()
+        messagebox.showerror("Error", message)
+
+    def _set_stage(self, stage):
+        """Show a connect/disconnect pipeline stage in the status pill"""
+        if hasattr(self, "connection_pill"):
+            self.connection_pill.config(text=stage, fg=self.accent_warning)
+
+    def _on_vpn_state(self, tunnel, state):
+        self.update_status()
     
     def check_status(self):
         """Check VPN status"""
         try:
-            # Check if OpenVPN process is running
-            result = subprocess.run(
-                ['pgrep', '-x', 'openvpn'],
-                capture_output=True,
-                text=True
-            )
-            
             status_msg = "=== VPN STATUS CHECK ===\n\n"
-            
-            if result.returncode == 0:
-                pids = result.stdout.strip().split('\n')
-                status_msg += f"✓ OpenVPN Process: RUNNING\n"
-                status_msg += f"  PIDs: {', '.join(pids)}\n\n"
-                
-                # Check network interfaces
-                ip_result = subprocess.run(
-                    ['ip', 'addr', 'show', 'tun0'],
-                    capture_output=True,
-                    text=True
-                )
-                
-                if ip_result.returncode == 0:
-                    # Extract IP from output
-                    lines = ip_result.stdout.split('\n')
-                    ip_info = [l.strip() for l in lines if 'inet' in l]
-                    
-                    status_msg += "✓ VPN Tunnel: ACTIVE\n"
-                    status_msg += "  Interface: tun0\n"
-                    if ip_info:
-                        status_msg += f"  {ip_info[0]}\n\n"
-                    
-                    status_msg += "Status: CONNECTED ✓"
-                    
-                    # Update internal state
-                    if not self.is_running:
-                        self.is_running = True
-                        self.update_status()
-                    
-                    messagebox.showinfo("VPN Status", status_msg)
+            if self.killswitch_enabled:
+                status_msg += self._killswitch_status_text()
+
+            # Our own tunnels report their state over their management
+            # sockets; traffic for all of them comes from one /proc read
+            tunnels = [t for t in self.tunnels.status() if t["active"] and t["state"] is not None]
+            if self.is_running and tunnels:
+                status_msg += "".join(self._tunnel_status_text(tunnel) for tunnel in tunnels)
+                if self.tunnel_dns:
+                    status_msg += self._dns_status_text()
+                if all(tunnel["state"] == "CONNECTED" for tunnel in tunnels):
+                    messagebox.showinfo("VPN Status", status_msg + "Status: CONNECTED ✓")
                 else:
-                    status_msg += "⚠ VPN Tunnel: NOT FOUND\n"
-                    status_msg += "  Interface tun0 not detected\n\n"
-                    status_msg += "Status: CONNECTING or FAILED"
-                    
-                    messagebox.showwarning("VPN Status", status_msg)
+                    messagebox.showwarning("VPN Status", status_msg + "Status: CONNECTING")
+                return
+
+            connected, text = self._probe_status_text()
+            if connected is False:
+                messagebox.showwarning("VPN Status", status_msg + text)
             else:
-                status_msg += "✗ OpenVPN Process: NOT RUNNING\n\n"
-                status_msg += "Status: DISCONNECTED ✗"
-                
-                # Update internal state
-                if self.is_running:
-                    self.is_running = False
-                    self.vpn_process = None
-                    self.vpn_pid = None
-                    self.update_status()
-                
-                messagebox.showinfo("VPN Status", status_msg)
+                messagebox.showinfo("VPN Status", status_msg + text)
                 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to check status:\n{str(e)}")
-    
-    def monitor_vpn(self):
-        """Monitor VPN process in background"""
-        while self.is_running:
-            if self.vpn_process and self.vpn_process.poll() is not None:
+
+    def _killswitch_status_text(self):
+        watcher = self.network_watcher.stats()
+        text = f"✓ Killswitch: ACTIVE ({self._get_firewall_backend().name})\n"
+        text += f"  Network events: {watcher['events']} ({watcher['bursts']} re-targets)\n"
+        if watcher["error"]:
+            text += f"  ⚠ Network watcher off: {watcher['error']}\n"
+        if watcher["last_latency"] is not None:
+            text += f"  Last re-target: {watcher['last_latency'] * 1000:.0f} ms\n"
+        return text + "\n"
+
+    @staticmethod
+    def _tunnel_status_text(tunnel):
+        """Status lines for one TunnelRegistry.status() entry"""
+        text = f"✓ Tunnel {tunnel['name']} ({tunnel['dev']}): {tunnel['state']}"
+        text += f" ({tunnel['detail']})\n" if tunnel["detail"] else "\n"
+        text += f"  PID: {tunnel['pid']}\n"
+        if tunnel["local_ip"]:
+            text += f"  Tunnel IP: {tunnel['local_ip']}\n"
+        if tunnel["remote"]:
+            text += f"  Server: {tunnel['remote']}\n"
+        if tunnel["time_to_connected"] is not None:
+            text += f"  Connected in: {tunnel['time_to_connected']:.2f} s\n"
+        if tunnel["reconnects"]:
+            text += f"  Reconnects: {tunnel['reconnects']}\n"
+        if tunnel["rx_bytes"] is not None:
+            text += (f"  Traffic: {tunnel['rx_bytes'] / 1048576:.1f} MB in / "
+                     f"{tunnel['tx_bytes'] / 1048576:.1f} MB out\n")
+        if tunnel["state"] != "CONNECTED" and tunnel["last_error"]:
+            text += f"  Last error: {tunnel['last_error']}\n"
+        return text + "\n"
+
+    def _dns_status_text(self):
+        text = f"✓ DNS: {', '.join(self.tunnel_dns)} ({self.dns.method})\n"
+        latency = self._format_dns_latency()
+        if latency:
+            text += f"  Latency: {latency}\n"
+        return text + "\n"
+
+    def _probe_status_text(self):
+        """Status of an openvpn we do not manage, from /proc and /sys.
+
+        Returns (connected, text): True when a process and its tunnel
+        interface exist, False when only the process does, None when no
+        openvpn runs. Syncs is_running with what was found.
+        """
+        try:
+            config = self._load_config()
+        except (OSError, ValueError):
+            config = None
+        tun_iface = self._tunnel_interface(config)
+        probe = probe_status("openvpn", [tun_iface])
+
+        if not probe["pids"]:
+            if self.is_running:
                 self.is_running = False
-                self.root.after(0, self.update_status)
-                break
-            time.sleep(2)
+                self.update_status()
+            return None, "✗ OpenVPN Process: NOT RUNNING\n\nStatus: DISCONNECTED ✗"
+
+        text = "✓ OpenVPN Process: RUNNING\n"
+        text += f"  PIDs: {', '.join(map(str, probe['pids']))}\n\n"
+        link = probe["interfaces"][tun_iface]
+        if link is None:
+            text += "⚠ VPN Tunnel: NOT FOUND\n"
+            text += f"  Interface {tun_iface} not detected\n\n"
+            return False, text + "Status: CONNECTING or FAILED"
+
+        ip_info = ([f"inet {link['ipv4']}"] if link["ipv4"] else []) + \
+            [f"inet6 {address}" for address in link["ipv6"]]
+        text += "✓ VPN Tunnel: ACTIVE\n"
+        text += f"  Interface: {tun_iface} ({link['operstate']})\n"
+        if ip_info:
+            text += f"  {ip_info[0]}\n\n"
+        if not self.is_running:
+            self.is_running = True
+            self.update_status()
+        return True, text + "Status: CONNECTED ✓"
+    
+    def run_leak_test(self):
+        """Run the DNS/IPv6/route leak checks in the background and show the report"""
+        if self._leak_test_running:
+            return
+        self._leak_test_running = True
+        self.leak_test_btn.config(state="disabled")
+        tunnels = [t.dev for t in self.tunnels if t.active and t.dev]
+        threading.Thread(target=self._leak_test_worker, args=(tunnels,), daemon=True).start()
+
+    def _leak_test_worker(self, tunnels):
+        try:
+            # An openvpn started outside the app still counts as the tunnel
+            report = run_leak_checks(tunnels or tunnel_interfaces(), killswitch=self.killswitch_enabled)
+            self._post(self._on_leak_test_done, report, None)
+        except Exception as e:
+            self._post(self._on_leak_test_done, None, f"Leak test failed:\n{str(e)}")
+
+    def _on_leak_test_done(self, report, error):
+        self._leak_test_running = False
+        if hasattr(self, "leak_test_btn"):
+            self.leak_test_btn.config(state="normal")
+        if error:
+            messagebox.showerror("Error", error)
+        elif report.passed:
+            messagebox.showinfo("Leak Test", report.format())
+        else:
+            messagebox.showwarning("Leak Test", report.format())
+
+    def _on_vpn_exit(self, tunnel, returncode):
+        """An openvpn we started has exited (Tk thread)"""
+        if tunnel is not self.tunnel:
+            return
+        # Still "running" while the supervisor brings the tunnel back
+        self.is_running = tunnel.active
+        self.update_status()
+
+    def _on_supervisor_state(self, tunnel, state):
+        """Supervisor state change (Tk thread)"""
+        if tunnel is not self.tunnel:
+            return
+        self.update_status()
+        if state == TunnelSupervisor.FAILED:
+            self.is_running = False
+            self.update_status()
+            messagebox.showerror(
+                "VPN Failed",
+                f"The tunnel could not be re-established after {tunnel.supervisor.max_attempts} attempts."
+                + ("\n\nKillswitch is still ACTIVE." if self.killswitch_enabled else "")
+            )
     
     def update_status(self):
         """Update premium status indicator with glow effect"""
@@ -1139,7 +5389,13 @@ class An0m0sVPN:
             self.start_btn.config(state="disabled", bg=self._blend(self.bg_secondary, self.bg_primary, 0.10))
             self.force_stop_btn.config(state="normal", bg=self.accent_danger)
             if hasattr(self, "connection_pill"):
-                self.connection_pill.config(text="CONNECTED", fg=self.text_primary)
+                management = self.tunnel.management
+                if self.tunnel.supervisor.state == TunnelSupervisor.RECONNECTING:
+                    self.connection_pill.config(text="RECONNECTING", fg=self.accent_warning)
+                elif management is None or management.state == "CONNECTED":
+                    self.connection_pill.config(text="CONNECTED", fg=self.text_primary)
+                else:
+                    self.connection_pill.config(text="CONNECTING", fg=self.text_secondary)
         else:
             # Update button states
             self.start_btn.config(state="normal", bg=self.accent_success)
@@ -1147,508 +5403,346 @@ class An0m0sVPN:
             if hasattr(self, "connection_pill"):
                 self.connection_pill.config(text="DISCONNECTED", fg=self.text_secondary)
     
-    def apply_killswitch(self):
-        """Apply firewall rules to block all traffic except VPN"""
+    def _get_firewall_backend(self):
+        """Detect the firewall backend once and reuse it"""
+        if self.firewall_backend is None:
+            self.firewall_backend = detect_firewall_backend()
+        return self.firewall_backend
+
+    def _load_config(self):
+        """Parsed OvpnConfig of the selected file, or None if none is selected"""
+        if not self.ovpn_file:
+            return None
+        return self.config_cache.load(self.ovpn_file)
+
+    def _tunnel_interface(self, config):
+        """Tunnel interface name for `config` (the first tunN/tapN if dynamic)"""
+        if config is not None and config.device:
+            return config.device
+        prefix = config.device_type if config is not None else "tun"
         try:
-            # Check if we have root privileges
-            if os.geteuid() != 0:
-                messagebox.showerror("Error", "App must run with root privileges!\nRestart with: pkexec python3 an0m0s_vpn.py")
-                return False
-            
-            # Get current default gateway and interface
-            try:
-                route_output = subprocess.run(['ip', 'route', 'show', 'default'], 
-                                            capture_output=True, text=True, timeout=5)
-                default_iface = None
-                default_gateway = None
-                
-                if route_output.returncode == 0 and route_output.stdout:
-                    # Parse: default via 192.168.1.1 dev eth0
-                    parts = route_output.stdout.split()
-                    if 'via' in parts:
-                        default_gateway = parts[parts.index('via') + 1]
-                    if 'dev' in parts:
-                        default_iface = parts[parts.index('dev') + 1]
-            except Exception as e:
-                default_iface = None
-                default_gateway = None
-            
-            # Get VPN server from config file
-            vpn_servers = []
-            vpn_ports = []
-            if self.ovpn_file and os.path.exists(self.ovpn_file):
-                try:
-                    with open(self.ovpn_file, 'r') as f:
-                        for line in f:
-                            line = line.strip()
-                            if line.startswith('remote '):
-                                parts = line.split()
-                                if len(parts) >= 2:
-                                    vpn_servers.append(parts[1])
-                                if len(parts) >= 3:
-                                    try:
-                                        vpn_ports.append(int(parts[2]))
-                                    except:
-                                        pass
-                            elif line.startswith('port '):
-                                parts = line.split()
-                                if len(parts) >= 2:
-                                    try:
-                                        vpn_ports.append(int(parts[1]))
-                                    except:
-                                        pass
-                except Exception as e:
-                    pass
-            
-            # Default VPN ports if none found
-            if not vpn_ports:
-                vpn_ports = [1194, 443]
-
-            def is_safe_iface(value: str) -> bool:
-                if not value:
-                    return False
-                # Linux ifname max length is typically 15 chars, but allow slightly more
-                if len(value) > 32:
-                    return False
-                return bool(re.fullmatch(r"[A-Za-z0-9_.:+-]+", value))
-
-            def normalize_ports(ports):
-                normalized = []
-                for port in ports:
-                    try:
-                        p = int(port)
-                    except Exception:
-                        continue
-                    if 1 <= p <= 65535 and p not in normalized:
-                        normalized.append(p)
-                return normalized
-
-            def normalize_servers(servers):
-                normalized = []
-                for server in servers:
-                    if not server:
-                        continue
-                    s = str(server).strip()
-                    # Keep as a single token; iptables will reject invalid values.
-                    # This avoids command injection by never using a shell.
-                    if len(s) > 255:
-                        continue
-                    if s not in normalized:
-                        normalized.append(s)
-                return normalized
+            names = sorted(n for n in os.listdir(SYS_NET)
+                           if n.startswith(prefix) and n[len(prefix):].isdigit())
+        except OSError:
+            names = []
+        return names[0] if names else prefix + "0"
 
-            def run_cmd(argv, timeout=10, ignore_errors=False, stdin=None, stdout=None):
-                try:
-                    cp = subprocess.run(
-                        argv,
-                        capture_output=(stdout is None and stdin is None),
-                        text=True,
-                        timeout=timeout,
-                        stdin=stdin,
-                        stdout=stdout,
-                    )
-                    if cp.returncode != 0 and not ignore_errors:
-                        return False
-                    return True
-                except FileNotFoundError:
-                    return False if not ignore_errors else True
-                except Exception:
-                    return False if not ignore_errors else True
+    def _read_default_route(self, family):
+        """Return (iface, gateway) of the default route for IP version `family`"""
+        return read_default_route(family)
 
-            vpn_ports = normalize_ports(vpn_ports)
-            vpn_servers = normalize_servers(vpn_servers)
+    def _build_killswitch_spec(self):
+        """Collect the current route and VPN config into a KillswitchSpec"""
+        # Get current default gateway and interface (IPv4 and IPv6)
+        default_iface, default_gateway = self._read_default_route(4)
+        default_iface6, default_gateway6 = self._read_default_route(6)
 
-            if default_iface and not is_safe_iface(default_iface):
-                default_iface = None
-            
-            # Ensure iptables binaries exist
-            if shutil.which("iptables") is None:
-                messagebox.showerror("Error", "iptables not found on this system.")
-                return False
+        # Get the servers and ports of every tunnel (and the selected
+        # config) from the (cached) parsed configs
+        vpn_servers, vpn_ports = self.tunnels.allowances([self.ovpn_file])
+        
+        # Default VPN ports if none found
+        if not vpn_ports:
+            vpn_ports = [1194, 443]
 
-            # Step 1: Backup current rules (best-effort)
-            try:
-                backup_dir = "/run" if os.path.isdir("/run") and os.access("/run", os.W_OK) else "/tmp"
-                with tempfile.NamedTemporaryFile(
-                    mode="wb",
-                    prefix="an0m0s_iptables_",
-                    suffix=".rules",
-                    dir=backup_dir,
-                    delete=False,
-                ) as fp:
-                    self._iptables_backup_path = fp.name
-                try:
-                    os.chmod(self._iptables_backup_path, 0o600)
-                except Exception:
-                    pass
-                with open(self._iptables_backup_path, "wb") as out_fp:
-                    run_cmd(["iptables-save"], timeout=10, ignore_errors=True, stdout=out_fp)
-            except Exception:
-                self._iptables_backup_path = None
-
-            # Step 2: Flush existing rules
-            commands = [
-                ["iptables", "-F"],
-                ["iptables", "-X"],
-                ["iptables", "-t", "nat", "-F"],
-                ["iptables", "-t", "nat", "-X"],
-                ["iptables", "-t", "mangle", "-F"],
-                ["iptables", "-t", "mangle", "-X"],
-            ]
-            failed = 0
-            for argv in commands:
-                if not run_cmd(argv, timeout=10, ignore_errors=True):
-                    failed += 1
-
-            # Step 3: Set ACCEPT policies first (avoid lockout)
-            for argv in (
-                ["iptables", "-P", "INPUT", "ACCEPT"],
-                ["iptables", "-P", "OUTPUT", "ACCEPT"],
-                ["iptables", "-P", "FORWARD", "ACCEPT"],
-            ):
-                if not run_cmd(argv, timeout=10, ignore_errors=False):
-                    failed += 1
-
-            # Step 4: Allow loopback
-            for argv in (
-                ["iptables", "-A", "INPUT", "-i", "lo", "-j", "ACCEPT"],
-                ["iptables", "-A", "OUTPUT", "-o", "lo", "-j", "ACCEPT"],
-            ):
-                if not run_cmd(argv, timeout=10, ignore_errors=False):
-                    failed += 1
-
-            # Step 5: Allow established connections
-            for argv in (
-                ["iptables", "-A", "INPUT", "-m", "conntrack", "--ctstate", "ESTABLISHED,RELATED", "-j", "ACCEPT"],
-                ["iptables", "-A", "OUTPUT", "-m", "conntrack", "--ctstate", "ESTABLISHED,RELATED", "-j", "ACCEPT"],
-            ):
-                if not run_cmd(argv, timeout=10, ignore_errors=False):
-                    failed += 1
-
-            # Step 6: Allow VPN tunnel
-            for argv in (
-                ["iptables", "-A", "INPUT", "-i", "tun+", "-j", "ACCEPT"],
-                ["iptables", "-A", "OUTPUT", "-o", "tun+", "-j", "ACCEPT"],
-                ["iptables", "-A", "INPUT", "-i", "tap+", "-j", "ACCEPT"],
-                ["iptables", "-A", "OUTPUT", "-o", "tap+", "-j", "ACCEPT"],
-            ):
-                if not run_cmd(argv, timeout=10, ignore_errors=False):
-                    failed += 1
-
-            # Step 7: Allow DNS (before VPN connects)
-            if default_iface:
-                for argv in (
-                    ["iptables", "-A", "OUTPUT", "-o", default_iface, "-p", "udp", "--dport", "53", "-j", "ACCEPT"],
-                    ["iptables", "-A", "INPUT", "-i", default_iface, "-p", "udp", "--sport", "53", "-j", "ACCEPT"],
-                ):
-                    if not run_cmd(argv, timeout=10, ignore_errors=False):
-                        failed += 1
-
-            # Step 8: Allow DHCP
-            if default_iface:
-                for argv in (
-                    ["iptables", "-A", "OUTPUT", "-o", default_iface, "-p", "udp", "--dport", "67:68", "-j", "ACCEPT"],
-                    ["iptables", "-A", "INPUT", "-i", default_iface, "-p", "udp", "--sport", "67:68", "-j", "ACCEPT"],
-                ):
-                    if not run_cmd(argv, timeout=10, ignore_errors=False):
-                        failed += 1
-
-            # Step 9: Allow VPN server connections
-            if default_iface:
-                if vpn_servers:
-                    for server in vpn_servers:
-                        for port in vpn_ports:
-                            for proto in ("udp", "tcp"):
-                                argv = [
-                                    "iptables",
-                                    "-A",
-                                    "OUTPUT",
-                                    "-o",
-                                    default_iface,
-                                    "-d",
-                                    server,
-                                    "-p",
-                                    proto,
-                                    "--dport",
-                                    str(port),
-                                    "-j",
-                                    "ACCEPT",
-                                ]
-                                if not run_cmd(argv, timeout=10, ignore_errors=False):
-                                    failed += 1
-                        argv_in = ["iptables", "-A", "INPUT", "-i", default_iface, "-s", server, "-j", "ACCEPT"]
-                        if not run_cmd(argv_in, timeout=10, ignore_errors=False):
-                            failed += 1
-                else:
-                    for port in vpn_ports:
-                        for proto in ("udp", "tcp"):
-                            argv = [
-                                "iptables",
-                                "-A",
-                                "OUTPUT",
-                                "-o",
-                                default_iface,
-                                "-p",
-                                proto,
-                                "--dport",
-                                str(port),
-                                "-j",
-                                "ACCEPT",
-                            ]
-                            if not run_cmd(argv, timeout=10, ignore_errors=False):
-                                failed += 1
-
-            # Step 10: Allow gateway
-            if default_gateway and default_iface:
-                for argv in (
-                    ["iptables", "-A", "OUTPUT", "-o", default_iface, "-d", default_gateway, "-j", "ACCEPT"],
-                    ["iptables", "-A", "INPUT", "-i", default_iface, "-s", default_gateway, "-j", "ACCEPT"],
-                ):
-                    if not run_cmd(argv, timeout=10, ignore_errors=False):
-                        failed += 1
-
-            # Step 11: Drop all other traffic on physical interface
-            if default_iface:
-                for argv in (
-                    ["iptables", "-A", "OUTPUT", "-o", default_iface, "-j", "DROP"],
-                    ["iptables", "-A", "INPUT", "-i", default_iface, "-j", "DROP"],
-                ):
-                    if not run_cmd(argv, timeout=10, ignore_errors=False):
-                        failed += 1
-
-            # Step 12: Block IPv6 (best-effort)
-            for argv in (
-                ["ip6tables", "-P", "INPUT", "DROP"],
-                ["ip6tables", "-P", "OUTPUT", "DROP"],
-                ["ip6tables", "-P", "FORWARD", "DROP"],
-            ):
-                run_cmd(argv, timeout=10, ignore_errors=True)
-
-            # If too many failures, consider it unsuccessful
-            total_ops = 1 + 6 + 3 + 2 + 2 + 4
-            if failed > max(5, total_ops // 2):
-                return False
+        vpn_ports = normalize_ports(vpn_ports)
+        vpn_servers = normalize_servers(vpn_servers)
+
+        # Resolve `remote` hostnames up front (concurrently, cached) so the
+        # firewall only ever sees literal addresses
+        vpn_servers = self.remote_resolver.resolve_all(vpn_servers)
+
+        tunnel_devs = {tunnel.dev for tunnel in self.tunnels if tunnel.dev}
+        default_iface, default_gateway = self._physical_route(4, default_iface, default_gateway, tunnel_devs)
+        default_iface6, default_gateway6 = self._physical_route(6, default_iface6, default_gateway6, tunnel_devs)
+
+        return KillswitchSpec(
+            default_iface,
+            normalize_gateway(default_gateway, 4),
+            vpn_servers,
+            vpn_ports,
+            default_iface6=default_iface6,
+            default_gateway6=normalize_gateway(default_gateway6, 6),
+            dns_servers=self.tunnel_dns,
+        )
+
+    def _physical_route(self, family, iface, gateway, tunnel_devs):
+        """The default route if it is on a physical link, else the last one that was.
+
+        A default route through a tunnel (redirect-gateway without def1)
+        or none at all (link flap, roaming) must not empty phys_ifaces:
+        that would drop every DROP rule.
+        """
+        if iface and is_safe_iface(iface) and not is_tunnel_iface(iface) and iface not in tunnel_devs:
+            self._last_default_routes[family] = (iface, gateway)
+            return iface, gateway
+        return self._last_default_routes.get(family, (None, None))
+
+    def _killswitch_up(self):
+        """Apply the killswitch (any thread).
+
+        Returns None on success, otherwise an error message for the user
+        (empty when the firewall command itself failed).
+        """
+        try:
+            # Check if we have root privileges
+            if os.geteuid() != 0:
+                return "App must run with root privileges!\nRestart with: pkexec python3 an0m0s_vpn.py"
             
-            self.killswitch_enabled = True
-            return True
+            # Pick nftables when available, iptables otherwise
+            backend = self._get_firewall_backend()
+            if backend is None:
+                return "Neither nft nor iptables-restore was found on this system."
+
+            # Reconcile: only the rules that differ from the live ruleset change
+            with self._firewall_lock:
+                if not backend.apply(self._build_killswitch_spec()):
+                    return ""
+                self.killswitch_enabled = True
+            return None
             
         except Exception as e:
-            messagebox.showerror("Error", f"Killswitch failed:\n{str(e)}")
-            return False
+            return f"Killswitch failed:\n{str(e)}"
+
+    def apply_killswitch(self):
+        """Apply firewall rules to block all traffic except VPN"""
+        error = self._killswitch_up()
+        if error:
+            messagebox.showerror("Error", error)
+        return error is None
     
-    def remove_killswitch(self):
-        """Remove killswitch and restore normal network"""
+    def _network_state(self):
+        """The default routes and tunnel states a network change is judged by"""
+        routes = (self._read_default_route(4), self._read_default_route(6))
+        return routes, tuple((t.name, t.dev, t.supervisor.state) for t in self.tunnels)
+
+    def _on_network_change(self):
+        """Re-check the IP and re-target the killswitch at the new default route (watcher thread)"""
+        # Address and link events elsewhere (containers, Wi-Fi scans, a
+        # DHCP renewal) leave the default route alone: nothing to redo
+        state = self._network_state()
+        if state == self._last_network_state:
+            return
+        self._last_network_state = state
+        # The cached IP is what the route change may have made wrong
+        self.ip_lookup.invalidate()
+        self.ip_refresh.request("route change", force=True)
+        self._retarget_killswitch()
+
+    def _retarget_killswitch(self):
+        """Re-apply the killswitch with a fresh spec if it is up (worker thread)"""
+        if not self.killswitch_enabled:
+            return
+        backend = self._get_firewall_backend()
+        if backend is None:
+            return
+        with self._firewall_lock:
+            if self.killswitch_enabled:
+                backend.apply(self._build_killswitch_spec())
+
+    def _killswitch_down(self):
+        """Remove the killswitch (any thread); None on success, else an error message"""
         try:
             # Check if we have root privileges
             if os.geteuid() != 0:
-                messagebox.showerror("Error", "App must run with root privileges!")
-                return False
-            
-            def run_cmd(argv, timeout=10, ignore_errors=False, stdin=None):
-                try:
-                    cp = subprocess.run(
-                        argv,
-                        capture_output=(stdin is None),
-                        text=True,
-                        timeout=timeout,
-                        stdin=stdin,
-                    )
-                    if cp.returncode != 0 and not ignore_errors:
-                        return False
-                    return True
-                except FileNotFoundError:
-                    return False if not ignore_errors else True
-                except Exception:
-                    return False if not ignore_errors else True
-
-            # Best-effort restore from backup created when enabling killswitch
-            restored = False
-            if self._iptables_backup_path and os.path.exists(self._iptables_backup_path):
-                try:
-                    st = os.stat(self._iptables_backup_path)
-                    # Require root-owned and not world/group readable
-                    if st.st_uid == 0 and (st.st_mode & 0o077) == 0:
-                        if shutil.which("iptables-restore") is not None:
-                            with open(self._iptables_backup_path, "rb") as fp:
-                                restored = run_cmd(["iptables-restore"], timeout=15, ignore_errors=False, stdin=fp)
-                except Exception:
-                    restored = False
-
-            if restored:
-                try:
-                    os.remove(self._iptables_backup_path)
-                except Exception:
-                    pass
-                self._iptables_backup_path = None
-            else:
-                # Fallback: restore normal internet by flushing and setting ACCEPT policies
-                commands = [
-                    ["iptables", "-P", "INPUT", "ACCEPT"],
-                    ["iptables", "-P", "OUTPUT", "ACCEPT"],
-                    ["iptables", "-P", "FORWARD", "ACCEPT"],
-                    ["iptables", "-F"],
-                    ["iptables", "-X"],
-                    ["iptables", "-t", "nat", "-F"],
-                    ["iptables", "-t", "nat", "-X"],
-                    ["iptables", "-t", "mangle", "-F"],
-                    ["iptables", "-t", "mangle", "-X"],
-                    ["ip6tables", "-P", "INPUT", "ACCEPT"],
-                    ["ip6tables", "-P", "OUTPUT", "ACCEPT"],
-                    ["ip6tables", "-P", "FORWARD", "ACCEPT"],
-                    ["ip6tables", "-F"],
-                ]
-                failed = 0
-                for argv in commands:
-                    if not run_cmd(argv, timeout=10, ignore_errors=True):
-                        failed += 1
-                if failed > len(commands) / 2:
-                    return False
+                return "App must run with root privileges!"
             
-            self.killswitch_enabled = False
-            return True
+            backend = self._get_firewall_backend()
+            with self._firewall_lock:
+                if backend is None:
+                    return ""
+                # Cleared before the teardown and under the lock, so a
+                # concurrent re-target cannot put the rules back
+                was_enabled = self.killswitch_enabled
+                self.killswitch_enabled = False
+                if not backend.remove():
+                    self.killswitch_enabled = was_enabled
+                    return ""
+            return None
             
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to restore:\n{str(e)}")
-            return False
+            return f"Failed to restore:\n{str(e)}"
+
+    def remove_killswitch(self):
+        """Remove killswitch and restore normal network (blocking; workers and tools)"""
+        error = self._killswitch_down()
+        if error:
+            messagebox.showerror("Error", error)
+        return error is None
     
     def force_stop_vpn(self):
         """Force stop VPN using direct sudo commands"""
+        # Between reconnect attempts there is no process, but the
+        # supervisor is still about to launch the next one
+        if not self.tunnel.active and self.tunnel.process is None:
+            messagebox.showwarning(
+                "Stop",
+                "No OpenVPN process started by this app is running.\n\n"
+                "Other OpenVPN instances (e.g. system services) are left alone."
+            )
+            return
+
         response = messagebox.askyesno(
-            "Force Stop",
-            "This will forcefully kill all OpenVPN processes.\n\nContinue?"
+            "Stop VPN",
+            "This will disconnect the VPN tunnel.\n\nContinue?"
         )
         
         if not response:
             return
-        
+
+        if self._pipeline_busy:
+            messagebox.showwarning("Warning", "A connect, disconnect or firewall change is already in progress.")
+            return
+
+        # No reconnects from here on: this stop is intentional
+        self.tunnel.supervisor.stop()
+        if self.tunnel.process is None:
+            # Waiting out the reconnect backoff: cancelling it is the stop
+            # (an attempt launching right now sees the supervisor stopped)
+            self.is_running = False
+            self.update_status()
+            messagebox.showinfo("Success", "Reconnect cancelled, VPN stopped.")
+            return
+        tunnel, pid = self.tunnel, self.tunnel.pid
+        self._run_pipeline("STOPPING", lambda: self._disconnect_worker(tunnel, pid))
+
+    def _disconnect_worker(self, tunnel, pid, timeout=5.0):
+        """Disconnect pipeline (worker thread): graceful stop of our own openvpn"""
         try:
-            # Direct force kill (already running as root)
-            commands = [
-                ['killall', '-9', 'openvpn'],
-                ['pkill', '-9', '-f', 'openvpn']
-            ]
-            
-            for cmd in commands:
-                try:
-                    result = subprocess.run(cmd, capture_output=True, 
-                                          text=True, timeout=5)
-                except Exception as e:
-                    pass
-            
-            time.sleep(2)
-            
-            # Check if stopped
-            check = subprocess.run(['pgrep', '-x', 'openvpn'], 
-                                  capture_output=True, text=True)
+            self._post(self._on_disconnect_done, tunnel.stop(timeout), pid, None)
+        except Exception as e:
+            self._post(self._on_disconnect_done, False, pid, f"Stop failed:\n{str(e)}")
+
+    def _on_disconnect_done(self, stopped, pid, error):
+        self._pipeline_busy = False
+        if error:
+            self.update_status()
+            messagebox.showerror("Error", error)
+        elif not stopped:
+            self.update_status()
+            messagebox.showerror(
+                "Failed",
+                f"Stop failed!\nOpenVPN (PID {pid}) is still running.\n\nTry in terminal:\nsudo kill -9 {pid}"
+            )
+        else:
+            self.is_running = False
+            self.update_status()
             
-            if check.returncode == 0:
-                messagebox.showerror(
-                    "Failed",
-                    "Force stop failed!\nOpenVPN still running.\n\nTry in terminal:\nsudo killall -9 openvpn"
+            # Don't touch killswitch - let user control it manually via toggle
+            if self.killswitch_enabled:
+                messagebox.showinfo(
+                    "✓ VPN Stopped",
+                    "VPN stopped successfully!\n\n" +
+                    "⚠ WARNING: Killswitch is still ACTIVE\n" +
+                    "Internet is blocked. Use the toggle to disable it."
                 )
             else:
-                self.is_running = False
-                self.vpn_process = None
-                self.vpn_pid = None
-                
-                # Don't touch killswitch - let user control it manually via toggle
-                if self.killswitch_enabled:
-                    messagebox.showinfo(
-                        "✓ VPN Stopped",
-                        "VPN force stopped successfully!\n\n" +
-                        "⚠ WARNING: Killswitch is still ACTIVE\n" +
-                        "Internet is blocked. Use the toggle to disable it."
-                    )
-                else:
-                    self.update_status()
-                    messagebox.showinfo("Success", "VPN force stopped successfully!")
-                
-                self.update_status()
-                # Refresh IP info after stopping VPN
-                time.sleep(2)
-                self.refresh_ip_info()
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"Force stop failed:\n{str(e)}")
+                messagebox.showinfo("Success", "VPN stopped successfully!")
     
     def restore_network(self):
-        """Restore network to normal (remove all iptables rules)"""
+        """Restore network to normal (remove the killswitch rules)"""
         response = messagebox.askyesno(
             "Restore Network",
-            "This will remove all firewall rules and restore normal internet.\nContinue?"
+            "This will remove the killswitch firewall rules and restore normal internet.\nContinue?"
         )
         if response:
-            if self.remove_killswitch():
-                messagebox.showinfo("Success", "Network restored to normal!")
-            else:
-                messagebox.showerror("Error", "Failed to restore network!")
+            self._run_pipeline("RESTORING", self._killswitch_down, self._on_network_restored)
+
+    def _on_network_restored(self, error):
+        self._pipeline_busy = False
+        self.update_status()
+        if error is None:
+            self.killswitch_var.set(False)
+            self._sync_toggle_visual()
+            messagebox.showinfo("Success", "Network restored to normal!")
+        else:
+            messagebox.showerror("Error", error or "Failed to restore network!")
     
     def close_app(self):
         """Close application with cleanup"""
-        self.animation_running = False  # Stop animations
-        
-        # Unbind mouse wheel events
-        try:
-            self.canvas.unbind_all("<MouseWheel>")
-            self.canvas.unbind_all("<Button-4>")
-            self.canvas.unbind_all("<Button-5>")
-        except:
-            pass
-        
         if self.is_running:
             response = messagebox.askyesno(
                 "Confirm exit",
-                "VPN is still running. Force stop it and exit?"
+                "VPN is still running. Stop it and exit?"
             )
             if response:
-                # Force stop without asking again
-                try:
-                    commands = [
-                        ['killall', '-9', 'openvpn'],
-                        ['pkill', '-9', '-f', 'openvpn']
-                    ]
-                    for cmd in commands:
-                        try:
-                            subprocess.run(cmd, capture_output=True, timeout=5)
-                        except:
-                            pass
-                    self.is_running = False
+                # Stop without asking again (in the background, so the
+                # killswitch question below shows up immediately)
+                workers = [self._start_worker(self._stop_own_tunnels)]
+                self.is_running = False
                     
-                    # Check killswitch before closing
-                    if self.killswitch_enabled:
-                        ks_response = messagebox.askyesno(
-                            "Killswitch still active",
-                            "Killswitch is active — internet is blocked outside the VPN.\n\n" +
-                            "Disable killswitch before closing?\n\n" +
-                            "• Yes: disable and restore internet\n" +
-                            "• No: keep killswitch active"
-                        )
-                        if ks_response:
-                            self.remove_killswitch()
-                            # Update toggle visual
-                            self.killswitch_var.set(False)
-                            self.toggle_canvas.itemconfig(self.toggle_bg,
-                                                         fill=self.bg_secondary,
-                                                         outline=self.text_secondary)
-                            self.toggle_canvas.coords(self.toggle_circle, 8, 8, 28, 22)
-                            self.toggle_canvas.itemconfig(self.toggle_circle, fill=self.text_secondary)
-                except:
-                    pass
-                time.sleep(1)
-                self.root.quit()
+                # Check killswitch before closing
+                if self.killswitch_enabled:
+                    ks_response = messagebox.askyesno(
+                        "Killswitch still active",
+                        "Killswitch is active — internet is blocked outside the VPN.\n\n" +
+                        "Disable killswitch before closing?\n\n" +
+                        "• Yes: disable and restore internet\n" +
+                        "• No: keep killswitch active"
+                    )
+                    if ks_response:
+                        workers.append(self._start_worker(self._killswitch_down))
+                        self.killswitch_var.set(False)
+                        self._sync_toggle_visual()
+                self._quit_when_done(*workers)
         else:
             # Check if killswitch is active
+            workers = []
             if self.killswitch_enabled:
                 response = messagebox.askyesno(
                     "Killswitch active",
                     "Killswitch is still active. Disable it before closing?"
                 )
                 if response:
-                    self.remove_killswitch()
-            self.root.quit()
+                    workers.append(self._start_worker(self._killswitch_down))
+            self._quit_when_done(*workers)
+
+    @staticmethod
+    def _start_worker(target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def _stop_own_tunnels(self):
+        try:
+            self.tunnels.stop_all()
+        except Exception:
+            pass
+        try:
+            self._restore_dns()
+        except Exception:
+            pass
+
+    def _quit_when_done(self, *workers):
+        """Quit once every worker has finished, without blocking the Tk loop"""
+        if any(worker.is_alive() for worker in workers):
+            self.root.after(50, self._quit_when_done, *workers)
+        else:
+            self._quit()
+
+    def _quit(self):
+        """Stop the background workers and leave the Tk loop (exit confirmed)"""
+        self.animation_running = False  # Stop animations
+        self.ip_refresh.stop()
+        self.network_watcher.stop()
+
+        # Unbind mouse wheel events
+        try:
+            self.canvas.unbind_all("<MouseWheel>")
+            self.canvas.unbind_all("<Button-4>")
+            self.canvas.unbind_all("<Button-5>")
+        except:
+            pass
+        self.root.quit()
 
 
 def main():
+    # Headless tools: no root, no window
+    if "--compile-geoip" in sys.argv[1:]:
+        sys.exit(compile_geoip_main(sys.argv[1:]))
+    if "--leak-test" in sys.argv[1:]:
+        sys.exit(leak_test_main(sys.argv[1:]))
+
     # Check and get root privileges first
     check_root()
     
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Killswitch apply/remove benchmark.
+
+Runs apply_killswitch() and remove_killswitch() headless (no Tk window, no
+messagebox) against recording stub firewall binaries put
+first on PATH, for configs with 1, 10, 100 and 1000 `remote` entries.
+Reports wall time, process spawn count and rule count per backend.
+
+Usage: python3 benchmarks/bench_killswitch.py [--remotes 1,10,100,1000]
+                                              [--backend iptables,nftables]
+                                              [--repeat 5] [--json]
+"""
+
+import argparse
+import ipaddress
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import An0m0s_vpn as vpn  # noqa: E402
+
+LOG_LINE = 'echo "$(basename "$0") $*" >> "$AN0M0S_BENCH_DIR/calls.log"\n'
+
+STUBS = {
+    "iptables": "",
+    "ip6tables": "",
+    "iptables-save": (
+        'if [ -f "$AN0M0S_BENCH_DIR/iptables.state" ]; then cat "$AN0M0S_BENCH_DIR/iptables.state"\n'
+        'else printf "*filter\\n:INPUT ACCEPT [0:0]\\n:FORWARD ACCEPT [0:0]\\n:OUTPUT ACCEPT [0:0]\\nCOMMIT\\n"; fi\n'
+    ),
+    "ip6tables-save": (
+        'if [ -f "$AN0M0S_BENCH_DIR/ip6tables.state" ]; then cat "$AN0M0S_BENCH_DIR/ip6tables.state"\n'
+        'else printf "*filter\\n:INPUT ACCEPT [0:0]\\n:FORWARD ACCEPT [0:0]\\n:OUTPUT ACCEPT [0:0]\\nCOMMIT\\n"; fi\n'
+    ),
+    "iptables-restore": 'cat > "$AN0M0S_BENCH_DIR/iptables-restore.in"\n',
+    "ip6tables-restore": 'cat > "$AN0M0S_BENCH_DIR/ip6tables-restore.in"\n',
+    "nft": (
+        'case " $* " in\n'
+        '    *" -j "*) [ -f "$AN0M0S_BENCH_DIR/nft.json" ] || exit 1; cat "$AN0M0S_BENCH_DIR/nft.json" ;;\n'
+        '    *) cat > "$AN0M0S_BENCH_DIR/nft.in" ;;\n'
+        'esac\n'
+    ),
+}
+
+BACKENDS = {
+    "iptables": vpn.IptablesBackend,
+    "nftables": vpn.NftablesBackend,
+}
+
+
+class HeadlessMessagebox:
+    """Stands in for tkinter.messagebox: answers yes and records the rest"""
+
+    def __init__(self):
+        self.shown = []
+
+    def askyesno(self, title, message, **kwargs):
+        return True
+
+    def showinfo(self, title, message, **kwargs):
+        self.shown.append(("info", title))
+
+    def showwarning(self, title, message, **kwargs):
+        self.shown.append(("warning", title))
+
+    def showerror(self, title, message, **kwargs):
+        self.shown.append(("error", title))
+
+
+class NullWatcher:
+    """Keeps the network watcher out of the measurement"""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def install_stubs(directory):
+    """Write the recording stub binaries and put them first on PATH"""
+    bin_dir = os.path.join(directory, "bin")
+    os.makedirs(bin_dir)
+    for name, body in STUBS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n" + LOG_LINE + body)
+        os.chmod(path, 0o755)
+    os.environ["AN0M0S_BENCH_DIR"] = directory
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+
+def write_config(directory, count):
+    """An .ovpn profile with `count` literal-address remote entries"""
+    path = os.path.join(directory, f"remotes-{count}.ovpn")
+    with open(path, "w") as f:
+        f.write("client\ndev tun\nproto udp\n")
+        for i in range(count):
+            f.write(f"remote 10.{i // 62500}.{i // 250 % 250}.{i % 250 + 1} {1194 + i % 3}\n")
+        f.write("nobind\npersist-key\npersist-tun\n")
+    return path
+
+
+def make_app(config, backend):
+    """An An0m0sVPN instance with just the state the firewall code uses"""
+    app = vpn.An0m0sVPN.__new__(vpn.An0m0sVPN)
+    app.ovpn_file = config
+    app.firewall_backend = backend
+    app.remote_resolver = vpn.RemoteResolver()
+    app.config_cache = vpn.OvpnConfigCache()
+    app.tunnels = vpn.TunnelRegistry(app.config_cache)
+    app.tunnel = app.tunnels.add("main")
+    app._firewall_lock = threading.Lock()
+    app._last_default_routes = {}
+    app.network_watcher = NullWatcher()
+    app.tunnel_dns = []
+    app.killswitch_enabled = False
+    return app
+
+
+def write_live_state(directory, ruleset):
+    """Make the stub *-save/nft -j report `ruleset` as already loaded"""
+    for family, name, chains in ((4, "iptables", vpn.KILLSWITCH_CHAINS),
+                                 (6, "ip6tables", vpn.KILLSWITCH_CHAINS_V6)):
+        lines = ["*filter", ":INPUT ACCEPT [0:0]", ":FORWARD ACCEPT [0:0]", ":OUTPUT ACCEPT [0:0]"]
+        lines.extend(f":{owned} - [0:0]" for _, owned in chains)
+        lines.extend(f"-A {builtin} -j {owned}" for builtin, owned in chains)
+        lines.extend(vpn.render_iptables_rules(ruleset, family))
+        lines.append("COMMIT")
+        with open(os.path.join(directory, f"{name}.state"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def element(name, value):
+        if vpn.KILLSWITCH_SETS[name][0] in ("ifname", "inet_service"):
+            return value
+        net = ipaddress.ip_network(value)
+        if net.prefixlen == net.max_prefixlen:
+            return str(net.network_address)
+        return {"prefix": {"addr": str(net.network_address), "len": net.prefixlen}}
+
+    objects = [{"set": {"family": "inet", "table": "an0m0s", "name": vpn.NFT_LAYOUT_SET}}]
+    for name, values in ruleset.sets.items():
+        objects.append({"set": {"family": "inet", "table": "an0m0s", "name": name,
+                                "elem": [element(name, v) for v in values]}})
+    with open(os.path.join(directory, "nft.json"), "w") as f:
+        json.dump({"nftables": objects}, f)
+
+
+def clear_live_state(directory):
+    for name in ("iptables.state", "ip6tables.state", "nft.json"):
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def read_calls(directory):
+    path = os.path.join(directory, "calls.log")
+    try:
+        with open(path) as f:
+            calls = [line.split()[0] for line in f if line.strip()]
+    except FileNotFoundError:
+        calls = []
+    open(path, "w").close()
+    return calls
+
+
+def rule_count(backend_name, ruleset):
+    """Rules the backend loads: expanded rules for iptables, statements for nft"""
+    if backend_name == "iptables":
+        return ruleset.rule_count(4) + ruleset.rule_count(6)
+    return len(ruleset.rules)
+
+
+def run_case(directory, backend_name, count, repeat):
+    config = write_config(directory, count)
+    backend = BACKENDS[backend_name]()
+    app = make_app(config, backend)
+    ruleset = vpn.build_killswitch_ruleset(app._build_killswitch_spec())
+    read_calls(directory)
+
+    def measure(name, action, prepare):
+        times = []
+        spawns = 0
+        ok = True
+        for _ in range(repeat):
+            prepare()
+            read_calls(directory)
+            start = time.perf_counter()
+            ok = action() is not False and ok
+            times.append(time.perf_counter() - start)
+            spawns = len(read_calls(directory))
+        return {
+            "backend": backend_name,
+            "remotes": count,
+            "operation": name,
+            "ok": ok,
+            "wall_ms": statistics.median(times) * 1000,
+            "spawns": spawns,
+            "rules": rule_count(backend_name, ruleset),
+            "set_elements": sum(len(values) for values in ruleset.sets.values()),
+        }
+
+    def cold():
+        app.remote_resolver.clear()
+        clear_live_state(directory)
+
+    def warm():
+        write_live_state(directory, ruleset)
+
+    return [
+        measure("apply (cold)", app.apply_killswitch, cold),
+        measure("apply (unchanged)", app.apply_killswitch, warm),
+        measure("remove", app.remove_killswitch, warm),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark killswitch apply/remove with stub firewall binaries")
+    parser.add_argument("--remotes", default="1,10,100,1000", help="comma separated remote counts")
+    parser.add_argument("--backend", default="iptables,nftables", help="comma separated backends")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement (median is reported)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # Headless: the firewall code believes it is root and never opens a dialog
+    messagebox = HeadlessMessagebox()
+    vpn.messagebox = messagebox
+    vpn.os.geteuid = lambda: 0
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="an0m0s-bench-") as directory:
+        install_stubs(directory)
+        for backend_name in args.backend.split(","):
+            for count in (int(n) for n in args.remotes.split(",")):
+                results.extend(run_case(directory, backend_name, count, args.repeat))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'backend':<10} {'remotes':>7} {'operation':<18} {'ok':<5} {'wall ms':>9} {'spawns':>6} "
+              f"{'rules':>6} {'elements':>8}")
+        for r in results:
+            print(f"{r['backend']:<10} {r['remotes']:>7} {r['operation']:<18} {str(r['ok']):<5} "
+                  f"{r['wall_ms']:>9.2f} {r['spawns']:>6} {r['rules']:>6} {r['set_elements']:>8}")
+    errors = [entry for entry in messagebox.shown if entry[0] == "error"]
+    return 1 if errors or not all(r["ok"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Killswitch simulator benchmark.
+
+Measures packets per second through KillswitchSimulator for a profile with
+`--remotes` literal-address servers: evaluate() one SimPacket at a time,
+evaluate_batch() over pre-built flows of one interface and protocol, and
+find_leaks(), which also generates its random packets. Pure Python; nothing
+needs root or a network.
+
+Usage: python3 benchmarks/bench_simulator.py [--packets 1000000] [--remotes 100]
+                                             [--repeat 3] [--json]
+"""
+
+import argparse
+import ipaddress
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import An0m0s_vpn as vpn  # noqa: E402
+
+
+def make_simulator(remotes):
+    servers = [f"10.{i // 62500}.{i // 250 % 250}.{i % 250 + 1}" for i in range(remotes)]
+    spec = vpn.KillswitchSpec("eth0", "192.168.1.1", servers, [1194, 443], dns_servers=["10.8.0.1"])
+    return vpn.KillswitchSimulator(vpn.build_killswitch_ruleset(spec)), servers
+
+
+def make_flows(count, servers, seed=0):
+    """udp egress flows, a third of them to the VPN servers"""
+    rng = random.Random(seed)
+    targets = [int(ipaddress.ip_address(s)) for s in servers]
+    flows = []
+    for _ in range(count):
+        dst = rng.choice(targets) if rng.random() < 0.3 else rng.getrandbits(32)
+        flows.append((0, dst, rng.randrange(1024, 65536), rng.choice((53, 443, 1194, 8080)), None))
+    return flows
+
+
+def best_rate(run, count, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the in-process killswitch simulator")
+    parser.add_argument("--packets", type=int, default=1000000, help="packets per measurement")
+    parser.add_argument("--remotes", type=int, default=100, help="VPN servers in the ruleset")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per method (the fastest counts)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    simulator, servers = make_simulator(args.remotes)
+    flows = make_flows(args.packets, servers)
+    packets = [vpn.SimPacket("output", 4, oif="eth0", proto="udp", dst=str(ipaddress.IPv4Address(dst)),
+                             sport=sport, dport=dport) for _, dst, sport, dport, _ in flows]
+
+    def single():
+        for packet in packets:
+            simulator.evaluate(packet)
+
+    results = [
+        {"method": "evaluate", "packets_per_s": best_rate(single, len(packets), args.repeat)},
+        {"method": "evaluate_batch", "packets_per_s": best_rate(
+            lambda: simulator.evaluate_batch("output", 4, "udp", flows, oif="eth0"), len(flows), args.repeat)},
+        {"method": "find_leaks", "packets_per_s": best_rate(
+            lambda: simulator.find_leaks(samples=args.packets), args.packets, args.repeat)},
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'method':<16} {'packets/s':>12}")
+        for r in results:
+            print(f"{r['method']:<16} {r['packets_per_s']:>12,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Status probe benchmark.
+
+Times one status snapshot (openvpn PIDs, tunnel interface and addresses,
+IPv4 and IPv6 default routes) taken the old way -- forking `pgrep -x
+openvpn`, `ip addr show <dev>` and `ip -4/-6 route show default` -- against
+probe_status(), which reads /proc and /sys directly. Nothing needs root
+and no tunnel has to be up; missing binaries skip the old-way row.
+
+Usage: python3 benchmarks/bench_status.py [--iterations 200] [--iface tun0] [--json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import An0m0s_vpn as vpn  # noqa: E402
+
+
+def spawn_snapshot(iface):
+    """The pre-probe status check: four child processes"""
+    commands = (
+        ["pgrep", "-x", "openvpn"],
+        ["ip", "addr", "show", iface],
+        ["ip", "-4", "route", "show", "default"],
+        ["ip", "-6", "route", "show", "default"],
+    )
+    for cmd in commands:
+        subprocess.run(cmd, capture_output=True, text=True)
+    return len(commands)
+
+
+def probe_snapshot(iface):
+    vpn.probe_status("openvpn", [iface])
+    return 0
+
+
+def measure(name, snapshot, iface, iterations):
+    times = []
+    spawns = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        spawns = snapshot(iface)
+        times.append(time.perf_counter() - start)
+    return {
+        "method": name,
+        "iterations": iterations,
+        "median_us": statistics.median(times) * 1e6,
+        "p95_us": sorted(times)[int(len(times) * 0.95) - 1] * 1e6,
+        "spawns": spawns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a status check with and without process spawns")
+    parser.add_argument("--iterations", type=int, default=200, help="snapshots per method")
+    parser.add_argument("--iface", default="tun0", help="tunnel interface to look up")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    if shutil.which("pgrep") and shutil.which("ip"):
+        results.append(measure("pgrep + ip", spawn_snapshot, args.iface, args.iterations))
+    else:
+        print("pgrep/ip not found: skipping the spawning variant", file=sys.stderr)
+    results.append(measure("probe_status", probe_snapshot, args.iface, args.iterations))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'method':<14} {'median us':>10} {'p95 us':>10} {'spawns':>6}")
+        for r in results:
+            print(f"{r['method']:<14} {r['median_us']:>10.1f} {r['p95_us']:>10.1f} {r['spawns']:>6}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
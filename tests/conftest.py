@@ -0,0 +1,31 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import An0m0s_vpn as vpn  # noqa: E402
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """An An0m0sVPN instance with just the state the firewall code uses (no Tk)"""
+    def make(remotes=("10.0.0.1 1194",)):
+        config = tmp_path / "test.ovpn"
+        config.write_text("client\ndev tun\n" + "".join(f"remote {r}\n" for r in remotes))
+        app = vpn.An0m0sVPN.__new__(vpn.An0m0sVPN)
+        app.ovpn_file = str(config)
+        app.firewall_backend = None
+        app.remote_resolver = vpn.RemoteResolver()
+        app.config_cache = vpn.OvpnConfigCache()
+        app.tunnels = vpn.TunnelRegistry(app.config_cache)
+        app.tunnel = app.tunnels.add("main")
+        app._firewall_lock = threading.Lock()
+        app._last_default_routes = {}
+        app._last_network_state = None
+        app.tunnel_dns = []
+        app.killswitch_enabled = False
+        return app
+    return make
@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+ORIGINAL = "# from the DHCP client\nnameserver 192.168.1.1\nsearch lan\n"
+
+
+@pytest.fixture
+def etc(tmp_path):
+    """A stand-in /etc without systemd-resolved"""
+    (tmp_path / "etc").mkdir()
+    return tmp_path / "etc"
+
+
+def configurator(etc):
+    return vpn.DnsConfigurator(resolv_conf=str(etc / "resolv.conf"),
+                               resolved_run=str(etc / "no-resolved"))
+
+
+def test_regular_file_is_backed_up_and_restored(etc):
+    resolv_conf = etc / "resolv.conf"
+    resolv_conf.write_text(ORIGINAL)
+    dns = configurator(etc)
+
+    assert dns.apply("tun0", ["10.8.0.1", "fd00::1"], ["corp.example"]) == "resolv.conf"
+    assert resolv_conf.read_text() == (
+        f"{vpn.RESOLV_CONF_MARKER}\nnameserver 10.8.0.1\nnameserver fd00::1\nsearch corp.example\n")
+    assert (etc / "resolv.conf.an0m0s-backup").read_text() == ORIGINAL
+    assert oct(resolv_conf.stat().st_mode & 0o777) == "0o644"
+    # Written through a temp file in the same directory, nothing left over
+    assert sorted(p.name for p in etc.iterdir()) == ["resolv.conf", "resolv.conf.an0m0s-backup"]
+
+    assert dns.restore()
+    assert dns.method is None
+    assert resolv_conf.read_text() == ORIGINAL
+    assert not (etc / "resolv.conf.an0m0s-backup").exists()
+
+
+def test_symlink_is_backed_up_as_a_symlink(etc):
+    target = etc / "stub-resolv.conf"
+    target.write_text(ORIGINAL)
+    resolv_conf = etc / "resolv.conf"
+    resolv_conf.symlink_to("stub-resolv.conf")
+    dns = configurator(etc)
+
+    assert dns.apply("tun0", ["10.8.0.1"]) == "resolv.conf"
+    # The link itself is replaced, not the file it points at
+    assert not resolv_conf.is_symlink()
+    assert target.read_text() == ORIGINAL
+    assert os.readlink(etc / "resolv.conf.an0m0s-backup") == "stub-resolv.conf"
+
+    assert dns.restore()
+    assert resolv_conf.is_symlink() and os.readlink(resolv_conf) == "stub-resolv.conf"
+
+
+def test_reconnect_keeps_the_first_backup(etc):
+    resolv_conf = etc / "resolv.conf"
+    resolv_conf.write_text(ORIGINAL)
+    dns = configurator(etc)
+    dns.apply("tun0", ["10.8.0.1"])
+    dns.apply("tun0", ["10.8.0.2"])
+    assert "nameserver 10.8.0.2" in resolv_conf.read_text()
+    assert (etc / "resolv.conf.an0m0s-backup").read_text() == ORIGINAL
+    dns.restore()
+    assert resolv_conf.read_text() == ORIGINAL
+
+
+def test_recover_after_a_crash(etc):
+    resolv_conf = etc / "resolv.conf"
+    resolv_conf.write_text(ORIGINAL)
+    configurator(etc).apply("tun0", ["10.8.0.1"])
+
+    # A new run after the crash: nothing applied in this process
+    dns = configurator(etc)
+    assert dns.recover()
+    assert resolv_conf.read_text() == ORIGINAL
+    assert not dns.recover()
+
+
+def test_recover_leaves_a_foreign_resolv_conf_alone(etc):
+    resolv_conf = etc / "resolv.conf"
+    resolv_conf.write_text(ORIGINAL)
+    (etc / "resolv.conf.an0m0s-backup").write_text("nameserver 10.0.0.1\n")
+    assert not configurator(etc).recover()
+    assert resolv_conf.read_text() == ORIGINAL
+
+
+def test_systemd_resolved_gets_per_link_dns(etc, monkeypatch):
+    (etc / "resolv.conf").write_text("nameserver 127.0.0.53\n")
+    (etc / "resolved").mkdir()
+    commands = []
+    monkeypatch.setattr(vpn.shutil, "which", lambda name: "/usr/bin/" + name)
+    monkeypatch.setattr(vpn, "run_firewall_cmd", lambda cmd, **kwargs: commands.append(cmd) or True)
+    dns = vpn.DnsConfigurator(resolv_conf=str(etc / "resolv.conf"), resolved_run=str(etc / "resolved"))
+
+    assert dns.apply("tun0", ["10.8.0.1"], ["corp.example"]) == "resolved"
+    assert commands[:2] == [["resolvectl", "dns", "tun0", "10.8.0.1"],
+                            ["resolvectl", "domain", "tun0", "~.", "corp.example"]]
+    assert (etc / "resolv.conf").read_text() == "nameserver 127.0.0.53\n"
+    assert dns.restore()
+    assert commands[-1] == ["resolvectl", "revert", "tun0"]
+
+
+@pytest.mark.parametrize("push_reply, servers, domains", [
+    ("PUSH_REPLY,route-gateway 10.8.0.1,dhcp-option DNS 10.8.0.1,dhcp-option DNS 1.1.1.1",
+     ["10.8.0.1", "1.1.1.1"], []),
+    ("PUSH_REPLY,dhcp-option DNS6 fd00::1,dhcp-option DOMAIN corp.example,dhcp-option DOMAIN-SEARCH lab.example",
+     ["fd00::1"], ["corp.example", "lab.example"]),
+    ("PUSH_REPLY,dhcp-option DNS 10.8.0.1,dhcp-option DNS 10.8.0.1,dhcp-option DNS not-an-ip",
+     ["10.8.0.1"], []),
+    ("PUSH_REPLY,dns server 0 address 10.8.0.1 [fd00::53]:5353,dns search-domains corp.example lab.example",
+     ["10.8.0.1", "fd00::53"], ["corp.example", "lab.example"]),
+    ("PUSH_REPLY,dns server 1 address 10.8.0.2:853#dns.example,dns server 0 address fd00::1",
+     ["10.8.0.2", "fd00::1"], []),
+    ("PUSH_REPLY,redirect-gateway def1,ping 10", [], []),
+])
+def test_parse_pushed_dns(push_reply, servers, domains):
+    assert vpn.parse_pushed_dns(push_reply) == (servers, domains)
+
+
+def test_push_reply_comes_from_the_management_log(make_app):
+    events = []
+    tunnel = make_app().tunnel
+    tunnel.on_event = lambda tunnel, kind, value: events.append((kind, value))
+    client = vpn.ManagementClient("/nonexistent/socket", on_event=tunnel._on_management_event)
+    client._handle_line(">LOG:1700000000,I,PUSH: Received control message: "
+                        "'PUSH_REPLY,route-gateway 10.8.0.1,dhcp-option DNS 10.8.0.1,dhcp-option DOMAIN corp'")
+    client._handle_line(">LOG:1700000001,I,Initialization Sequence Completed")
+    assert events == [("dns", (["10.8.0.1"], ["corp"]))]
+    assert (tunnel.dns_servers, tunnel.dns_domains) == (["10.8.0.1"], ["corp"])
@@ -0,0 +1,105 @@
+import pytest
+
+import An0m0s_vpn as vpn
+
+# DB-IP style: start,end,country and start,end,continent,country,region,city
+RANGES_CSV = """\
+1.0.0.0,1.0.0.255,AU
+1.0.4.0,1.0.7.255,OC,Australia,Victoria,Melbourne
+8.8.8.0,8.8.8.255,US
+223.255.255.0,223.255.255.255,CN
+2001:db8::,2001:db8::ffff,NL
+2a00:1450::,2a00:1450:ffff:ffff:ffff:ffff:ffff:ffff,OC,Ireland,Leinster,Dublin
+not,an,address
+"""
+
+# GeoLite2 style blocks plus a locations file
+BLOCKS_CSV = """\
+network,geoname_id,registered_country_geoname_id
+9.9.9.0/24,2643743,
+2620:fe::/48,,2950159
+"""
+LOCATIONS_CSV = """\
+geoname_id,locale_code,continent_code,continent_name,country_iso_code,country_name,city_name
+2643743,en,EU,Europe,GB,United Kingdom,London
+2950159,en,EU,Europe,DE,Germany,Berlin
+"""
+
+
+@pytest.fixture
+def database(tmp_path):
+    source = tmp_path / "dbip.csv"
+    source.write_text(RANGES_CSV)
+    path = tmp_path / "geoip.bin"
+    assert vpn.compile_geoip([str(source)], str(path)) == (4, 2)
+    db = vpn.GeoIpDatabase(str(path))
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize("ip, location", [
+    ("1.0.0.0", "AU"),
+    ("1.0.0.255", "AU"),
+    ("1.0.1.0", None),
+    ("1.0.5.17", "Melbourne, Australia"),
+    ("8.8.8.8", "US"),
+    ("0.255.255.255", None),
+    ("223.255.255.255", "CN"),
+    ("255.255.255.255", None),
+    ("2001:db8::1", "NL"),
+    ("2001:db8::1:0", None),
+    ("2a00:1450:4001::5", "Dublin, Ireland"),
+    ("::1", None),
+    ("ffff::1", None),
+    ("::ffff:8.8.8.8", "US"),
+    ("::ffff:1.0.1.0", None),
+    ("not an ip", None),
+])
+def test_lookup(database, ip, location):
+    assert database.lookup(ip) == location
+
+
+def test_geolite2_blocks_with_locations(tmp_path):
+    (tmp_path / "blocks.csv").write_text(BLOCKS_CSV)
+    (tmp_path / "locations.csv").write_text(LOCATIONS_CSV)
+    path = tmp_path / "geoip.bin"
+    assert vpn.compile_geoip([str(tmp_path / "blocks.csv")], str(path), str(tmp_path / "locations.csv")) == (1, 1)
+    db = vpn.GeoIpDatabase(str(path))
+    try:
+        assert len(db) == 2
+        assert db.lookup("9.9.9.9") == "London, United Kingdom"
+        # Falls back to the registered country's geoname
+        assert db.lookup("2620:fe::fe") == "Berlin, Germany"
+        assert db.lookup("9.9.10.1") is None
+    finally:
+        db.close()
+
+
+def test_truncated_file_is_rejected(database, tmp_path):
+    data = open(database.path, "rb").read()
+    for size in (len(vpn.GEOIP_MAGIC), vpn._GEOIP_HEADER.size + 5, len(data) - 1):
+        path = tmp_path / f"truncated-{size}.bin"
+        path.write_bytes(data[:size])
+        with pytest.raises(ValueError, match="truncated"):
+            vpn.GeoIpDatabase(str(path))
+
+
+@pytest.mark.parametrize("header", [b"XGEO", vpn.GEOIP_MAGIC + b"\x00\x63"])
+def test_bad_magic_or_version_is_rejected(database, tmp_path, header):
+    data = open(database.path, "rb").read()
+    path = tmp_path / "bad.bin"
+    path.write_bytes(header + data[len(header):])
+    with pytest.raises(ValueError, match="not a geoip database"):
+        vpn.GeoIpDatabase(str(path))
+
+
+def test_geoip_switches_to_plain_ip_echo_providers(database):
+    with_db = vpn.IpLookupService(geoip=database)
+    without = vpn.IpLookupService()
+    try:
+        assert [p.name for p in with_db.providers] == [p.name for p in vpn.IP_ECHO_PROVIDERS]
+        assert all(p.parse is vpn.parse_echo_response for p in with_db.providers)
+        assert [p.name for p in without.providers] == ["ipapi.co", "ipinfo.io"]
+    finally:
+        with_db.close()
+        without.close()
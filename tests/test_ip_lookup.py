@@ -0,0 +1,122 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """Local public-IP endpoints: /fast, /slow, /fail and /count answers"""
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if self.path == "/fail":
+            self.send_error(500)
+            return
+        if self.path.startswith("/slow"):
+            self.server.release.wait(2)
+        body = self.server.answers.get(self.path, b"203.0.113.7").decode()
+        payload = f'{{"ip": "{body}", "city": "Testville", "country_name": "Testland"}}'.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    httpd.daemon_threads = True
+    httpd.block_on_close = False
+    httpd.hits = []
+    httpd.answers = {"/slow": b"198.51.100.1"}
+    httpd.release = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def provider(server, path):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    return vpn.IpInfoProvider(path.strip("/"), url, vpn.parse_ipapi_response)
+
+
+def service(server, paths, **kwargs):
+    return vpn.IpLookupService([provider(server, path) for path in paths], **kwargs)
+
+
+def test_fastest_answer_wins(server):
+    lookups = service(server, ["/slow", "/fail", "/fast"], timeout=5)
+    try:
+        start = time.monotonic()
+        assert lookups.lookup() == ("203.0.113.7", "Testville, Testland")
+        assert time.monotonic() - start < 1.5
+        assert lookups.last_provider == "fast"
+    finally:
+        lookups.close()
+
+
+def test_losers_not_yet_started_are_cancelled(server):
+    # Two workers: /fast and /slow run, /slow2 waits in the queue
+    lookups = service(server, ["/fast", "/slow", "/slow2"], timeout=5, workers=2)
+    try:
+        assert lookups.lookup()[0] == "203.0.113.7"
+        server.release.set()
+        time.sleep(0.3)
+        assert "/slow2" not in server.hits
+    finally:
+        lookups.close()
+
+
+def test_all_failing_returns_none(server):
+    lookups = service(server, ["/fail", "/fail"], timeout=1)
+    try:
+        assert lookups.lookup() is None
+        assert lookups.cached() is None
+    finally:
+        lookups.close()
+
+
+def test_ttl_cache(server):
+    lookups = service(server, ["/fast"], ttl=0.3)
+    try:
+        lookups.lookup()
+        lookups.lookup()
+        assert server.hits.count("/fast") == 1
+        lookups.lookup(force=True)
+        assert server.hits.count("/fast") == 2
+        time.sleep(0.4)
+        assert lookups.cached() is None
+        lookups.lookup()
+        assert server.hits.count("/fast") == 3
+    finally:
+        lookups.close()
+
+
+def test_invalidation_during_a_lookup_is_not_cached(server):
+    lookups = service(server, ["/slow"], timeout=5)
+    try:
+        results = []
+        thread = threading.Thread(target=lambda: results.append(lookups.lookup()))
+        thread.start()
+        while "/slow" not in server.hits:
+            time.sleep(0.01)
+        # The tunnel changed while the answer was on its way
+        lookups.invalidate()
+        server.release.set()
+        thread.join(5)
+        assert results == [("198.51.100.1", "Testville, Testland")]
+        assert lookups.cached() is None
+        lookups.lookup()
+        assert server.hits.count("/slow") == 2
+    finally:
+        lookups.close()
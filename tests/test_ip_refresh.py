@@ -0,0 +1,155 @@
+import threading
+import time
+
+import An0m0s_vpn as vpn
+
+
+class CachedLookup:
+    """A lookup with a result cache, like IpLookupService; blocks until released"""
+
+    def __init__(self, address):
+        self.address = address
+        self.cache = None
+        self.queries = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, force):
+        if self.cache is not None and not force:
+            return self.cache
+        self.queries += 1
+        answer = self.address
+        self.entered.set()
+        self.release.wait(5)
+        self.cache = answer
+        return answer
+
+
+def test_superseded_lookup_is_forced_past_the_cache():
+    lookup = CachedLookup("1.1.1.1")
+    results = []
+    done = threading.Event()
+
+    def on_result(result):
+        results.append(result)
+        done.set()
+
+    scheduler = vpn.IpRefreshScheduler(lookup, on_result=on_result, interval=3600)
+    scheduler.start()
+    try:
+        scheduler.request("tunnel CONNECTED")
+        assert lookup.entered.wait(5)
+        # The address changes while the first lookup is still in flight
+        lookup.address = "2.2.2.2"
+        scheduler.request("route change")
+        lookup.release.set()
+        assert done.wait(5)
+    finally:
+        scheduler.stop()
+    assert scheduler.stale == 1
+    assert lookup.queries == 2
+    assert results == ["2.2.2.2"]
+
+
+class Recording:
+    """Lookup that records when it ran and answers `result`"""
+
+    def __init__(self, result="1.1.1.1"):
+        self.result = result
+        self.starts = []
+        self.ran = threading.Event()
+
+    def __call__(self, force):
+        self.starts.append((time.monotonic(), force))
+        self.ran.set()
+        return self.result
+
+
+def run_scheduler(lookup, **kwargs):
+    scheduler = vpn.IpRefreshScheduler(lookup, interval=3600, **kwargs)
+    scheduler.start()
+    return scheduler
+
+
+def flood(scheduler, seconds, reason="route change", force=True):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        scheduler.request(reason, force=force)
+        time.sleep(0.01)
+
+
+def gaps(starts):
+    return [b[0] - a[0] for a, b in zip(starts, starts[1:])]
+
+
+def test_forced_requests_are_rate_limited():
+    lookup = Recording()
+    scheduler = run_scheduler(lookup, min_interval=0.3)
+    try:
+        flood(scheduler, 1.0)
+        time.sleep(0.35)
+    finally:
+        scheduler.stop()
+    # ~100 route changes: one lookup right away, then one per min_interval
+    assert 3 <= len(lookup.starts) <= 5
+    assert all(gap >= 0.29 for gap in gaps(lookup.starts))
+    assert all(force for _, force in lookup.starts)
+    assert scheduler.held >= 2
+
+
+def test_forced_requests_wait_out_the_failure_backoff():
+    lookup = Recording(result=None)
+    scheduler = run_scheduler(lookup, min_interval=0.05, backoff=0.4, max_backoff=10.0)
+    try:
+        flood(scheduler, 1.0)
+    finally:
+        scheduler.stop()
+    # Lookups at 0, 0.4 and 1.2 s at most, not one per request
+    assert 1 < len(lookup.starts) <= 3
+    assert gaps(lookup.starts)[0] >= 0.39
+    assert scheduler.failures == len(lookup.starts)
+
+
+def test_other_requests_are_not_held():
+    lookup = Recording(result=None)
+    scheduler = run_scheduler(lookup, min_interval=10.0, backoff=10.0)
+    try:
+        scheduler.request("route change", force=True)
+        assert lookup.ran.wait(5)
+        lookup.ran.clear()
+        # Failing and within min_interval: a forced request waits ...
+        scheduler.request("route change", force=True)
+        assert not lookup.ran.wait(0.2)
+        # ... until a tunnel event joins it
+        scheduler.request("tunnel CONNECTED")
+        assert lookup.ran.wait(5)
+    finally:
+        scheduler.stop()
+    assert len(lookup.starts) == 2
+    assert lookup.starts[1][1] is True
+
+
+def test_periodic_checks_do_not_show_loading():
+    app = vpn.An0m0sVPN.__new__(vpn.An0m0sVPN)
+    shown = []
+    app._post = lambda func, *args: shown.append(args)
+    lookup = Recording(result=("1.1.1.1", "Wonderland"))
+    app.ip_refresh = scheduler = vpn.IpRefreshScheduler(
+        lookup, on_start=app._on_ip_lookup_start, on_result=app._on_ip_lookup_result, interval=0.05)
+    scheduler.start()
+    try:
+        scheduler.request("startup")
+        deadline = time.monotonic() + 5
+        while len(lookup.starts) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        scheduler.request("tunnel CONNECTED")
+        deadline = time.monotonic() + 5
+        while shown.count(("Loading…", "Loading…", True)) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    loading = [n for n, args in enumerate(shown) if args == ("Loading…", "Loading…", True)]
+    assert loading[0] == 0 and len(loading) == 2
+    # Between the two events only the periodic results were shown
+    assert set(shown[1:loading[1]]) == {("1.1.1.1", "Wonderland")}
+    assert loading[1] - 1 >= 3
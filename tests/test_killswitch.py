@@ -0,0 +1,101 @@
+import An0m0s_vpn as vpn
+
+
+def route_table(app, routes):
+    """Make the app read its default routes from `routes` ({family: (iface, gateway)})"""
+    app._read_default_route = lambda family: routes.get(family, (None, None))
+
+
+def evaluate(spec, **packet):
+    simulator = vpn.KillswitchSimulator(vpn.build_killswitch_ruleset(spec))
+    return simulator.evaluate(vpn.SimPacket("output", 4, proto="tcp", sport=40000, **packet))
+
+
+def test_default_route_on_tunnel_keeps_physical_link(make_app):
+    app = make_app()
+    routes = {4: ("eth0", "192.168.1.1")}
+    route_table(app, routes)
+    assert evaluate(app._build_killswitch_spec(), oif="eth0", dst="8.8.4.4", dport=443) == "drop"
+
+    # redirect-gateway without def1 moves the default route onto tun0
+    routes[4] = ("tun0", "10.8.0.1")
+    spec = app._build_killswitch_spec()
+    assert spec.default_iface == "eth0"
+    assert evaluate(spec, oif="eth0", dst="8.8.4.4", dport=443) == "drop"
+    assert evaluate(spec, oif="eth0", dst="10.0.0.1", dport=1194) == "accept"
+    assert evaluate(spec, oif="tun0", dst="8.8.4.4", dport=443) == "accept"
+
+
+def test_tunnel_device_never_becomes_physical(make_app):
+    app = make_app()
+    app.tunnel.dev = "vpn0"
+    route_table(app, {4: ("vpn0", "10.8.0.1"), 6: ("tap1", None)})
+    spec = app._build_killswitch_spec()
+    assert spec.default_iface is None and spec.default_iface6 is None
+    ruleset = vpn.build_killswitch_ruleset(vpn.KillswitchSpec("tun0", None, ["10.0.0.1"], [1194]))
+    assert not ruleset.sets["phys_ifaces"]
+
+
+def test_lost_default_route_keeps_rules(make_app):
+    app = make_app()
+    routes = {4: ("wlan0", "192.168.1.1")}
+    route_table(app, routes)
+    app._build_killswitch_spec()
+
+    # Link flap / roaming: no default route for a moment
+    routes.clear()
+    spec = app._build_killswitch_spec()
+    ruleset = vpn.build_killswitch_ruleset(spec)
+    assert ruleset.sets["phys_ifaces"] == {"wlan0"}
+    assert ruleset.sets["vpn_servers4"]
+    assert evaluate(spec, oif="wlan0", dst="1.1.1.1", dport=443) == "drop"
+    assert not vpn.KillswitchSimulator(ruleset).find_leaks(samples=2000)
+
+
+class RecordingBackend:
+    """Firewall backend that records apply/remove and what was enabled meanwhile"""
+
+    name = "recording"
+
+    def __init__(self, app):
+        self.app = app
+        self.calls = []
+
+    def apply(self, spec):
+        self.calls.append("apply")
+        return True
+
+    def remove(self):
+        # A re-target racing the removal runs here, while the rules go away
+        self.app._retarget_killswitch()
+        self.calls.append("remove")
+        return True
+
+
+def test_remove_killswitch_is_not_undone_by_a_retarget(make_app, monkeypatch):
+    monkeypatch.setattr(vpn.os, "geteuid", lambda: 0)
+    app = make_app()
+    route_table(app, {4: ("eth0", "192.168.1.1")})
+    app._firewall_lock = vpn.threading.RLock()
+    app.firewall_backend = RecordingBackend(app)
+    assert app._killswitch_up() is None and app.killswitch_enabled
+    assert app.remove_killswitch()
+    assert not app.killswitch_enabled
+    assert app.firewall_backend.calls == ["apply", "remove"]
+
+
+def test_gateway_gets_no_dns_once_the_resolvers_are_narrowed():
+    def verdict(spec, proto, dport):
+        simulator = vpn.KillswitchSimulator(vpn.build_killswitch_ruleset(spec))
+        return simulator.evaluate(vpn.SimPacket("output", 4, oif="eth0", proto=proto, dst="192.168.1.1",
+                                                sport=40000, dport=dport))
+
+    open_dns = vpn.KillswitchSpec("eth0", "192.168.1.1", ["10.0.0.1"], [1194])
+    narrowed = vpn.KillswitchSpec("eth0", "192.168.1.1", ["10.0.0.1"], [1194], dns_servers=["10.8.0.1"])
+    for proto in ("udp", "tcp"):
+        assert verdict(open_dns, proto, 53) == "accept"
+        assert verdict(narrowed, proto, 53) == "drop"
+        assert verdict(narrowed, proto, 80) == "accept"
+    assert verdict(narrowed, "icmp", None) == "accept"
+    for spec in (open_dns, narrowed):
+        assert vpn.KillswitchSimulator(vpn.build_killswitch_ruleset(spec)).find_leaks(samples=5000) == []
@@ -0,0 +1,327 @@
+"""Randomized property test: the compiled firewalls agree with the simulator.
+
+Random KillswitchSpecs are compiled with render_iptables_rules() and
+compile_nft_ruleset(); small independent interpreters of the rendered
+iptables rules and nft script then evaluate random packets, which must get
+the same verdict from KillswitchSimulator. find_leaks() must find nothing.
+"""
+
+import ipaddress
+import random
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+SPECS = 60
+PACKETS = 300
+IFACES = ("eth0", "wlan0", "enp3s0", "wwan0")
+OTHER_IFACES = ("lo", "tun0", "tap3", "docker0", "")
+ICMPV6_TYPES = {name: number for number, name in vpn.ICMPV6_ND_NAMES.items()}
+
+
+def random_address(rng, version):
+    bits = 32 if version == 4 else 128
+    return str(ipaddress.ip_address(rng.getrandbits(bits)) if version == 4
+               else ipaddress.IPv6Address(rng.getrandbits(bits)))
+
+
+def random_network(rng, version):
+    address = random_address(rng, version)
+    if rng.random() < 0.7:
+        return address
+    prefix = rng.randrange(8, 32) if version == 4 else rng.randrange(32, 128)
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+def random_spec(rng):
+    iface = rng.choice(IFACES + (None,))
+    iface6 = rng.choice(IFACES + (None, None))
+    servers = [random_network(rng, rng.choice((4, 6))) for _ in range(rng.randrange(0, 6))]
+    ports = rng.sample([1194, 443, 1195, 51820, 8080, 53], rng.randrange(1, 4))
+    dns = [random_address(rng, rng.choice((4, 6))) for _ in range(rng.choice((0, 0, 1, 2)))]
+    return vpn.KillswitchSpec(
+        iface,
+        random_address(rng, 4) if iface and rng.random() < 0.8 else None,
+        servers,
+        ports,
+        default_iface6=iface6,
+        default_gateway6=random_address(rng, 6) if iface6 and rng.random() < 0.5 else None,
+        dns_servers=dns,
+    )
+
+
+def interesting_addresses(ruleset, version):
+    """Addresses inside (or at the edge of) every network in the ruleset's sets"""
+    suffix = "4" if version == 4 else "6"
+    addresses = []
+    for name in ("vpn_servers", "gateways", "dns_servers"):
+        for value in ruleset.sets[name + suffix]:
+            net = ipaddress.ip_network(value)
+            addresses.append(str(net.network_address))
+            addresses.append(str(net.broadcast_address))
+    return addresses
+
+
+def random_packet(rng, ruleset):
+    fam = rng.choice((4, 6))
+    chain = rng.choice(("input", "output", "output", "forward"))
+    ifaces = list(ruleset.sets["phys_ifaces"]) + list(OTHER_IFACES)
+    iface = rng.choice(ifaces)
+    known = interesting_addresses(ruleset, fam)
+    peer = rng.choice(known) if known and rng.random() < 0.5 else random_address(rng, fam)
+    proto = rng.choice(("tcp", "udp", "udp", "icmpv6" if fam == 6 else "icmp"))
+    ports = sorted(ruleset.sets["vpn_ports"] | ruleset.sets["vpn_any_ports"]) + [53, 67, 68, 546, 547]
+    sport = dport = icmp = None
+    if proto in ("tcp", "udp"):
+        sport = rng.choice(ports) if rng.random() < 0.3 else rng.randrange(1, 65536)
+        dport = rng.choice(ports) if rng.random() < 0.6 else rng.randrange(1, 65536)
+    elif rng.random() < 0.7:
+        icmp = rng.choice(list(vpn.ICMPV6_ND_TYPES) + [1, 128, 129])
+    local = random_address(rng, fam)
+    if chain == "input":
+        return vpn.SimPacket("input", fam, iif=iface, proto=proto, src=peer, dst=local, sport=sport,
+                             dport=dport, ctstate=rng.choice(("new", "new", "established", "related")),
+                             icmpv6_type=icmp)
+    return vpn.SimPacket(chain, fam, oif=iface, iif=None if chain == "output" else "eth9", proto=proto,
+                         src=local, dst=peer, sport=sport, dport=dport,
+                         ctstate=rng.choice(("new", "new", "established", "related")), icmpv6_type=icmp)
+
+
+class IptablesInterpreter:
+    """First-match evaluation of render_iptables_rules() output (policy ACCEPT)"""
+
+    CHAINS = {"input": "AN0M0S_INPUT", "output": "AN0M0S_OUTPUT", "forward": "AN0M0S_FORWARD"}
+
+    def __init__(self, ruleset):
+        self.rules = {}
+        for family in (4, 6):
+            for line in vpn.render_iptables_rules(ruleset, family):
+                tokens = line.split()
+                options = {}
+                i = 2
+                while i < len(tokens):
+                    key = tokens[i]
+                    if key == "-m":
+                        i += 2
+                        continue
+                    options[key] = tokens[i + 1]
+                    i += 2
+                self.rules.setdefault((family, tokens[1]), []).append(options)
+
+    @staticmethod
+    def _iface(pattern, name):
+        return name.startswith(pattern[:-1]) if pattern.endswith("+") else name == pattern
+
+    @staticmethod
+    def _port(spec, value):
+        if value is None:
+            return False
+        if ":" in spec:
+            low, high = spec.split(":")
+            return int(low) <= value <= int(high)
+        return value == int(spec)
+
+    def _matches(self, options, packet):
+        for key, value in options.items():
+            if key == "-i" and not self._iface(value, packet.iif or ""):
+                return False
+            if key == "-o" and not self._iface(value, packet.oif or ""):
+                return False
+            if key == "-s" and ipaddress.ip_address(packet.src) not in ipaddress.ip_network(value):
+                return False
+            if key == "-d" and ipaddress.ip_address(packet.dst) not in ipaddress.ip_network(value):
+                return False
+            if key == "-p" and (packet.proto if packet.proto != "icmpv6" else "ipv6-icmp") != value:
+                return False
+            if key == "--sport" and not self._port(value, packet.sport):
+                return False
+            if key == "--dport" and not self._port(value, packet.dport):
+                return False
+            if key == "--icmpv6-type" and packet.icmpv6_type != int(value):
+                return False
+            if key == "--ctstate" and packet.ctstate.upper() not in value.split(","):
+                return False
+        return True
+
+    def evaluate(self, packet):
+        for options in self.rules.get((packet.family, self.CHAINS[packet.chain]), []):
+            if self._matches(options, packet):
+                return options["-j"].lower()
+        return "accept"
+
+
+class NftInterpreter:
+    """First-match evaluation of a compile_nft_ruleset() script (policy accept)"""
+
+    def __init__(self, ruleset):
+        self.sets = {}
+        self.chains = {}
+        chain = None
+        for line in vpn.compile_nft_ruleset(ruleset).splitlines():
+            line = line.strip()
+            if line.startswith("set "):
+                name = line.split()[1]
+                elements = line.partition("elements = {")[2].partition("}")[0]
+                self.sets[name] = [e.strip().strip('"') for e in elements.split(",") if e.strip()]
+            elif line.startswith("chain "):
+                chain = line.split()[1]
+                self.chains[chain] = []
+            elif chain and line.endswith(("accept", "drop")) and not line.startswith("type "):
+                self.chains[chain].append(self._tokenize(line))
+            elif line == "}":
+                chain = None
+
+    @staticmethod
+    def _tokenize(line):
+        tokens = []
+        group = None
+        for word in line.split():
+            if word == "{":
+                group = []
+            elif word == "}":
+                tokens.append(group)
+                group = None
+            elif group is not None:
+                group.append(word.rstrip(",").strip('"'))
+            else:
+                tokens.append(word.strip('"'))
+        return tokens
+
+    def _values(self, value):
+        if isinstance(value, list):
+            return value
+        if value.startswith("@"):
+            return self.sets[value[1:]]
+        return value.split(",")
+
+    def _in(self, value, items, kind):
+        for item in self._values(items):
+            if kind == "iface":
+                if item.endswith("*") and value.startswith(item[:-1]) or item == value:
+                    return True
+            elif kind == "addr":
+                if ipaddress.ip_address(value) in ipaddress.ip_network(item):
+                    return True
+            elif kind == "port":
+                if value is None:
+                    return False
+                low, _, high = item.partition("-")
+                if int(low) <= value <= int(high or low):
+                    return True
+            elif value == item:
+                return True
+        return False
+
+    def _matches(self, tokens, packet):
+        i = 0
+        while i < len(tokens) - 1:
+            key = tokens[i]
+            if key in ("iifname", "oifname"):
+                name = packet.iif if key == "iifname" else packet.oif
+                if not self._in(name or "", tokens[i + 1], "iface"):
+                    return False
+                i += 2
+            elif key in ("ip", "ip6"):
+                if packet.family != (4 if key == "ip" else 6):
+                    return False
+                address = packet.src if tokens[i + 1] == "saddr" else packet.dst
+                if not self._in(address, tokens[i + 2], "addr"):
+                    return False
+                i += 3
+            elif key == "meta" and tokens[i + 1] == "nfproto":
+                if packet.family != (4 if tokens[i + 2] == "ipv4" else 6):
+                    return False
+                i += 3
+            elif key == "meta" and tokens[i + 1] == "l4proto":
+                proto = "ipv6-icmp" if packet.proto == "icmpv6" else packet.proto
+                if not self._in(proto, tokens[i + 2], "name"):
+                    return False
+                i += 3
+            elif key == "ct":
+                if not self._in(packet.ctstate, tokens[i + 2], "name"):
+                    return False
+                i += 3
+            elif key == "icmpv6":
+                if packet.family != 6 or packet.proto != "icmpv6":
+                    return False
+                types = [ICMPV6_TYPES[name] for name in self._values(tokens[i + 2])]
+                if packet.icmpv6_type not in types:
+                    return False
+                i += 3
+            elif key in ("tcp", "udp", "th"):
+                if key != "th" and packet.proto != key:
+                    return False
+                if packet.proto not in ("tcp", "udp"):
+                    return False
+                port = packet.sport if tokens[i + 1] == "sport" else packet.dport
+                if not self._in(port, tokens[i + 2], "port"):
+                    return False
+                i += 3
+            else:
+                raise AssertionError(f"unknown nft expression {key!r} in {tokens}")
+        return True
+
+    def evaluate(self, packet):
+        for tokens in self.chains[packet.chain]:
+            if self._matches(tokens, packet):
+                return tokens[-1]
+        return "accept"
+
+
+@pytest.mark.parametrize("seed", range(SPECS))
+def test_backends_agree_with_the_simulator(seed):
+    rng = random.Random(seed)
+    ruleset = vpn.build_killswitch_ruleset(random_spec(rng))
+    simulator = vpn.KillswitchSimulator(ruleset)
+    iptables = IptablesInterpreter(ruleset)
+    nft = NftInterpreter(ruleset)
+    for _ in range(PACKETS):
+        packet = random_packet(rng, ruleset)
+        expected = simulator.evaluate(packet)
+        assert iptables.evaluate(packet) == expected, packet
+        assert nft.evaluate(packet) == expected, packet
+    assert simulator.find_leaks(samples=2000, seed=seed) == []
+
+
+def test_interpreters_see_drops():
+    # Guards against interpreters that accept everything
+    spec = vpn.KillswitchSpec("eth0", "192.168.1.1", ["10.0.0.1"], [1194])
+    ruleset = vpn.build_killswitch_ruleset(spec)
+    leak = vpn.SimPacket("output", 4, oif="eth0", proto="tcp", src="192.168.1.5", dst="8.8.8.8",
+                         sport=40000, dport=443)
+    allowed = leak._replace(dst="10.0.0.1", dport=1194, proto="udp")
+    for engine in (vpn.KillswitchSimulator(ruleset), IptablesInterpreter(ruleset), NftInterpreter(ruleset)):
+        assert engine.evaluate(leak) == "drop"
+        assert engine.evaluate(allowed) == "accept"
+
+
+@pytest.mark.parametrize("seed", range(SPECS))
+def test_batch_evaluation_agrees_with_single_packets(seed):
+    rng = random.Random(seed)
+    ruleset = vpn.build_killswitch_ruleset(random_spec(rng))
+    simulator = vpn.KillswitchSimulator(ruleset)
+    groups = {}
+    for _ in range(PACKETS):
+        packet = random_packet(rng, ruleset)
+        key = (packet.chain, packet.family, packet.proto, packet.iif, packet.oif, packet.ctstate)
+        groups.setdefault(key, []).append(packet)
+    for (chain, fam, proto, iif, oif, ctstate), packets in groups.items():
+        flows = [(int(ipaddress.ip_address(p.src)), int(ipaddress.ip_address(p.dst)),
+                  -1 if p.sport is None else p.sport, -1 if p.dport is None else p.dport, p.icmpv6_type)
+                 for p in packets]
+        verdicts = simulator.evaluate_batch(chain, fam, proto, flows, iif=iif, oif=oif, ctstate=ctstate)
+        assert verdicts == [simulator.evaluate(p) for p in packets]
+
+
+def test_find_leaks_sees_a_missing_drop():
+    # Guards against a leak check that never reports anything
+    spec = vpn.KillswitchSpec("eth0", "192.168.1.1", ["10.0.0.1"], [1194], default_iface6="eth0")
+    ruleset = vpn.build_killswitch_ruleset(spec)
+    without_drops = vpn.KillswitchRuleset(ruleset.sets, tuple(r for r in ruleset.rules if r.action != "drop"))
+    leaks = vpn.KillswitchSimulator(without_drops).find_leaks(samples=2000)
+    assert len(leaks) > 1000
+    assert {leak.family for leak in leaks} == {4, 6}
+    assert {leak.proto for leak in leaks} == {"tcp", "udp", "icmp", "icmpv6"}
+    simulator = vpn.KillswitchSimulator(ruleset)
+    assert all(simulator.evaluate(leak) == "drop" for leak in leaks)
@@ -0,0 +1,180 @@
+import errno
+import socket
+import struct
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+IFINDEX = {1: "lo", 2: "eth0", 5: "tun0"}
+
+# /proc/net/route: default via 192.168.1.1 on eth0 (hex, little endian)
+ROUTE_ETH0 = (
+    "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT\n"
+    "eth0\t00000000\t0101A8C0\t0003\t0\t0\t100\t00000000\t0\t0\t0\n"
+    "eth0\t0001A8C0\t00000000\t0001\t0\t0\t100\t00FFFFFF\t0\t0\t0\n"
+)
+# /proc/net/ipv6_route: the kernel's unreachable default on lo only
+IPV6_ROUTE_NONE = (
+    "00000000000000000000000000000000 00 00000000000000000000000000000000 00 "
+    "00000000000000000000000000000000 ffffffff 00000001 00000000 00200200       lo\n"
+)
+# ... and a real default via fe80::1 on eth0
+IPV6_ROUTE_ETH0 = (
+    "00000000000000000000000000000000 00 00000000000000000000000000000000 00 "
+    "fe800000000000000000000000000001 00000400 00000001 00000000 00000003     eth0\n"
+)
+# /proc/net/if_inet6: link-local on eth0, global 2001:db8::5/64 on eth0
+IF_INET6_LINK = "fe80000000000000021122fffe334455 02 40 20 80     eth0\n"
+IF_INET6_GLOBAL = IF_INET6_LINK + "20010db8000000000000000000000005 02 40 00 00     eth0\n"
+
+
+def rtm_newroute(address, oif=None, gateway=None, rtype=1):
+    """A canned RTM_NEWROUTE reply, as the kernel answers RTM_GETROUTE"""
+    address = vpn.ipaddress.ip_address(address)
+    family = socket.AF_INET if address.version == 4 else socket.AF_INET6
+    attrs = b""
+
+    def attr(kind, value):
+        data = struct.pack("=HH", 4 + len(value), kind) + value
+        return data + b"\0" * (-len(data) % 4)
+
+    attrs += attr(vpn.RTA_DST, address.packed)
+    if oif is not None:
+        attrs += attr(vpn.RTA_OIF, struct.pack("=I", oif))
+    if gateway is not None:
+        attrs += attr(vpn.RTA_GATEWAY, vpn.ipaddress.ip_address(gateway).packed)
+    body = struct.pack("=BBBBBBBBI", family, len(address.packed) * 8, 0, 0, 254, 4, 0, rtype, 0) + attrs
+    return struct.pack("=IHHII", 16 + len(body), vpn.RTM_NEWROUTE, 0, 1, 0) + body
+
+
+def nlmsg_error(code):
+    body = struct.pack("=i", -code) + b"\0" * 16
+    return struct.pack("=IHHII", 16 + len(body), vpn.NLMSG_ERROR, 0, 1, 0) + body
+
+
+class FakeHost:
+    """A /proc tree, resolv.conf files and netlink replies for run_leak_checks()"""
+
+    def __init__(self, root):
+        self.root = root
+        (root / "proc" / "net").mkdir(parents=True)
+        self.replies = {}
+        self.routes(ROUTE_ETH0, IPV6_ROUTE_NONE, IF_INET6_LINK)
+        self.resolvers(["10.8.0.1"])
+
+    def routes(self, route, ipv6_route, if_inet6):
+        net = self.root / "proc" / "net"
+        (net / "route").write_text(route)
+        (net / "ipv6_route").write_text(ipv6_route)
+        (net / "if_inet6").write_text(if_inet6)
+
+    def resolvers(self, configured, upstream=()):
+        (self.root / "resolv.conf").write_text("".join(f"nameserver {s}\n" for s in configured))
+        (self.root / "resolved.conf").write_text("".join(f"nameserver {s}\n" for s in upstream))
+
+    def route_lookup(self, address):
+        # Like route_get(): parse the kernel's reply, then name the device
+        route = vpn.parse_route_reply(self.replies[address])
+        route["dev"] = IFINDEX.get(route["oif"])
+        return route
+
+    def run(self, tunnels=("tun0",), **kwargs):
+        return vpn.run_leak_checks(
+            tunnels, route_lookup=self.route_lookup, proc=str(self.root / "proc"),
+            resolv_conf=str(self.root / "resolv.conf"), resolved_conf=str(self.root / "resolved.conf"),
+            **kwargs,
+        )
+
+
+def rows(report):
+    return {check: (status, detail) for check, status, detail in report.results}
+
+
+@pytest.fixture
+def host(tmp_path):
+    host = FakeHost(tmp_path)
+    # Everything goes through the tunnel (redirect-gateway def1)
+    host.replies = {
+        "10.8.0.1": rtm_newroute("10.8.0.1", oif=5),
+        "1.1.1.1": rtm_newroute("1.1.1.1", oif=5, gateway="10.8.0.1"),
+        "9.9.9.9": rtm_newroute("9.9.9.9", oif=5, gateway="10.8.0.1"),
+        "2606:4700:4700::1111": nlmsg_error(errno.ENETUNREACH),
+    }
+    return host
+
+
+def test_everything_through_the_tunnel_passes(host):
+    report = host.run()
+    assert report.passed, report.format()
+    assert rows(report)["DNS 10.8.0.1"] == (vpn.LEAK_PASS, "via tun0")
+    assert rows(report)["route 1.1.1.1"] == (vpn.LEAK_PASS, "via tun0")
+    assert rows(report)["route 2606:4700:4700::1111"][0] == vpn.LEAK_PASS
+    assert rows(report)["IPv6"] == (vpn.LEAK_PASS, "no global IPv6 outside the tunnel")
+
+
+def test_dns_leak_through_the_lan_resolver(host):
+    host.resolvers(["192.168.1.1"])
+    host.replies["192.168.1.1"] = rtm_newroute("192.168.1.1", oif=2)
+    report = host.run()
+    assert not report.passed
+    status, detail = rows(report)["DNS 192.168.1.1"]
+    assert status == vpn.LEAK_FAIL and detail.startswith("via eth0")
+    # The killswitch drops it: a warning, not a failure
+    report = host.run(killswitch=True)
+    assert report.passed
+    assert rows(report)["DNS 192.168.1.1"][0] == vpn.LEAK_WARN
+
+
+def test_resolved_stub_is_followed_upstream(host):
+    host.resolvers(["127.0.0.53"], upstream=["192.168.1.1"])
+    host.replies["192.168.1.1"] = rtm_newroute("192.168.1.1", oif=2)
+    report = host.run()
+    assert rows(report)["DNS"] == (vpn.LEAK_PASS, "127.0.0.53 forwards to 192.168.1.1")
+    assert rows(report)["DNS 192.168.1.1"][0] == vpn.LEAK_FAIL
+    assert "DNS 127.0.0.53" not in rows(report)
+
+
+def test_ipv6_leak_outside_the_tunnel(host):
+    host.routes(ROUTE_ETH0, IPV6_ROUTE_ETH0, IF_INET6_GLOBAL)
+    host.replies["2606:4700:4700::1111"] = rtm_newroute("2606:4700:4700::1111", oif=2, gateway="fe80::1")
+    report = host.run()
+    assert not report.passed
+    status, detail = rows(report)["IPv6"]
+    assert status == vpn.LEAK_FAIL
+    assert detail.startswith("2001:db8::5/64 on eth0, default route via eth0")
+    assert rows(report)["route 2606:4700:4700::1111"] == (
+        vpn.LEAK_FAIL, "via eth0 gateway fe80::1, outside the tunnel")
+
+
+def test_ipv6_blocked_by_an_unreachable_route(host):
+    host.routes(ROUTE_ETH0, IPV6_ROUTE_ETH0, IF_INET6_GLOBAL)
+    host.replies["2606:4700:4700::1111"] = rtm_newroute("2606:4700:4700::1111", rtype=7)
+    report = host.run()
+    assert report.passed, report.format()
+    assert rows(report)["IPv6"][0] == vpn.LEAK_PASS
+    assert rows(report)["route 2606:4700:4700::1111"] == (vpn.LEAK_PASS, "unreachable route (nothing to leak)")
+
+
+def test_route_leak_after_the_tunnel_lost_the_default_route(host):
+    host.replies["1.1.1.1"] = rtm_newroute("1.1.1.1", oif=2, gateway="192.168.1.1")
+    report = host.run()
+    assert not report.passed
+    assert rows(report)["route 1.1.1.1"] == (vpn.LEAK_FAIL, "via eth0 gateway 192.168.1.1, outside the tunnel")
+    assert rows(report)["route 9.9.9.9"][0] == vpn.LEAK_PASS
+
+
+def test_no_tunnel_is_a_failure(host):
+    report = host.run(tunnels=())
+    assert rows(report)["tunnel"] == (vpn.LEAK_FAIL, "no tunnel interface is up")
+    assert rows(report)["route 1.1.1.1"][0] == vpn.LEAK_FAIL
+
+
+def test_canned_replies_parse_like_the_kernel_reply():
+    route = vpn.parse_route_reply(rtm_newroute("1.1.1.1", oif=2, gateway="192.168.1.1"))
+    assert route == {"oif": 2, "gateway": "192.168.1.1", "prefsrc": None, "type": 1}
+    with pytest.raises(OSError) as excinfo:
+        vpn.parse_route_reply(nlmsg_error(errno.ENETUNREACH))
+    assert excinfo.value.errno == errno.ENETUNREACH
+    request = vpn.build_route_get_request("2606:4700:4700::1111")
+    assert struct.unpack_from("=IH", request) == (len(request), vpn.RTM_GETROUTE)
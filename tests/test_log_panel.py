@@ -0,0 +1,114 @@
+import pytest
+
+
+class FakeText:
+    """The parts of tk.Text the log panel uses, one entry per line"""
+
+    def __init__(self):
+        self.lines = []
+        self.inserts = 0
+
+    def configure(self, **options):
+        pass
+
+    def yview(self):
+        return (0.0, 1.0)
+
+    def see(self, index):
+        pass
+
+    def index(self, index):
+        assert index == "end-1c"
+        return f"{len(self.lines) + 1}.0"
+
+    def delete(self, first, last):
+        if last == "end":
+            self.lines = []
+        else:
+            del self.lines[:int(last.split(".")[0]) - 1]
+
+    def insert(self, index, *chunks):
+        assert index == "end"
+        self.inserts += 1
+        for text, tag in zip(chunks[0::2], chunks[1::2]):
+            self.lines.extend((line, tag) for line in text.split("\n")[:-1])
+
+
+class StubVar:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class StubRoot:
+    def after(self, ms, func, *args):
+        pass
+
+
+@pytest.fixture
+def panel(make_app):
+    app = make_app()
+    app.root = StubRoot()
+    app.log_text = FakeText()
+    app.log_level_var = StubVar("All")
+    app.log_search_var = StubVar("")
+    app.log_panel_lines = 500
+    app.log_flush_ms = 100
+    app._log_panel_buffer = None
+    app._log_panel_seen = 0
+    buffer = app.tunnel.log_buffer
+    buffer.separator("--- attempt 1 ---")
+    buffer.append("stdout", "error", "TLS Error: TLS handshake failed")
+    buffer.append("stdout", "warning", "Restart pause, 5 second(s)")
+    buffer.separator("--- attempt 2 ---")
+    buffer.append("stdout", "info", "Peer Connection Initiated")
+    return app, buffer
+
+
+def test_panel_shows_every_attempt(panel):
+    app, buffer = panel
+    app._render_log_panel()
+    assert app.log_text.lines == [
+        ("--- attempt 1 ---", "separator"),
+        ("TLS Error: TLS handshake failed", "error"),
+        ("Restart pause, 5 second(s)", "warning"),
+        ("--- attempt 2 ---", "separator"),
+        ("Peer Connection Initiated", "info"),
+    ]
+    # A later flush appends only what is new, in one insert
+    buffer.append("stdout", "info", "Initialization Sequence Completed")
+    inserts = app.log_text.inserts
+    app._flush_log_panel()
+    assert app.log_text.inserts == inserts + 1
+    assert app.log_text.lines[-1] == ("Initialization Sequence Completed", "info")
+
+
+@pytest.mark.parametrize("level, search, expected", [
+    ("Errors", "", ["TLS Error: TLS handshake failed"]),
+    ("Warnings", "", ["TLS Error: TLS handshake failed", "Restart pause, 5 second(s)"]),
+    ("All", "peer", ["Peer Connection Initiated"]),
+    ("Errors", "peer", []),
+])
+def test_filter_and_search_cover_earlier_attempts(panel, level, search, expected):
+    app, _ = panel
+    app.log_level_var.value = level
+    app.log_search_var.value = search
+    app._apply_log_filter()
+    assert [text for text, tag in app.log_text.lines if tag != "separator"] == expected
+    separators = [text for text, tag in app.log_text.lines if tag == "separator"]
+    assert separators == ["--- attempt 1 ---", "--- attempt 2 ---"]
+
+
+def test_panel_keeps_only_the_last_lines(panel):
+    app, buffer = panel
+    app.log_panel_lines = 10
+    for n in range(30):
+        buffer.append("stdout", "info", f"line {n}")
+    app._render_log_panel()
+    assert [text for text, _ in app.log_text.lines] == [f"line {n}" for n in range(20, 30)]
+    for n in range(30, 35):
+        buffer.append("stdout", "info", f"line {n}")
+    app._flush_log_panel()
+    assert [text for text, _ in app.log_text.lines] == [f"line {n}" for n in range(25, 35)]
@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+
+def read(stdout_data, stderr_data=b"", chunk=None, **kwargs):
+    """Feed the data through real pipes and run a reader to EOF"""
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    events = []
+    reader = vpn.OpenVpnLogReader(os.fdopen(out_r, "rb", buffering=0), os.fdopen(err_r, "rb", buffering=0),
+                                  on_event=lambda *event: events.append(event), **kwargs)
+    reader.start()
+    for fd, data in ((out_w, stdout_data), (err_w, stderr_data)):
+        step = chunk or max(len(data), 1)
+        for offset in range(0, len(data), step):
+            os.write(fd, data[offset:offset + step])
+        os.close(fd)
+    reader.join(10)
+    assert not reader._thread.is_alive()
+    return reader, events
+
+
+def test_ring_capacity_and_sequence_numbers():
+    data = b"".join(b"line %d\n" % n for n in range(25))
+    reader, _ = read(data, capacity=10)
+    assert reader.line_count == 25
+    assert [text for _, _, _, text in reader.tail()] == [f"line {n}" for n in range(15, 25)]
+    assert [text for _, _, _, text in reader.tail(2)] == ["line 23", "line 24"]
+
+    # Caught up: nothing new
+    assert reader.lines_since(25) == (25, [])
+    count, lines = reader.lines_since(22)
+    assert count == 25 and [line[3] for line in lines] == ["line 22", "line 23", "line 24"]
+    # Fell behind the ring: only what is still there
+    count, lines = reader.lines_since(3)
+    assert count == 25 and [line[3] for line in lines] == [f"line {n}" for n in range(15, 25)]
+
+
+def test_lines_split_across_reads():
+    data = b"2024-01-01 10:00:00 first line\r\nsecond line\nunterminated"
+    reader, _ = read(data, chunk=3)
+    assert [text for _, _, _, text in reader.tail()] == [
+        "2024-01-01 10:00:00 first line", "second line", "unterminated"]
+
+
+@pytest.mark.parametrize("line, stream, level", [
+    ("2024-01-01 10:00:00 Initialization Sequence Completed", "stdout", "info"),
+    ("2024-01-01 10:00:00 AUTH_FAILED", "stdout", "error"),
+    ("2024-01-01 10:00:00 TLS Error: TLS handshake failed", "stdout", "error"),
+    ("2024-01-01 10:00:00 RESOLVE: Cannot resolve host address: vpn.example.com", "stdout", "error"),
+    ("2024-01-01 10:00:00 WARNING: 'link-mtu' is used inconsistently", "stdout", "warning"),
+    ("2024-01-01 10:00:00 Restart pause, 5 second(s)", "stdout", "warning"),
+    ("Options error: Unrecognized option", "stderr", "error"),
+    ("some diagnostic", "stderr", "warning"),
+])
+def test_level_classification(line, stream, level):
+    data = (line + "\n").encode()
+    reader, _ = read(data if stream == "stdout" else b"", data if stream == "stderr" else b"")
+    (_, got_stream, got_level, text), = reader.tail()
+    assert (got_stream, got_level, text) == (stream, level, line)
+
+
+def test_events():
+    data = (
+        "2024-01-01 10:00:00 TUN/TAP device tun3 opened\n"
+        "2024-01-01 10:00:01 PUSH: Received control message: "
+        "'PUSH_REPLY,route-gateway 10.8.0.1,dhcp-option DNS 10.8.0.1'\n"
+        "2024-01-01 10:00:01 Initialization Sequence Completed\n"
+        "2024-01-01 10:00:09 AUTH_FAILED\n"
+        "2024-01-01 10:00:09 plain line\n"
+    ).encode()
+    reader, events = read(data)
+    assert [(kind, detail) for _, kind, detail, _ in events] == [
+        ("device", "tun3"),
+        ("push_reply", "PUSH_REPLY,route-gateway 10.8.0.1,dhcp-option DNS 10.8.0.1"),
+        ("connected", ""),
+        ("auth_failed", ""),
+    ]
+    assert list(reader.events) == events
+    assert reader.last_event()[1] == "auth_failed"
+    assert reader.last_event(vpn.OPENVPN_ERROR_EVENTS)[1] == "auth_failed"
+    assert reader.last_event({"connected"})[3] == "2024-01-01 10:00:01 Initialization Sequence Completed"
+    assert reader.last_event({"fatal"}) is None
+
+
+def test_rotation_at_max_bytes(tmp_path):
+    path = tmp_path / "openvpn.log"
+    line = "x" * 99
+    reader, _ = read(("".join(f"{line}\n" for _ in range(25))).encode(),
+                     rotate_path=str(path), max_bytes=1000, backups=2)
+    assert reader.line_count == 25
+    # 10 lines of 100 bytes per file: two rotated files, 5 lines in the live one
+    assert path.read_text() == f"{line}\n" * 5
+    assert (tmp_path / "openvpn.log.1").read_text() == f"{line}\n" * 10
+    assert (tmp_path / "openvpn.log.2").read_text() == f"{line}\n" * 10
+    assert not (tmp_path / "openvpn.log.3").exists()
+
+
+def test_rotation_without_backups(tmp_path):
+    path = tmp_path / "openvpn.log"
+    reader, _ = read(b"a" * 20 + b"\n" + b"b\n", rotate_path=str(path), max_bytes=10, backups=0)
+    assert path.read_text() == "b\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["openvpn.log"]
+
+
+def test_attempts_share_one_buffer():
+    buffer = vpn.OpenVpnLogBuffer(capacity=100)
+    buffer.separator("--- attempt 1: a.example.com 1194/udp on tun0 ---")
+    first, _ = read(b"TLS Error: TLS handshake failed\nSIGUSR1[soft,ping-restart] received\n", buffer=buffer)
+    buffer.separator("--- attempt 2: b.example.com 443/tcp on tun0 ---")
+    second, _ = read(b"Initialization Sequence Completed\n", buffer=buffer)
+    assert first.line_count == second.line_count == buffer.line_count == 5
+    assert [(stream, level) for _, stream, level, _ in buffer.tail()] == [
+        ("separator", "info"), ("stdout", "error"), ("stdout", "warning"), ("separator", "info"), ("stdout", "info")]
+    # A panel that saw the first attempt picks up from there
+    count, lines = buffer.lines_since(3)
+    assert count == 5 and [text for _, _, _, text in lines] == [
+        "--- attempt 2: b.example.com 443/tcp on tun0 ---", "Initialization Sequence Completed"]
+    # Events stay per attempt
+    assert [kind for _, kind, _, _ in first.events] == ["tls_error", "reconnecting"]
+    assert [kind for _, kind, _, _ in second.events] == ["connected"]
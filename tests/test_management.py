@@ -0,0 +1,166 @@
+import socket
+import threading
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+
+class FakeOpenVpn:
+    """The openvpn end of a management socket: sends notifications, reads commands"""
+
+    def __init__(self, path):
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(1)
+        self.listener.settimeout(10)
+        self.conn = None
+        self.buffer = b""
+
+    def accept(self):
+        self.conn, _ = self.listener.accept()
+        self.conn.settimeout(10)
+
+    def send(self, *lines):
+        self.conn.sendall("".join(line + "\r\n" for line in lines).encode())
+
+    def command(self):
+        """Next command line from the client"""
+        while b"\n" not in self.buffer:
+            data = self.conn.recv(4096)
+            assert data, "client closed the socket"
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line.decode()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.listener.close()
+
+
+class Events:
+    def __init__(self):
+        self.items = []
+        self.changed = threading.Condition()
+
+    def __call__(self, kind, fields):
+        with self.changed:
+            self.items.append((kind, fields))
+            self.changed.notify_all()
+
+    def wait_for(self, kind, count=1):
+        with self.changed:
+            assert self.changed.wait_for(lambda: self.kinds().count(kind) >= count, timeout=10), self.items
+
+    def kinds(self):
+        return [kind for kind, _ in self.items]
+
+
+@pytest.fixture
+def session(tmp_path):
+    # stop() removes the socket's directory, like the real one from make_management_socket_path()
+    directory = tmp_path / "mgmt"
+    directory.mkdir()
+    path = str(directory / "management.sock")
+    server = FakeOpenVpn(path)
+    events = Events()
+    clients = []
+
+    def connect(**kwargs):
+        client = vpn.ManagementClient(path, on_event=events, **kwargs)
+        clients.append(client)
+        client.start(connect_timeout=10)
+        server.accept()
+        assert [server.command() for _ in range(3)] == ["state on", "log on", "bytecount 1"]
+        return client
+
+    yield connect, server, events
+    for client in clients:
+        client.stop()
+    server.close()
+
+
+def test_hold_is_released(session):
+    connect, server, events = session
+    connect()
+    server.send(">INFO:OpenVPN Management Interface Version 5 -- type 'help' for more info",
+                ">HOLD:Waiting for hold release:0")
+    assert server.command() == "hold release"
+    events.wait_for("hold")
+    assert ("hold", ["Waiting for hold release:0"]) in events.items
+    assert ("info", ["OpenVPN Management Interface Version 5 -- type 'help' for more info"]) in events.items
+
+
+def test_state_bytecount_and_log(session):
+    connect, server, events = session
+    client = connect()
+    server.send(
+        "SUCCESS: real-time state notification set to ON",
+        ">STATE:1700000000,CONNECTING,,,,,,",
+        ">STATE:1700000003,CONNECTED,SUCCESS,10.8.0.6,198.51.100.7,1194,,",
+        ">BYTECOUNT:1234,5678",
+        ">LOG:1700000003,I,Initialization Sequence Completed, with a comma",
+    )
+    assert client.wait_for_state({"CONNECTED"}, timeout=10) == "CONNECTED"
+    events.wait_for("log")
+    assert client.state_time == 1700000003
+    assert (client.state_detail, client.local_ip, client.remote_ip, client.remote_port) == (
+        "SUCCESS", "10.8.0.6", "198.51.100.7", 1194)
+    assert client.time_to_connected is not None and client.time_to_connected >= 0
+    assert (client.bytes_in, client.bytes_out) == (1234, 5678)
+    assert list(client.log) == ["Initialization Sequence Completed, with a comma"]
+    assert events.kinds() == ["state", "state", "bytecount", "log"]
+    assert events.items[2] == ("bytecount", [1234, 5678])
+    assert events.items[3] == ("log", ["1700000003", "I", "Initialization Sequence Completed, with a comma"])
+
+    # A reconnect clears the connected time; a later state keeps the addresses
+    server.send(">STATE:1700000009,RECONNECTING,ping-restart,,,,,")
+    assert client.wait_for_state({"RECONNECTING"}, timeout=10) == "RECONNECTING"
+    assert client.connected_at is None
+    assert client.local_ip == "10.8.0.6"
+
+
+def test_remote_prompt_skips_to_the_preferred_remote(session):
+    connect, server, events = session
+    connect(preferred_remote=vpn.OvpnRemote("b.example.com", 443, "tcp"))
+    server.send(">REMOTE:a.example.com,1194,udp")
+    assert server.command() == "remote SKIP"
+    server.send(">REMOTE:b.example.com,1194,udp")
+    assert server.command() == "remote SKIP"
+    server.send(">REMOTE:b.example.com,443,tcp")
+    assert server.command() == "remote ACCEPT"
+    # From then on openvpn's own rotation applies
+    server.send(">REMOTE:c.example.com,1194,udp")
+    assert server.command() == "remote ACCEPT"
+    events.wait_for("remote", 4)
+    assert [fields for kind, fields in events.items if kind == "remote"] == [
+        ["a.example.com", "1194"], ["b.example.com", "1194"], ["b.example.com", "443"], ["c.example.com", "1194"]]
+
+
+def test_remote_skips_are_limited(session):
+    connect, server, _ = session
+    connect(preferred_remote=vpn.OvpnRemote("gone.example.com"), remote_skip_limit=2)
+    replies = []
+    for _ in range(3):
+        server.send(">REMOTE:a.example.com,1194,udp")
+        replies.append(server.command())
+    assert replies == ["remote SKIP", "remote SKIP", "remote ACCEPT"]
+
+
+def test_closed_socket_is_reported(session):
+    connect, server, events = session
+    client = connect()
+    server.conn.close()
+    events.wait_for("closed")
+    assert client.wait_for_state({"CONNECTED"}, timeout=1) is None
+    assert not client.send("state")
+
+
+def test_missing_socket_is_an_error(tmp_path):
+    events = Events()
+    client = vpn.ManagementClient(str(tmp_path / "none" / "management.sock"), on_event=events)
+    client.start(connect_timeout=0.05)
+    events.wait_for("error")
+    assert events.items == [("error", ["management socket not available"])]
+    client.stop()
@@ -0,0 +1,79 @@
+import os
+import time
+
+import An0m0s_vpn as vpn
+
+
+def no_netlink(self):
+    raise OSError("netlink unavailable")
+
+
+def test_missing_ip_binary_disables_the_watcher(monkeypatch, tmp_path):
+    monkeypatch.setattr(vpn.NetworkChangeWatcher, "_open_netlink", no_netlink)
+    monkeypatch.setenv("PATH", str(tmp_path))
+    watcher = vpn.NetworkChangeWatcher(lambda: None)
+    watcher.start()
+    assert watcher._thread is None
+    assert watcher.source is None and "ip monitor" in watcher.error
+    watcher.stop()
+
+
+def test_ip_monitor_exit_ends_the_thread(monkeypatch, tmp_path):
+    ip = tmp_path / "ip"
+    ip.write_text("#!/bin/sh\necho '2: eth0: <BROADCAST,MULTICAST> mtu 1500'\n")
+    ip.chmod(0o755)
+    monkeypatch.setattr(vpn.NetworkChangeWatcher, "_open_netlink", no_netlink)
+    monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+    calls = []
+    watcher = vpn.NetworkChangeWatcher(lambda: calls.append(time.monotonic()), debounce=0.05)
+    start = time.process_time()
+    watcher.start()
+    watcher._thread.join(5)
+    assert not watcher._thread.is_alive()
+    # Exited on EOF instead of spinning on it
+    assert time.process_time() - start < 1.0
+    assert calls and watcher.error.startswith("`ip monitor` exited")
+    assert watcher.stats()["error"] == watcher.error
+    watcher.stop()
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+
+def test_only_route_or_tunnel_changes_are_acted_on(make_app):
+    app = make_app()
+    routes = {4: ("eth0", "192.168.1.1"), 6: (None, None)}
+    app._read_default_route = routes.get
+    app.ip_lookup = Recorder()
+    app.ip_refresh = Recorder()
+    retargets = []
+    app._retarget_killswitch = lambda: retargets.append(dict(routes))
+    app._last_network_state = app._network_state()
+
+    # A container's veth or an address renewal: the default route is the same
+    app._on_network_change()
+    assert app.ip_refresh.calls == [] and retargets == []
+
+    routes[4] = ("wlan0", "10.1.0.1")
+    app._on_network_change()
+    app._on_network_change()
+    assert app.ip_lookup.calls == [("invalidate", (), {})]
+    assert app.ip_refresh.calls == [("request", ("route change",), {"force": True})]
+    assert len(retargets) == 1
+
+    routes[6] = ("wlan0", "fe80::1")
+    app._on_network_change()
+    assert len(retargets) == 2
+
+    # The tunnel came up (its device may now carry the default route)
+    app.tunnel.dev = "tun0"
+    app.tunnel.supervisor.state = vpn.TunnelSupervisor.CONNECTED
+    app._on_network_change()
+    assert len(retargets) == 3 and len(app.ip_refresh.calls) == 3
+    app._on_network_change()
+    assert len(retargets) == 3
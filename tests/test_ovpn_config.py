@@ -0,0 +1,141 @@
+import os
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+CA = """-----BEGIN CERTIFICATE-----
+MIIBszCCAVmgAwIBAgIUremote 10.9.9.9 443
+port 9999
+-----END CERTIFICATE-----"""
+
+TLS_AUTH = """-----BEGIN OpenVPN Static key V1-----
+dev tap7
+proto tcp
+-----END OpenVPN Static key V1-----"""
+
+
+def remotes(config):
+    return [(r.host, r.port, r.proto) for r in config.remotes]
+
+
+PROFILES = [
+    pytest.param(
+        "client\nremote vpn.example.com\n",
+        [("vpn.example.com", 1194, "udp")],
+        id="defaults",
+    ),
+    pytest.param(
+        "remote a.example.com\nremote b.example.com 443 tcp-client\nport 1195\nproto udp6\n",
+        [("a.example.com", 1195, "udp"), ("b.example.com", 443, "tcp")],
+        id="global port/proto apply wherever they appear",
+    ),
+    pytest.param(
+        "port 443\nproto tcp\n"
+        "<connection>\nremote a.example.com\n</connection>\n"
+        "<connection>\nremote b.example.com 1194\nproto udp\n</connection>\n",
+        [("a.example.com", 443, "tcp"), ("b.example.com", 1194, "udp")],
+        id="connection blocks inherit the global port/proto",
+    ),
+    pytest.param(
+        "remote a.example.com\nremote b.example.com 80 tcp\nremote-random\n",
+        [("a.example.com", 1194, "udp"), ("b.example.com", 80, "tcp")],
+        id="remote-random",
+    ),
+    pytest.param(
+        f"remote a.example.com\n<ca>\n{CA}\n</ca>\n<tls-auth>\n{TLS_AUTH}\n</tls-auth>\n",
+        [("a.example.com", 1194, "udp")],
+        id="inline bodies are not directives",
+    ),
+    pytest.param(
+        "--remote a.example.com 1195\n# remote commented.example.com\n; remote also.commented\n",
+        [("a.example.com", 1195, "udp")],
+        id="dashes and comments",
+    ),
+    pytest.param(
+        "remote a.example.com 99999\nport nope\n",
+        [("a.example.com", 1194, "udp")],
+        id="invalid ports fall back",
+    ),
+]
+
+
+@pytest.mark.parametrize("text, expected", PROFILES)
+def test_remotes(text, expected):
+    assert remotes(vpn.parse_ovpn_config(text)) == expected
+
+
+def test_remote_random_and_inline_sections():
+    config = vpn.parse_ovpn_config(
+        f"remote a.example.com\nremote-random\n<ca>\n{CA}\n</ca>\n<tls-auth>\n{TLS_AUTH}\n</tls-auth>\n")
+    assert config.remote_random
+    assert config.inline == {"ca": CA + "\n", "tls-auth": TLS_AUTH + "\n"}
+    # Nothing from the inline bodies leaked into the directives
+    assert config.port == 1194 and config.dev == "tun"
+    assert config.directives == []
+
+
+@pytest.mark.parametrize("text, device_type, device", [
+    ("dev tun\n", "tun", None),
+    ("dev tap\n", "tap", None),
+    ("dev tun1\n", "tun", "tun1"),
+    ("dev tap3\n", "tap", "tap3"),
+    ("dev vpn0\ndev-type tun\n", "tun", "vpn0"),
+    ("dev office\ndev-type TAP\n", "tap", "office"),
+])
+def test_device(text, device_type, device):
+    config = vpn.parse_ovpn_config("remote a.example.com\n" + text)
+    assert (config.device_type, config.device) == (device_type, device)
+
+
+def test_unterminated_block_is_rejected():
+    with pytest.raises(ValueError, match="unterminated <ca>"):
+        vpn.parse_ovpn_config("remote a.example.com\n<ca>\nabc\n")
+    with pytest.raises(ValueError, match="unterminated <connection>"):
+        vpn.parse_ovpn_config("<connection>\nremote a.example.com\n")
+
+
+def test_unknown_directives_are_kept():
+    config = vpn.parse_ovpn_config('remote a.example.com\nverb 4\nauth-user-pass "my file.txt"\nverb 5\n')
+    assert config.get("verb") == ["5"]
+    assert config.get("auth-user-pass") == ["my file.txt"]
+    assert config.get("cipher", ["AES-256-GCM"]) == ["AES-256-GCM"]
+
+
+def test_cache_reuses_the_parse_until_the_content_changes(tmp_path):
+    path = tmp_path / "a.ovpn"
+    path.write_text("remote a.example.com\n")
+    cache = vpn.OvpnConfigCache()
+
+    first = cache.load(str(path))
+    assert cache.load(str(path)) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Touched (new mtime), same bytes: still the same object
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.load(str(path)) is first
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # Edited: parsed again
+    path.write_text("remote b.example.com 443\n")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+    second = cache.load(str(path))
+    assert second is not first
+    assert remotes(second) == [("b.example.com", 443, "udp")]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_cache_is_per_real_path(tmp_path):
+    path = tmp_path / "a.ovpn"
+    path.write_text("remote a.example.com\n")
+    link = tmp_path / "link.ovpn"
+    link.symlink_to(path)
+    cache = vpn.OvpnConfigCache()
+    assert cache.load(str(link)) is cache.load(str(path))
+    cache.clear()
+    assert cache.misses == 1
+    cache.load(str(path))
+    assert cache.misses == 2
+    with pytest.raises(OSError):
+        cache.load(str(tmp_path / "missing.ovpn"))
@@ -0,0 +1,111 @@
+import ipaddress
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+ROUTE_HEADER = "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT"
+
+
+def route4(iface, gateway, metric, flags=0x0003, destination="00000000", mask="00000000"):
+    """/proc/net/route line; addresses are hex in host (little endian) order"""
+    gateway = ipaddress.IPv4Address(gateway).packed[::-1].hex().upper() if gateway else "00000000"
+    return f"{iface}\t{destination}\t{gateway}\t{flags:04X}\t0\t0\t{metric}\t{mask}\t0\t0\t0"
+
+
+def route6(iface, nexthop, metric, flags=0x0003, destination="::", prefix=0):
+    """/proc/net/ipv6_route line"""
+    def hexed(address):
+        return ipaddress.IPv6Address(address).packed.hex()
+    return (f"{hexed(destination)} {prefix:02x} {hexed('::')} 00 {hexed(nexthop or '::')} "
+            f"{metric:08x} 00000001 00000000 {flags:08x} {iface:>8}")
+
+
+@pytest.fixture
+def proc(tmp_path):
+    (tmp_path / "net").mkdir()
+    return tmp_path
+
+
+def write_routes(proc, v4=(), v6=()):
+    (proc / "net" / "route").write_text("\n".join([ROUTE_HEADER, *v4]) + "\n")
+    (proc / "net" / "ipv6_route").write_text("".join(line + "\n" for line in v6))
+
+
+def add_process(proc, pid, name, state="S"):
+    (proc / str(pid)).mkdir()
+    (proc / str(pid) / "stat").write_text(f"{pid} ({name}) {state} 1 {pid} {pid} 0 -1 4194560\n")
+
+
+def test_default_route_v4_lowest_metric(proc):
+    write_routes(proc, v4=[
+        route4("eth0", "0.0.0.0", 0, destination="0001A8C0", mask="00FFFFFF"),
+        route4("wlan0", "10.0.0.1", 600),
+        route4("eth0", "192.168.1.1", 100),
+    ])
+    assert vpn.read_default_route(4, str(proc / "net")) == ("eth0", "192.168.1.1")
+
+
+def test_default_route_v4_skips_down_and_reject(proc):
+    write_routes(proc, v4=[
+        route4("eth0", "192.168.1.1", 0, flags=0x0002),
+        route4("eth1", "192.168.2.1", 0, flags=0x0203),
+        route4("tun0", None, 50, flags=0x0001),
+    ])
+    # An on-link default (no gateway) is still a default route
+    assert vpn.read_default_route(4, str(proc / "net")) == ("tun0", None)
+
+
+def test_default_route_v6(proc):
+    write_routes(proc, v6=[
+        route6("lo", None, 0xffffffff, flags=0x00200200),
+        route6("lo", None, 0, flags=0x0001),
+        route6("eth0", "fe80::1", 1024),
+        route6("wlan0", "fe80::2", 600),
+        route6("eth0", None, 256, destination="2001:db8::", prefix=64),
+    ])
+    assert vpn.read_default_route(6, str(proc / "net")) == ("wlan0", "fe80::2")
+
+
+@pytest.mark.parametrize("family", [4, 6])
+def test_no_default_route(proc, family):
+    assert vpn.read_default_route(family, str(proc / "net")) == (None, None)
+    write_routes(proc, v4=[route4("eth0", "0.0.0.0", 0, destination="0001A8C0", mask="00FFFFFF")])
+    assert vpn.read_default_route(family, str(proc / "net")) == (None, None)
+
+
+def test_find_processes_matches_the_exact_name(proc):
+    add_process(proc, 300, "openvpn")
+    add_process(proc, 42, "openvpn")
+    add_process(proc, 7, "openvpn-helper")
+    add_process(proc, 8, "sudo")
+    add_process(proc, 9, "openvpn", state="Z")
+    (proc / "self").mkdir()
+    (proc / "net" / "route").write_text(ROUTE_HEADER + "\n")
+    assert vpn.find_processes("openvpn", str(proc)) == [42, 300]
+    assert vpn.find_processes("sudo", str(proc)) == [8]
+    assert vpn.find_processes("dnsmasq", str(proc)) == []
+
+
+def test_find_processes_odd_names_and_vanished_entries(proc):
+    # Command names may hold spaces and parentheses, and the kernel truncates them to 15 characters
+    add_process(proc, 10, "a (b) c")
+    add_process(proc, 11, "network-manager")
+    # A process that exits between listdir and the read leaves an empty directory
+    (proc / "12").mkdir()
+    assert vpn.find_processes("a (b) c", str(proc)) == [10]
+    assert vpn.find_processes("network-manager-dispatcher", str(proc)) == [11]
+    assert vpn.find_processes("openvpn", str(proc / "missing")) == []
+
+
+def test_probe_status_reads_the_fake_tree(proc, tmp_path_factory):
+    add_process(proc, 100, "openvpn")
+    write_routes(proc, v4=[route4("eth0", "192.168.1.1", 100)], v6=[route6("eth0", "fe80::1", 1024)])
+    sys_net = tmp_path_factory.mktemp("sys_net")
+    status = vpn.probe_status("openvpn", ["tun0"], proc=str(proc), sys_net=str(sys_net))
+    assert status == {
+        "pids": [100],
+        "interfaces": {"tun0": None},
+        "default_route": ("eth0", "192.168.1.1"),
+        "default_route6": ("eth0", "fe80::1"),
+    }
@@ -0,0 +1,151 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import An0m0s_vpn as vpn
+
+
+def test_stop_after_exit_does_not_write_to_a_reused_fd():
+    exited = threading.Event()
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    watcher = vpn.ProcessExitWatcher(process, lambda code: exited.set())
+    watcher.start()
+    assert exited.wait(10)
+    watcher._thread.join(5)
+    if watcher.mechanism == "pidfd":
+        assert watcher._wake_w is None
+    # Whatever now holds the old descriptor numbers must stay untouched
+    read_fd, write_fd = os.pipe()
+    try:
+        watcher.stop()
+        os.set_blocking(read_fd, False)
+        try:
+            leaked = os.read(read_fd, 1)
+        except BlockingIOError:
+            leaked = b""
+        assert leaked == b""
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+    assert watcher.returncode == 0
+
+
+def test_stop_cancels_the_callback():
+    called = []
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.2)"])
+    watcher = vpn.ProcessExitWatcher(process, called.append)
+    watcher.start()
+    watcher.stop()
+    assert watcher.wait(10)
+    assert called == []
+
+
+IGNORES_SIGTERM = (
+    "import signal, sys, time\n"
+    "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+    "print('ready', flush=True)\n"
+    "time.sleep(60)\n"
+)
+
+
+class RecordingProcess:
+    """Popen wrapper that records which signals stop_openvpn() sent"""
+
+    def __init__(self, code):
+        self.popen = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE)
+        if "ready" in code:
+            assert self.popen.stdout.readline() == b"ready\n"
+        self.pid = self.popen.pid
+        self.signals = []
+
+    def poll(self):
+        return self.popen.poll()
+
+    def wait(self, timeout=None):
+        return self.popen.wait(timeout)
+
+    def terminate(self):
+        self.signals.append("SIGTERM")
+        self.popen.terminate()
+
+    def kill(self):
+        self.signals.append("SIGKILL")
+        self.popen.kill()
+
+
+class FakeManagement:
+    """A connected management client; openvpn acts on `signal SIGTERM`"""
+
+    def __init__(self, process, connected=True):
+        self.process = process
+        self.connected = connected
+        self.commands = []
+
+    def send(self, command):
+        if not self.connected:
+            return False
+        self.commands.append(command)
+        os.kill(self.process.pid, signal.SIGTERM)
+        return True
+
+
+def watched(process):
+    watcher = vpn.ProcessExitWatcher(process, lambda code: None)
+    watcher.start()
+    return watcher
+
+
+def test_stop_kills_a_child_that_ignores_sigterm():
+    process = RecordingProcess(IGNORES_SIGTERM)
+    watcher = watched(process)
+    elapsed, escalated = vpn.stop_openvpn(process, watcher, timeout=0.5)
+    assert escalated
+    assert process.signals == ["SIGTERM", "SIGKILL"]
+    assert 0.5 <= elapsed < 0.5 + 1.0
+    assert watcher.returncode == -signal.SIGKILL
+    process.popen.stdout.close()
+
+
+def test_stop_over_the_management_socket():
+    process = RecordingProcess("print('ready', flush=True)\nimport time\ntime.sleep(60)\n")
+    watcher = watched(process)
+    management = FakeManagement(process)
+    elapsed, escalated = vpn.stop_openvpn(process, watcher, management, timeout=5.0)
+    assert not escalated
+    assert management.commands == ["signal SIGTERM"]
+    # Not signalled directly
+    assert process.signals == []
+    assert elapsed < 1.0
+    assert watcher.returncode == -signal.SIGTERM
+    process.popen.stdout.close()
+
+
+def test_stop_signals_when_management_is_not_connected():
+    process = RecordingProcess("print('ready', flush=True)\nimport time\ntime.sleep(60)\n")
+    watcher = watched(process)
+    management = FakeManagement(process, connected=False)
+    _, escalated = vpn.stop_openvpn(process, watcher, management, timeout=5.0)
+    assert not escalated
+    assert process.signals == ["SIGTERM"]
+    process.popen.stdout.close()
+
+
+def test_stop_of_an_exited_process_sends_nothing(make_app):
+    process = RecordingProcess("pass")
+    watcher = watched(process)
+    assert watcher.wait(10)
+    management = FakeManagement(process)
+    start = time.monotonic()
+    elapsed, escalated = vpn.stop_openvpn(process, watcher, management, timeout=5.0)
+    assert (escalated, process.signals, management.commands) == (False, [], [])
+    assert elapsed < 0.5 and time.monotonic() - start < 0.5
+
+    # Through Tunnel.stop(): True, still nothing sent
+    tunnel = make_app().tunnel
+    tunnel.process, tunnel.exit_watcher, tunnel.management = process, watcher, management
+    assert tunnel.stop(timeout=5.0) is True
+    assert (process.signals, management.commands) == ([], [])
+    process.popen.stdout.close()
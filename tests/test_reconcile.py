@@ -0,0 +1,298 @@
+"""Reconcile against live firewall state read through stub *-save/nft binaries.
+
+The stubs print a live table the test controls and record what would have
+been loaded, so the backends run their real read/compile/restore path.
+"""
+
+import ipaddress
+import json
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+SERVERS = ["198.51.100.1", "198.51.100.2", "2001:db8::1"]
+SPEC = dict(default_iface="eth0", default_gateway="192.168.1.1", vpn_ports=[1194], dns_servers=["10.8.0.1"])
+
+# Rules of other software in the builtin chains and a chain of its own
+FOREIGN = {
+    "INPUT": ["-A INPUT -i docker0 -j ACCEPT"],
+    "FORWARD": ["-A FORWARD -j DOCKER-USER"],
+    "OUTPUT": ["-A OUTPUT -o lo -j ACCEPT"],
+    "DOCKER-USER": ["-A DOCKER-USER -s 172.17.0.0/16 -j RETURN", "-A DOCKER-USER -j RETURN"],
+}
+
+STUBS = {
+    "iptables-save": 'cat "{dir}/iptables.state"\n',
+    "ip6tables-save": 'cat "{dir}/ip6tables.state"\n',
+    "iptables-restore": 'echo "$*" > "{dir}/iptables-restore.args"; cat > "{dir}/iptables-restore.in"\n',
+    "ip6tables-restore": 'echo "$*" > "{dir}/ip6tables-restore.args"; cat > "{dir}/ip6tables-restore.in"\n',
+    "nft": (
+        'case " $* " in\n'
+        '    *" -j "*) echo "$*" > "{dir}/nft-list.args"; [ -f "{dir}/nft.json" ] || exit 1; cat "{dir}/nft.json" ;;\n'
+        '    *) cat > "{dir}/nft.in" ;;\n'
+        'esac\n'
+    ),
+}
+
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, body in STUBS.items():
+        path = bin_dir / name
+        path.write_text("#!/bin/sh\n" + body.format(dir=tmp_path))
+        path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:/usr/bin:/bin")
+    return tmp_path
+
+
+def ruleset(servers=SERVERS):
+    return vpn.build_killswitch_ruleset(vpn.KillswitchSpec(vpn_servers=servers, **SPEC))
+
+
+# -- iptables ---------------------------------------------------------------
+
+def live_tables(rules, chains, hooked=True):
+    """Chain name -> rule lines, as after a previous apply plus foreign rules"""
+    tables = {"INPUT": [], "FORWARD": [], "OUTPUT": [], "DOCKER-USER": []}
+    if hooked:
+        for builtin, owned in chains:
+            tables[builtin].append(f"-A {builtin} -j {owned}")
+    for chain, lines in FOREIGN.items():
+        tables[chain].extend(lines)
+    for _, owned in chains:
+        tables[owned] = [r for r in rules if r.split()[1] == owned]
+    return tables
+
+
+def save_output(tables):
+    lines = ["*filter"]
+    for chain in tables:
+        policy = "ACCEPT" if chain in ("INPUT", "FORWARD", "OUTPUT") else "-"
+        lines.append(f":{chain} {policy} [0:0]")
+    for rules in tables.values():
+        lines.extend(rules)
+    lines.append("COMMIT")
+    return "\n".join(lines) + "\n"
+
+
+def restore_noflush(tables, payload):
+    """Apply an iptables-restore --noflush payload the way the kernel table would change"""
+    tables = {chain: list(rules) for chain, rules in tables.items()}
+    lines = payload.splitlines()
+    assert lines[0] == "*filter" and lines[-1] == "COMMIT"
+    for line in lines[1:-1]:
+        if line.startswith(":"):
+            tables[line[1:].split()[0]] = []
+            continue
+        op, chain, rest = line.split(" ", 2)
+        if op == "-A":
+            tables[chain].append(f"-A {chain} {rest}")
+        elif op == "-I":
+            position, rest = rest.split(" ", 1)
+            tables[chain].insert(int(position) - 1, f"-A {chain} {rest}")
+        elif op == "-D":
+            # Deleting a rule that is not there fails the whole transaction
+            tables[chain].remove(f"-A {chain} {rest}")
+        else:
+            pytest.fail(f"unexpected restore line {line!r}")
+    return tables
+
+
+def write_iptables(directory, family_tables):
+    for name, tables in family_tables.items():
+        (directory / f"{name}.state").write_text(save_output(tables))
+
+
+def loaded(directory, name):
+    path = directory / f"{name}.in"
+    if not path.exists():
+        return None
+    payload = path.read_text()
+    path.unlink()
+    return payload
+
+
+FAMILIES = (("iptables", 4, vpn.KILLSWITCH_CHAINS), ("ip6tables", 6, vpn.KILLSWITCH_CHAINS_V6))
+
+
+def apply_iptables(stubs, live_servers, servers, hooked=True):
+    """Apply `servers` over a table holding `live_servers`; (live, payload, result) per family"""
+    live = {name: live_tables(vpn.render_iptables_rules(ruleset(live_servers), family), chains, hooked)
+            for name, family, chains in FAMILIES}
+    write_iptables(stubs, live)
+    assert vpn.IptablesBackend().apply(vpn.KillswitchSpec(vpn_servers=servers, **SPEC))
+    results = {}
+    for name, family, chains in FAMILIES:
+        payload = loaded(stubs, "iptables-restore" if family == 4 else "ip6tables-restore")
+        after = live[name] if payload is None else restore_noflush(live[name], payload)
+        results[name] = (live[name], payload, after)
+    return results
+
+
+def check_converged(stubs, results, servers):
+    for name, family, chains in FAMILIES:
+        live, payload, after = results[name]
+        desired = vpn.render_iptables_rules(ruleset(servers), family)
+        for builtin, owned in chains:
+            assert after[builtin][0] == f"-A {builtin} -j {owned}"
+            assert after[builtin][1:] == FOREIGN[builtin]
+            # Same rules, every ACCEPT still ahead of every DROP
+            assert sorted(after[owned]) == sorted(r for r in desired if r.split()[1] == owned)
+            actions = [rule.rsplit(" ", 1)[1] for rule in after[owned]]
+            assert actions == sorted(actions)
+        assert after["DOCKER-USER"] == FOREIGN["DOCKER-USER"]
+    # Applying again over the result changes nothing
+    write_iptables(stubs, {name: after for name, (_, _, after) in results.items()})
+    assert vpn.IptablesBackend().apply(vpn.KillswitchSpec(vpn_servers=servers, **SPEC))
+    assert loaded(stubs, "iptables-restore") is None and loaded(stubs, "ip6tables-restore") is None
+
+
+def test_iptables_unchanged_state_restores_nothing(stubs):
+    results = apply_iptables(stubs, SERVERS, SERVERS)
+    assert all(payload is None for _, payload, _ in results.values())
+
+
+def test_iptables_added_remote_inserts_only_its_rules(stubs):
+    servers = SERVERS + ["203.0.113.9"]
+    results = apply_iptables(stubs, SERVERS, servers)
+    body = results["iptables"][1].splitlines()[1:-1]
+    assert body and all(line.startswith("-I AN0M0S_") and "203.0.113.9" in line for line in body)
+    # The IPv6 table has nothing to do with an IPv4 remote
+    assert results["ip6tables"][1] is None
+    assert (stubs / "iptables-restore.args").read_text().split() == ["--noflush"]
+    check_converged(stubs, results, servers)
+
+
+def test_iptables_removed_remote_deletes_only_its_rules(stubs):
+    servers = [s for s in SERVERS if s != "2001:db8::1"]
+    results = apply_iptables(stubs, SERVERS, servers)
+    assert results["iptables"][1] is None
+    body = results["ip6tables"][1].splitlines()[1:-1]
+    assert body and all(line.startswith("-D AN0M0S_") and "2001:db8::1/128" in line for line in body)
+    check_converged(stubs, results, servers)
+
+
+def test_iptables_missing_chains_are_created_and_hooked(stubs):
+    # A first apply: none of our chains exist yet
+    live = {name: live_tables([], chains, hooked=False) for name, _, chains in FAMILIES}
+    for tables in live.values():
+        for name in ("AN0M0S_INPUT", "AN0M0S_OUTPUT", "AN0M0S_FORWARD"):
+            tables.pop(name, None)
+    write_iptables(stubs, live)
+    assert vpn.IptablesBackend().apply(vpn.KillswitchSpec(vpn_servers=SERVERS, **SPEC))
+    results = {}
+    for name, family, _ in FAMILIES:
+        payload = loaded(stubs, name + "-restore")
+        assert "-D" not in payload
+        results[name] = (live[name], payload, restore_noflush(live[name], payload))
+    check_converged(stubs, results, SERVERS)
+
+
+def test_iptables_jump_pushed_down_by_foreign_rule_is_moved_back(stubs):
+    live = {name: live_tables(vpn.render_iptables_rules(ruleset(), family), chains)
+            for name, family, chains in FAMILIES}
+    # Someone inserted a rule above our jump
+    live["iptables"]["OUTPUT"].insert(0, "-A OUTPUT -d 192.0.2.1/32 -j ACCEPT")
+    write_iptables(stubs, live)
+    assert vpn.IptablesBackend().apply(vpn.KillswitchSpec(vpn_servers=SERVERS, **SPEC))
+    assert loaded(stubs, "iptables-restore") == (
+        "*filter\n-D OUTPUT -j AN0M0S_OUTPUT\n-I OUTPUT 1 -j AN0M0S_OUTPUT\nCOMMIT\n")
+    assert loaded(stubs, "ip6tables-restore") is None
+
+
+def test_iptables_duplicate_and_foreign_rules_in_our_chain(stubs):
+    live = {name: live_tables(vpn.render_iptables_rules(ruleset(), family), chains)
+            for name, family, chains in FAMILIES}
+    owned = live["iptables"]["AN0M0S_OUTPUT"]
+    owned.insert(0, owned[0])
+    owned.insert(0, "-A AN0M0S_OUTPUT -d 192.0.2.7/32 -j ACCEPT")
+    write_iptables(stubs, live)
+    assert vpn.IptablesBackend().apply(vpn.KillswitchSpec(vpn_servers=SERVERS, **SPEC))
+    # Our chains hold only our rules; both extras go, nothing else is touched
+    assert loaded(stubs, "iptables-restore") == (
+        f"*filter\n-D AN0M0S_OUTPUT -d 192.0.2.7/32 -j ACCEPT\n-D{owned[1][2:]}\nCOMMIT\n")
+
+
+# -- nftables ---------------------------------------------------------------
+
+def nft_json(sets, layout=vpn.NFT_LAYOUT_SET, extra=()):
+    """What `nft -j list table inet an0m0s` prints for these set contents"""
+
+    def element(name, value):
+        if vpn.KILLSWITCH_SETS[name][0] in ("ifname", "inet_service"):
+            return value
+        net = ipaddress.ip_network(value)
+        if net.prefixlen == net.max_prefixlen:
+            return str(net.network_address)
+        return {"prefix": {"addr": str(net.network_address), "len": net.prefixlen}}
+
+    objects = [{"metainfo": {"version": "1.0.9", "json_schema_version": 1}},
+               {"table": {"family": "inet", "name": "an0m0s", "handle": 7}}]
+    if layout:
+        objects.append({"set": {"family": "inet", "table": "an0m0s", "name": layout, "type": "inet_service"}})
+    for name, values in sets.items():
+        nft_set = {"family": "inet", "table": "an0m0s", "name": name, "type": vpn.KILLSWITCH_SETS[name][0]}
+        if values:
+            nft_set["elem"] = [element(name, v) for v in values]
+        objects.append({"set": nft_set})
+    objects.extend(extra)
+    objects.append({"chain": {"family": "inet", "table": "an0m0s", "name": "output", "hook": "output"}})
+    return json.dumps({"nftables": objects})
+
+
+def apply_nft(stubs, servers, live_json):
+    if live_json is not None:
+        (stubs / "nft.json").write_text(live_json)
+    assert vpn.NftablesBackend().apply(vpn.KillswitchSpec(vpn_servers=servers, **SPEC))
+    assert (stubs / "nft-list.args").read_text().split() == ["-j", "list", "table", "inet", "an0m0s"]
+    return loaded(stubs, "nft")
+
+
+def test_nft_unchanged_state_loads_nothing(stubs):
+    assert apply_nft(stubs, SERVERS, nft_json(ruleset().sets)) is None
+
+
+def test_nft_added_remote_is_one_element(stubs):
+    assert apply_nft(stubs, SERVERS + ["203.0.113.0/24"], nft_json(ruleset().sets)) == (
+        "add element inet an0m0s vpn_servers4 { 203.0.113.0/24 }\n")
+
+
+def test_nft_removed_remote_is_one_element(stubs):
+    assert apply_nft(stubs, SERVERS[1:], nft_json(ruleset().sets)) == (
+        "delete element inet an0m0s vpn_servers4 { 198.51.100.1/32 }\n")
+
+
+def test_nft_replaced_hosts_delete_before_add(stubs):
+    live = ruleset(["198.51.100.1", "198.51.100.2"]).sets
+    assert apply_nft(stubs, ["198.51.100.0/24"], nft_json(live)) == (
+        "delete element inet an0m0s vpn_servers4 { 198.51.100.1/32, 198.51.100.2/32 }\n"
+        "add element inet an0m0s vpn_servers4 { 198.51.100.0/24 }\n")
+
+
+def test_nft_only_touches_its_own_table(stubs):
+    # Rules and sets outside our table never show up in the listing we read,
+    # and unknown objects inside it are ignored
+    extra = [{"rule": {"family": "inet", "table": "an0m0s", "chain": "output", "expr": []}},
+             {"set": {"family": "inet", "table": "an0m0s", "name": "someone_elses"}}]
+    payload = apply_nft(stubs, SERVERS + ["203.0.113.9"], nft_json(ruleset().sets, extra=extra))
+    assert payload == "add element inet an0m0s vpn_servers4 { 203.0.113.9/32 }\n"
+    assert "someone_elses" not in payload
+
+
+@pytest.mark.parametrize("layout", ["layout_4", None])
+def test_nft_stale_layout_marker_forces_a_full_reload(stubs, layout):
+    payload = apply_nft(stubs, SERVERS, nft_json(ruleset().sets, layout=layout))
+    assert payload == vpn.compile_nft_ruleset(ruleset())
+    assert payload.startswith("table inet an0m0s\ndelete table inet an0m0s\n")
+    assert f"set {vpn.NFT_LAYOUT_SET} " in payload
+
+
+def test_nft_missing_set_or_table_forces_a_full_reload(stubs):
+    sets = dict(ruleset().sets)
+    del sets["dns_servers6"]
+    assert apply_nft(stubs, SERVERS, nft_json(sets)) == vpn.compile_nft_ruleset(ruleset())
+    (stubs / "nft.json").unlink()
+    assert apply_nft(stubs, SERVERS, None) == vpn.compile_nft_ruleset(ruleset())
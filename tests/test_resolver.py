@@ -0,0 +1,15 @@
+import pytest
+
+import An0m0s_vpn as vpn
+
+
+@pytest.mark.parametrize("name", ["vpn..example.com", "a" * 64 + ".example.com"])
+def test_malformed_name_is_an_oserror(name):
+    with pytest.raises(OSError):
+        vpn.query_dns(name, vpn.DNS_TYPE_A, "127.0.0.1", timeout=0.1)
+
+
+def test_malformed_remote_does_not_abort_the_others():
+    resolver = vpn.RemoteResolver(timeout=0.1)
+    hosts = ["1.2.3.4", "vpn..example.com", "a" * 64 + ".example.com", "2001:db8::1"]
+    assert resolver.resolve_all(hosts) == ["1.2.3.4", "2001:db8::1"]
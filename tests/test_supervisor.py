@@ -0,0 +1,217 @@
+import random
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+S = vpn.TunnelSupervisor
+REMOTES = [vpn.OvpnRemote("a.example.com"), vpn.OvpnRemote("b.example.com", 443, "tcp"),
+           vpn.OvpnRemote("c.example.com")]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeTimer:
+    """threading.Timer stand-in that only fires when the test says so"""
+
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.daemon = False
+        self.started = False
+        self.cancelled = False
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+    def fire(self):
+        assert self.started and not self.cancelled
+        self.function()
+
+
+class FixedRandom:
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class Harness:
+    def __init__(self, rng=None, **kwargs):
+        self.clock = FakeClock()
+        self.timers = []
+        self.launches = []
+        self.states = []
+        self.supervisor = S(self.launch, on_state=self.states.append, clock=self.clock,
+                            rng=rng or FixedRandom(0.0), timer=self.timer, **kwargs)
+
+    def launch(self, remote, attempt):
+        self.launches.append((remote.host, attempt))
+
+    def timer(self, interval, function):
+        timer = FakeTimer(interval, function)
+        self.timers.append(timer)
+        return timer
+
+    def fail(self, runtime=1.0):
+        """The current attempt's process exits after `runtime` seconds"""
+        self.clock.advance(runtime)
+        self.supervisor.exited(self.launches[-1][1], 1)
+
+    def retry(self):
+        self.timers[-1].fire()
+
+
+def test_state_machine():
+    h = Harness(max_attempts=2)
+    assert h.supervisor.state == S.IDLE and not h.supervisor.active
+    h.supervisor.start(REMOTES)
+    h.clock.advance(2.5)
+    h.supervisor.connected()
+    # openvpn restarts the session by itself (ping timeout)
+    h.supervisor.reconnecting()
+    h.supervisor.connected()
+    h.supervisor.reconnecting()
+    h.fail()
+    h.retry()
+    h.fail()
+    assert h.states == [S.CONNECTING, S.CONNECTED, S.RECONNECTING, S.CONNECTED, S.RECONNECTING, S.FAILED]
+    assert not h.supervisor.active
+    # A FAILED supervisor ignores late reports
+    h.supervisor.connected()
+    assert h.supervisor.state == S.FAILED
+
+
+def test_capped_exponential_backoff():
+    h = Harness(base_delay=1.0, max_delay=10.0, jitter=0.5, max_attempts=10)
+    h.supervisor.start(REMOTES)
+    delays = []
+    for _ in range(6):
+        h.fail()
+        delays.append(h.timers[-1].interval)
+        h.retry()
+    assert delays == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+    assert h.supervisor.failures == 6
+
+    # A successful connect resets it
+    h.supervisor.connected()
+    assert h.supervisor.failures == 0 and h.supervisor.next_delay is None
+    h.fail()
+    assert h.timers[-1].interval == 1.0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_jitter_stays_within_bounds(seed):
+    h = Harness(rng=random.Random(seed), base_delay=2.0, max_delay=30.0, jitter=0.25, max_attempts=50)
+    h.supervisor.start(REMOTES)
+    for failure in range(1, 20):
+        h.fail()
+        full = min(30.0, 2.0 * 2 ** (failure - 1))
+        assert full * 0.75 <= h.timers[-1].interval <= full
+        assert h.supervisor.next_delay == h.timers[-1].interval
+        h.retry()
+
+
+def test_full_jitter_bound():
+    h = Harness(rng=FixedRandom(0.999999), base_delay=4.0, jitter=0.5)
+    h.supervisor.start(REMOTES)
+    h.fail()
+    assert h.timers[-1].interval == pytest.approx(2.0, abs=1e-5)
+
+
+def test_rotates_through_the_remotes():
+    h = Harness()
+    h.supervisor.start(REMOTES)
+    for _ in range(4):
+        h.fail()
+        h.retry()
+    assert h.launches == [("a.example.com", 1), ("b.example.com", 2), ("c.example.com", 3),
+                          ("a.example.com", 4), ("b.example.com", 5)]
+
+
+def test_attempt_records():
+    h = Harness()
+    h.supervisor.start(REMOTES)
+    h.clock.advance(3.0)
+    h.supervisor.connected()
+    h.clock.advance(60.0)
+    h.supervisor.exited(1, 2)
+    h.clock.advance(1.0)
+    h.retry()
+    h.clock.advance(0.5)
+    h.supervisor.stop()
+
+    first, second = h.supervisor.attempts
+    assert (first["attempt"], first["remote"].host, first["outcome"]) == (1, "a.example.com", "exit 2")
+    assert first["launched"] == 1000.0
+    assert first["connected_after"] == 3.0
+    assert first["ended_after"] == 63.0
+    assert (second["attempt"], second["remote"].host) == (2, "b.example.com")
+    assert second["launched"] == 1064.0
+    assert second["connected_after"] is None
+    assert (second["ended_after"], second["outcome"]) == (0.5, "stopped")
+
+
+def test_stale_exit_is_ignored():
+    h = Harness()
+    h.supervisor.start(REMOTES)
+    h.fail()
+    h.retry()
+    # The first process's exit watcher reports late
+    h.supervisor.exited(1, 0)
+    assert len(h.timers) == 1 and h.supervisor.state == S.RECONNECTING
+
+
+def test_stop_cancels_the_pending_attempt():
+    h = Harness()
+    h.supervisor.start(REMOTES)
+    h.fail()
+    pending = h.timers[-1]
+    h.supervisor.stop()
+    assert pending.cancelled
+    assert h.supervisor.state == S.IDLE
+    # Even if the timer was already firing, nothing is launched
+    pending.function()
+    assert h.launches == [("a.example.com", 1)]
+
+
+def test_failing_first_launch_propagates():
+    h = Harness()
+
+    def launch(remote, attempt):
+        raise OSError("openvpn not found")
+
+    h.supervisor.launch = launch
+    with pytest.raises(OSError):
+        h.supervisor.start(REMOTES)
+    assert h.supervisor.state == S.IDLE
+    assert h.supervisor.attempts[-1]["outcome"] == "error"
+    assert not h.timers
+
+
+def test_failing_relaunch_counts_as_a_failure():
+    h = Harness()
+    h.supervisor.start(REMOTES)
+    h.fail()
+
+    def launch(remote, attempt):
+        raise OSError("no such device")
+
+    h.supervisor.launch = launch
+    h.retry()
+    assert h.supervisor.failures == 2
+    assert h.supervisor.attempts[-1]["outcome"] == "exit None"
+    assert h.timers[-1].interval == 2.0
@@ -0,0 +1,126 @@
+import pytest
+
+import An0m0s_vpn as vpn
+
+
+class FakeLink:
+    """/sys/class/net/<iface>/statistics for one interface, with a settable clock"""
+
+    def __init__(self, root, iface="tun0"):
+        self.root = root
+        self.iface = iface
+        self.now = 100.0
+        self.set(0, 0)
+
+    def set(self, rx, tx):
+        statistics = self.root / self.iface / "statistics"
+        statistics.mkdir(parents=True, exist_ok=True)
+        for name in vpn.LINK_STATISTICS:
+            value = {"rx_bytes": rx, "tx_bytes": tx}.get(name, 0)
+            (statistics / name).write_text(f"{value}\n")
+
+    def clock(self):
+        return self.now
+
+
+def sampler(tmp_path, capacity=120):
+    link = FakeLink(tmp_path)
+    return link, vpn.ThroughputSampler(capacity, sys_net=str(tmp_path), clock=link.clock)
+
+
+def test_rate_over_the_sample_interval(tmp_path):
+    link, s = sampler(tmp_path)
+    assert s.sample("tun0")
+    # First sample only sets the baseline
+    assert len(s.series) == 0
+    link.now += 0.5
+    link.set(5000, 1000)
+    assert s.sample("tun0")
+    assert s.series.latest() == (10000.0, 2000.0)
+    link.now += 2.0
+    link.set(9000, 1000)
+    s.sample("tun0")
+    assert s.series.latest() == (2000.0, 0.0)
+    assert s.counters["rx_bytes"] == 9000
+
+
+def test_counter_reset_is_not_a_negative_rate(tmp_path):
+    link, s = sampler(tmp_path)
+    link.set(10**9, 10**9)
+    s.sample("tun0")
+    # The device was recreated: counters start over
+    link.now += 1.0
+    link.set(300, 200)
+    s.sample("tun0")
+    assert s.series.latest() == (0.0, 0.0)
+    link.now += 1.0
+    link.set(1300, 400)
+    s.sample("tun0")
+    assert s.series.latest() == (1000.0, 200.0)
+
+
+def test_same_timestamp_adds_no_sample(tmp_path):
+    link, s = sampler(tmp_path)
+    s.sample("tun0")
+    link.set(100, 100)
+    s.sample("tun0")
+    assert len(s.series) == 0
+
+
+def test_missing_or_changed_interface(tmp_path):
+    link, s = sampler(tmp_path)
+    s.sample("tun0")
+    link.now += 1.0
+    link.set(100, 0)
+    s.sample("tun0")
+    assert not s.sample("tun9")
+    assert s.iface == "tun9" and s.counters is None and len(s.series) == 0
+    # Back on tun0: a fresh baseline, no rate across the gap
+    link.now += 1.0
+    assert s.sample("tun0")
+    assert len(s.series) == 0
+
+
+def test_ring_capacity():
+    series = vpn.RateSeries(4)
+    assert len(series) == 0 and series.latest() == (0.0, 0.0) and series.peak() == 0.0
+    for n in range(1, 4):
+        series.append(n, n * 10)
+    assert list(series.ordered(series.rx)) == [1, 2, 3]
+    for n in range(4, 8):
+        series.append(n, n * 10)
+    assert len(series) == 4
+    assert list(series.ordered(series.rx)) == [4, 5, 6, 7]
+    assert list(series.ordered(series.tx)) == [40, 50, 60, 70]
+    assert series.latest() == (7, 70)
+    assert series.peak() == 70
+    series.clear()
+    assert len(series) == 0 and series.peak() == 0.0 and list(series.ordered(series.rx)) == []
+
+
+def test_sparkline_scaling():
+    coords = vpn.sparkline_coords([0.0, 50.0, 100.0], capacity=3, width=101, height=54, peak=100.0, pad=2)
+    assert coords == [0.0, 52.0, 50.0, 27.0, 100.0, 2.0]
+
+
+def test_sparkline_is_right_aligned():
+    coords = vpn.sparkline_coords([1.0, 1.0], capacity=5, width=101, height=20, peak=2.0)
+    xs = coords[0::2]
+    assert xs == [75.0, 100.0]
+
+
+@pytest.mark.parametrize("values, peak, expected_y", [
+    # No traffic at all: the baseline, never a division by zero
+    ([0.0, 0.0, 0.0], 0.0, 18.0),
+    # All equal: a flat line at the top
+    ([7.0, 7.0, 7.0], 7.0, 2.0),
+])
+def test_sparkline_flat_lines(values, peak, expected_y):
+    coords = vpn.sparkline_coords(values, capacity=3, width=50, height=20, peak=peak)
+    assert len(coords) == 6
+    assert set(coords[1::2]) == {expected_y}
+
+
+@pytest.mark.parametrize("values", [[], [5.0]])
+def test_sparkline_needs_two_points(values):
+    assert vpn.sparkline_coords(values, capacity=10, width=50, height=20, peak=5.0) == [0, 18, 50, 18]
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+PROFILE = """\
+client
+remote vpn.example.com 1194
+"""
+
+
+@pytest.fixture
+def registry(tmp_path):
+    (tmp_path / "net").mkdir()
+    return vpn.TunnelRegistry(vpn.OvpnConfigCache(), sys_net=str(tmp_path / "net"))
+
+
+def profile(tmp_path, dev, name="client.ovpn"):
+    path = tmp_path / name
+    path.write_text(PROFILE + f"dev {dev}\n")
+    return str(path)
+
+
+def launch(registry, tunnel):
+    """What Tunnel._launch does before starting openvpn"""
+    tunnel.dev = registry.allocate_device(tunnel, registry.config_cache.load(tunnel.config_path))
+    tunnel.supervisor.state = vpn.TunnelSupervisor.CONNECTING
+    return tunnel.dev
+
+
+def test_fixed_device_shared_by_two_tunnels(tmp_path, registry):
+    path = profile(tmp_path, "tun0")
+    first = registry.add("first", config_path=path)
+    second = registry.add("second", config_path=path)
+    assert launch(registry, first) == "tun0"
+    # tun0 belongs to the running first tunnel: the second gets the next free one
+    assert launch(registry, second) == "tun1"
+
+    # Once the first one stops, its fixed device is free again
+    first.supervisor.state = vpn.TunnelSupervisor.IDLE
+    third = registry.add("third", config_path=path)
+    assert launch(registry, third) == "tun0"
+
+
+def test_free_device_skips_existing_interfaces(tmp_path, registry):
+    for name in ("tun0", "tun1", "tap0"):
+        (tmp_path / "net" / name).mkdir()
+    path = profile(tmp_path, "tun")
+    first = registry.add("first", config_path=path)
+    second = registry.add("second", config_path=path)
+    assert launch(registry, first) == "tun2"
+    assert launch(registry, second) == "tun3"
+    tap = registry.add("tap", config_path=profile(tmp_path, "tap", "tap.ovpn"))
+    assert launch(registry, tap) == "tap1"
+
+
+def test_relaunch_keeps_its_device(tmp_path, registry):
+    path = profile(tmp_path, "tun")
+    tunnel = registry.add("main", config_path=path)
+    assert launch(registry, tunnel) == "tun0"
+    # The old interface may linger while openvpn restarts
+    (tmp_path / "net" / "tun0").mkdir()
+    assert launch(registry, tunnel) == "tun0"
+
+
+def test_len_get_and_remove(tmp_path, registry):
+    path = profile(tmp_path, "tun")
+    tunnel = registry.add("main", config_path=path)
+    assert len(registry) == 1 and registry.get("main") is tunnel and registry.get("other") is None
+    with pytest.raises(ValueError, match="already exists"):
+        registry.add("main")
+    launch(registry, tunnel)
+    with pytest.raises(ValueError, match="still running"):
+        registry.remove("main")
+    tunnel.supervisor.state = vpn.TunnelSupervisor.IDLE
+    registry.remove("main")
+    assert len(registry) == 0 and list(registry) == []
+
+
+def test_len_and_get_wait_for_the_lock(registry):
+    registry.add("main")
+    results = []
+    with registry._lock:
+        readers = [threading.Thread(target=lambda: results.append(len(registry))),
+                   threading.Thread(target=lambda: results.append(registry.get("main").name))]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join(0.05)
+        assert results == []
+    for reader in readers:
+        reader.join(10)
+    assert sorted(results, key=str) == [1, "main"]
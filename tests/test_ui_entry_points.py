@@ -0,0 +1,272 @@
+"""The real button handlers never block the Tk thread.
+
+start_vpn(), force_stop_vpn(), the killswitch toggle and close_app() run
+headless against a stub Tk loop; Tunnel.start/stop and the firewall backend
+are slow stubs. Every call made on the "Tk" thread (the handler itself,
+every root.after callback and every callback pumped from a worker) is timed
+and must fit in UI_PUMP_BUDGET.
+"""
+
+import gc
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import An0m0s_vpn as vpn
+
+SLOW = 0.2
+
+
+class StubTk:
+    """root.after() queue run by the test instead of a Tk main loop"""
+
+    def __init__(self):
+        self.pending = []
+        self.quit_called = False
+
+    def after(self, ms, func, *args):
+        self.pending.append((time.monotonic() + ms / 1000, func, args))
+
+    def quit(self):
+        self.quit_called = True
+
+
+class StubWidget:
+    def __init__(self):
+        self.options = {}
+        self.history = []
+
+    def config(self, **options):
+        self.options.update(options)
+        if "text" in options:
+            self.history.append(options["text"])
+
+    def itemconfig(self, *args, **options):
+        pass
+
+    def coords(self, *args):
+        pass
+
+    def unbind_all(self, sequence):
+        pass
+
+
+class StubVar:
+    def __init__(self, value=False):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class StubMessagebox:
+    """Answers yes at once and records what was shown"""
+
+    def __init__(self):
+        self.shown = []
+
+    def askyesno(self, title, message, **kwargs):
+        return True
+
+    def showinfo(self, title, message, **kwargs):
+        self.shown.append(("info", title))
+
+    def showwarning(self, title, message, **kwargs):
+        self.shown.append(("warning", title))
+
+    def showerror(self, title, message, **kwargs):
+        self.shown.append(("error", title))
+
+
+class SlowBackend:
+    """Firewall backend that takes SLOW per change and records its thread"""
+
+    name = "slow"
+
+    def __init__(self):
+        self.calls = []
+
+    def apply(self, spec):
+        self.calls.append(("apply", threading.current_thread()))
+        time.sleep(SLOW)
+        return True
+
+    def remove(self):
+        self.calls.append(("remove", threading.current_thread()))
+        time.sleep(SLOW)
+        return True
+
+
+class Harness:
+    """An An0m0sVPN with stub widgets whose Tk-thread calls are all timed"""
+
+    def __init__(self, app):
+        self.app = app
+        self.timings = []
+        root = app.root
+        post = app._post
+
+        def timed_post(func, *args):
+            post(self._timed(func), *args)
+
+        app._post = timed_post
+        # The pump starts with the window
+        root.after(vpn.UI_FRAME_MS, app._pump_ui_queue)
+
+    def _timed(self, func):
+        def run(*args):
+            return self.call(func, *args)
+        return run
+
+    def call(self, func, *args):
+        """Run func on the "Tk" thread and record how long it took"""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timings.append((getattr(func, "__name__", repr(func)), time.perf_counter() - start))
+
+    def run_until(self, done, timeout=5.0):
+        """Run due root.after() callbacks until done() (the Tk main loop)"""
+        root = self.app.root
+        deadline = time.monotonic() + timeout
+        while not done():
+            assert time.monotonic() < deadline, "timed out waiting for the workers"
+            now = time.monotonic()
+            due = [entry for entry in root.pending if entry[0] <= now]
+            for entry in due:
+                root.pending.remove(entry)
+                _, func, args = entry
+                if func == self.app._pump_ui_queue:
+                    # Its callbacks are timed one by one
+                    func(*args)
+                else:
+                    self.call(func, *args)
+            time.sleep(0.001)
+
+    def assert_within_budget(self):
+        slow = [(name, elapsed) for name, elapsed in self.timings if elapsed >= vpn.UI_PUMP_BUDGET]
+        assert not slow, slow
+
+
+@pytest.fixture
+def harness(make_app, monkeypatch):
+    monkeypatch.setattr(vpn, "messagebox", StubMessagebox())
+    monkeypatch.setattr(vpn.os, "geteuid", lambda: 0)
+    monkeypatch.setattr(vpn, "measure_resolver_latency", lambda servers, **kwargs: {})
+
+    app = make_app()
+    app._read_default_route = lambda family: ("eth0", "192.168.1.1") if family == 4 else (None, None)
+    app.firewall_backend = SlowBackend()
+    app.root = StubTk()
+    app._ui_queue = queue.Queue()
+    app.is_running = False
+    app._pipeline_busy = False
+    app.killswitch_var = StubVar()
+    app.start_btn = StubWidget()
+    app.force_stop_btn = StubWidget()
+    app.connection_pill = StubWidget()
+    app.canvas = StubWidget()
+    for name in ("bg_primary", "bg_secondary", "text_primary", "text_secondary", "accent_success",
+                 "accent_danger", "accent_warning"):
+        setattr(app, name, "#202020")
+    app.ip_lookup = SimpleNamespace(invalidate=lambda: None)
+    app.ip_refresh = SimpleNamespace(request=lambda reason, force=False: None, stop=lambda: None)
+    app.network_watcher = SimpleNamespace(stop=lambda: None)
+    app.dns = SimpleNamespace(method=None)
+    app._dns_lock = threading.Lock()
+
+    tunnel = app.tunnel
+
+    def slow_start():
+        time.sleep(SLOW)
+        tunnel.process = SimpleNamespace(pid=4242)
+        app._on_tunnel_event(tunnel, "started", 1)
+        app._on_tunnel_event(tunnel, "state", "CONNECTED")
+
+    def slow_stop(timeout=5.0):
+        time.sleep(SLOW)
+        tunnel.process = None
+        return True
+
+    tunnel.start = slow_start
+    tunnel.stop = slow_stop
+    # Not the leftovers of earlier tests: a full collection would land in
+    # whichever call happens to allocate
+    gc.collect()
+    return Harness(app)
+
+
+def test_connect_and_disconnect_stay_off_the_tk_thread(harness):
+    app = harness.app
+    app.killswitch_var.set(True)
+
+    harness.call(app.start_vpn)
+    harness.run_until(lambda: app.is_running and not app._pipeline_busy)
+    assert app.killswitch_enabled
+    assert app.connection_pill.history[:3] == ["PREPARING", "KILLSWITCH", "STARTING"]
+    assert ("info", "Success") in vpn.messagebox.shown
+
+    harness.call(app.force_stop_vpn)
+    assert app.connection_pill.history[-1] == "STOPPING"
+    harness.run_until(lambda: not app.is_running and not app._pipeline_busy)
+    assert app.connection_pill.history[-1] == "DISCONNECTED"
+    assert ("info", "✓ VPN Stopped") in vpn.messagebox.shown
+
+    assert [call for call, _ in app.firewall_backend.calls] == ["apply"]
+    assert all(thread is not threading.main_thread() for _, thread in app.firewall_backend.calls)
+    assert {"start_vpn", "force_stop_vpn", "_on_connect_started", "_on_disconnect_done"} <= {
+        name for name, _ in harness.timings}
+    harness.assert_within_budget()
+
+
+def test_killswitch_toggle_restore_and_exit_stay_off_the_tk_thread(harness):
+    app = harness.app
+
+    harness.call(app.toggle_killswitch_click)
+    assert app.connection_pill.history[-1] == "KILLSWITCH"
+    harness.run_until(lambda: not app._pipeline_busy)
+    assert app.killswitch_enabled and app.killswitch_var.get()
+
+    harness.call(app.toggle_killswitch_click)
+    harness.run_until(lambda: not app._pipeline_busy)
+    assert not app.killswitch_enabled and not app.killswitch_var.get()
+
+    harness.call(app.toggle_killswitch_click)
+    harness.run_until(lambda: not app._pipeline_busy)
+    harness.call(app.restore_network)
+    harness.run_until(lambda: not app._pipeline_busy)
+    assert not app.killswitch_enabled and not app.killswitch_var.get()
+    assert ("info", "Success") in vpn.messagebox.shown
+
+    harness.call(app.toggle_killswitch_click)
+    harness.run_until(lambda: not app._pipeline_busy)
+    harness.call(app.close_app)
+    assert not app.root.quit_called
+    harness.run_until(lambda: app.root.quit_called)
+    assert not app.killswitch_enabled
+
+    calls = [call for call, _ in app.firewall_backend.calls]
+    assert calls == ["apply", "remove", "apply", "remove", "apply", "remove"]
+    assert all(thread is not threading.main_thread() for _, thread in app.firewall_backend.calls)
+    harness.assert_within_budget()
+
+
+def test_one_pipeline_at_a_time(harness):
+    app = harness.app
+
+    harness.call(app.toggle_killswitch_click)
+    # The killswitch is still being applied
+    harness.call(app.start_vpn)
+    harness.call(app.restore_network)
+    assert vpn.messagebox.shown.count(("warning", "Warning")) == 2
+    harness.run_until(lambda: not app._pipeline_busy)
+    assert not app.is_running
+    assert [call for call, _ in app.firewall_backend.calls] == ["apply"]
+    harness.assert_within_budget()
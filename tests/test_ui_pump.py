@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+
+import An0m0s_vpn as vpn
+
+
+class StubRoot:
+    """Records root.after() calls instead of running a Tk loop"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, func, *args):
+        self.scheduled.append((ms, func))
+
+
+def make_app():
+    app = vpn.An0m0sVPN.__new__(vpn.An0m0sVPN)
+    app.root = StubRoot()
+    app._ui_queue = queue.Queue()
+    return app
+
+
+def pump(app):
+    start = time.perf_counter()
+    app._pump_ui_queue()
+    return time.perf_counter() - start
+
+
+def test_pump_does_not_wait_for_a_blocked_worker():
+    app = make_app()
+    stages = []
+    posted = threading.Event()
+    release = threading.Event()
+
+    def worker():
+        # A connect worker that reports a stage, then blocks (killswitch,
+        # openvpn launch, waiting for the exit) for much longer than a frame
+        app._post(stages.append, "KILLSWITCH")
+        posted.set()
+        release.wait(5)
+        app._post(stages.append, "STARTING")
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    assert posted.wait(5)
+    try:
+        elapsed = max(pump(app) for _ in range(10))
+        assert elapsed < vpn.UI_PUMP_BUDGET * 2
+        assert stages == ["KILLSWITCH"]
+        assert len(app.root.scheduled) == 10
+    finally:
+        release.set()
+        thread.join(5)
+    pump(app)
+    assert stages == ["KILLSWITCH", "STARTING"]
+
+
+def test_pump_stays_within_budget_under_a_flood():
+    app = make_app()
+    handled = []
+
+    def stage(n):
+        # Each callback costs a millisecond of Tk time
+        time.sleep(0.001)
+        handled.append(n)
+
+    producer = threading.Thread(target=lambda: [app._post(stage, n) for n in range(200)])
+    producer.start()
+    producer.join(5)
+    elapsed = max(pump(app) for _ in range(5))
+    # Budget plus the callback running at the deadline (and scheduler slack);
+    # draining the whole backlog would take over 200 ms
+    assert elapsed < vpn.UI_PUMP_BUDGET + 0.02
+    assert 5 <= len(handled) < 200
+    assert handled == sorted(handled)
+    assert all(ms == vpn.UI_FRAME_MS for ms, _ in app.root.scheduled)
+    assert len(app.root.scheduled) == 5
+
+
+def test_pump_reschedules_after_a_failing_callback():
+    app = make_app()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    app._post(fail)
+    try:
+        app._pump_ui_queue()
+    except RuntimeError:
+        pass
+    assert len(app.root.scheduled) == 1